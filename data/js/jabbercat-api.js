@@ -1,19 +1,149 @@
 var api_object = null;
 var account_jid = null;
-var messages_parent = document.getElementById("messages");
+// assigned once the document has been parsed; this script is injected at
+// document creation
+var messages_parent = null;
 var messages = new Array();
+var message_arrival_counter = 0;
 var avatar_addresses = {};
 var message_uid_index = {};
 var marker_owner_index = {};
+var avatar_img_index = {};
+// must match the image widths in core.css
+var BLOCK_AVATAR_SIZE = 48;
+var INLINE_AVATAR_SIZE = 32;
+// the view keeps at least this many messages loaded; others are unloaded
+// once they are far enough above or below the viewport
+var MAX_LOADED_MESSAGES = 500;
+// distance from the viewport (in viewport heights) beyond which content may
+// be unloaded
+var UNLOAD_DISTANCE = 3;
+var HISTORY_PAGE_SIZE = 100;
+var history_request_pending = false;
+var history_exhausted = false;
+// whether messages newer than the loaded ones have been unloaded; live
+// messages are not shown until the view has caught up with the archive
+var newer_unloaded = false;
+var newer_request_pending = false;
+// distance from the bottom (in pixels) within which the view counts as
+// scrolled to the bottom
+var STICK_TO_BOTTOM_TOLERANCE = 16;
+var stuck_to_bottom = true;
+var frame_requested = false;
+var frame_tasks = new Array();
+var dirty_timestamps = new Set();
+var scroll_to_bottom_requested = false;
+var history_check_requested = false;
+// uid of a message to scroll to once older history containing it is loaded
+var pending_jump_uid = null;
+// duration (in milliseconds) of the highlight of a message jumped to
+var JUMP_HIGHLIGHT_DURATION = 2000;
 
-var scroll_to_bottom = function() {
-    // delay to ensure that the DOM has updated already
-    setTimeout(
-        function(){
+/**
+ * All DOM work is funneled through a single animation frame callback.
+ *
+ * Channel events queue their DOM mutations with defer_to_frame; timestamp
+ * updates and scrolling requested during those mutations are coalesced and
+ * carried out once at the end of the frame.
+ *
+ * Animation frames do not run while the page is hidden, which is the case
+ * for conversations which are not shown. The frame then runs from a timer
+ * instead, so that the page stays up to date for snapshots.
+ */
+var request_frame = function() {
+    if (frame_requested) {
+        return;
+    }
+    frame_requested = true;
+    if (document.hidden) {
+        window.setTimeout(run_frame, 0);
+    } else {
+        window.requestAnimationFrame(run_frame);
+    }
+}
+
+var handle_visibility_change = function() {
+    if (document.hidden && frame_requested) {
+        // the animation frame which was requested will not run
+        window.setTimeout(run_frame, 0);
+    }
+}
+
+var defer_to_frame = function(task) {
+    frame_tasks.push(task);
+    request_frame();
+}
+
+var deferred = function(handler) {
+    return function(arg) {
+        defer_to_frame(function() {
+            handler(arg);
+        });
+    };
+}
+
+var run_frame = function() {
+    if (!frame_requested) {
+        // already run from another callback
+        return;
+    }
+    frame_requested = false;
+
+    var tasks = frame_tasks;
+    frame_tasks = new Array();
+    for (var i = 0; i < tasks.length; ++i) {
+        tasks[i]();
+    }
+
+    var timestamps = dirty_timestamps;
+    dirty_timestamps = new Set();
+    timestamps.forEach(function(message) {
+        // the message may have been unloaded in the meantime
+        if (message.isConnected) {
+            update_timestamp_at(message);
+        }
+    });
+
+    if (scroll_to_bottom_requested) {
+        scroll_to_bottom_requested = false;
+        if (stuck_to_bottom) {
             window.scrollTo(0, document.body.scrollHeight);
-        },
-        50
-    );
+        }
+        history_check_requested = true;
+    }
+
+    if (history_check_requested) {
+        history_check_requested = false;
+        maybe_request_older_messages();
+        maybe_request_newer_messages();
+        trim_history();
+    }
+}
+
+var is_at_bottom = function() {
+    if (newer_unloaded) {
+        return false;
+    }
+    return (window.innerHeight + window.scrollY >=
+            document.body.scrollHeight - STICK_TO_BOTTOM_TOLERANCE);
+}
+
+var scroll_to_bottom = function() {
+    scroll_to_bottom_requested = true;
+    request_frame();
+}
+
+/**
+ * Run func and keep the content in the viewport in place even though func
+ * adds or removes content above it.
+ */
+var preserve_scroll_position = function(func) {
+    var height_before = document.body.scrollHeight;
+    func();
+    var delta = document.body.scrollHeight - height_before;
+    if (delta !== 0) {
+        window.scrollBy(0, delta);
+    }
 }
 
 var insertAfter = function(parent, node_to_insert, target) {
@@ -32,28 +162,58 @@ var insertAfter = function(parent, node_to_insert, target) {
     }
 }
 
-var get_prev_message = function(insertion_timestamp) {
-    if (messages.length == 0) {
-        return null;
+var parse_timestamp_value = function(s) {
+    var value = Date.parse(s);
+    if (isNaN(value)) {
+        console.log("failed to parse timestamp "+s);
+        return 0;
     }
-    var prev = null;
-    for (var i = 0; i < messages.length; i++) {
-        var message = messages[i];
-        if (message.dataset.timestamp > insertion_timestamp) {
-            return prev;
+    return value;
+};
+
+/**
+ * Order message items by timestamp; ties are broken by arrival order.
+ */
+var message_compare = function(a, b) {
+    var delta = a.timestamp_value - b.timestamp_value;
+    if (delta !== 0) {
+        return delta;
+    }
+    return a.arrival_seq - b.arrival_seq;
+};
+
+/**
+ * Return the index in `messages` at which message_item belongs.
+ *
+ * Appends at the tail are the common case and are detected without a search;
+ * everything else is a binary search.
+ */
+var find_message_index = function(message_item) {
+    var hi = messages.length;
+    if (hi === 0 || message_compare(messages[hi-1], message_item) <= 0) {
+        return hi;
+    }
+    var lo = 0;
+    while (lo < hi) {
+        var mid = (lo + hi) >>> 1;
+        if (message_compare(messages[mid], message_item) <= 0) {
+            lo = mid + 1;
+        } else {
+            hi = mid;
         }
     }
-    return messages[messages.length-1];
+    return lo;
 };
 
-var autoget_avatar_address = function(address, display_name) {
+var autoget_avatar_address = function(address, display_name, size) {
     var data = avatar_addresses[address];
     if (data === undefined) {
         data = {};
         avatar_addresses[address] = data;
     }
 
-    var url = data[display_name];
+    var key = size + "/" + display_name;
+    var url = data[key];
     if (url !== undefined) {
         return url;
     }
@@ -62,8 +222,10 @@ var autoget_avatar_address = function(address, display_name) {
     params.set("peer", address);
     params.set("nick", display_name);
     params.set("account", account_jid);
+    params.set("size", size);
+    params.set("dpr", window.devicePixelRatio || 1);
     url = "avatar:///?" + params.toString() + "#";
-    data[display_name] = url;
+    data[key] = url;
 
     return url;
 };
@@ -83,9 +245,78 @@ var inc_avatar_epoch = function(address) {
     return true;
 };
 
-var create_avatar_img = function(from_jid, display_name) {
+var register_avatar_img = function(img_el) {
+    var address = img_el.dataset.avatar_address;
+    var imgs = avatar_img_index[address];
+    if (imgs === undefined) {
+        imgs = new Set();
+        avatar_img_index[address] = imgs;
+    }
+    imgs.add(img_el);
+};
+
+var unregister_avatar_img = function(img_el) {
+    var address = img_el.dataset.avatar_address;
+    var imgs = avatar_img_index[address];
+    if (imgs === undefined) {
+        return;
+    }
+    imgs.delete(img_el);
+    if (imgs.size === 0) {
+        delete avatar_img_index[address];
+    }
+};
+
+/**
+ * Remember the URL of an avatar image which has not been created by
+ * create_avatar_img (e.g. restored from a snapshot), so that avatar_changed
+ * updates it.
+ */
+var remember_avatar_url = function(img_el) {
+    var address = img_el.dataset.avatar_address;
+    var data = avatar_addresses[address];
+    if (data === undefined) {
+        data = {};
+        avatar_addresses[address] = data;
+    }
+
+    var key = img_el.dataset.avatar_size + "/" +
+        img_el.dataset.avatar_display_name;
+    if (data[key] === undefined) {
+        data[key] = img_el.getAttribute("src");
+    }
+};
+
+/**
+ * Register all avatar images in the subtree of el with the avatar index.
+ */
+var register_avatar_imgs_in = function(el) {
+    var imgs = el.querySelectorAll("img[data-avatar_address]");
+    for (var i = 0; i < imgs.length; ++i) {
+        register_avatar_img(imgs[i]);
+    }
+};
+
+/**
+ * Remove all avatar images in the subtree of el from the avatar index.
+ *
+ * Must be called whenever a subtree containing avatars is removed from
+ * the document for good.
+ */
+var unregister_avatar_imgs_in = function(el) {
+    var imgs = el.querySelectorAll("img[data-avatar_address]");
+    for (var i = 0; i < imgs.length; ++i) {
+        unregister_avatar_img(imgs[i]);
+    }
+};
+
+var create_avatar_img = function(from_jid, display_name, size) {
     var img_el = document.createElement("img");
-    img_el.src = autoget_avatar_address(from_jid, display_name);
+    img_el.dataset.avatar_address = from_jid;
+    img_el.dataset.avatar_display_name = display_name;
+    img_el.dataset.avatar_size = size;
+    img_el.src = autoget_avatar_address(from_jid, display_name, size);
+    register_avatar_img(img_el);
     return img_el;
 }
 
@@ -117,7 +348,8 @@ var make_message_block = function(first_message) {
     avatar_el.classList.add("avatar");
     avatar_el.appendChild(create_avatar_img(
         first_message.dataset.from_jid,
-        first_message.dataset.display_name
+        first_message.dataset.display_name,
+        BLOCK_AVATAR_SIZE
     ));
     block_el.appendChild(avatar_el);
 
@@ -279,15 +511,9 @@ var block_prepend_message = function(block, msg) {
 };
 
 var insert_message_item = function(message_item) {
-    var prev_msg = get_prev_message(message_item.dataset.timestamp);
-    var next_msg = null;
-    if (prev_msg === null) {
-        if (messages.length > 0) {
-            next_msg = messages[0];
-        }
-    } else {
-        next_msg = message_get_next(prev_msg);
-    }
+    var index = find_message_index(message_item);
+    var prev_msg = index > 0 ? messages[index-1] : null;
+    var next_msg = index < messages.length ? messages[index] : null;
 
     if (prev_msg !== null &&
         prev_msg.dataset.from_jid == message_item.dataset.from_jid &&
@@ -313,12 +539,11 @@ var insert_message_item = function(message_item) {
         }
     }
 
-    if (prev_msg === null) {
-        index = 0;
+    if (index === messages.length) {
+        messages.push(message_item);
     } else {
-        index = messages.indexOf(prev_msg) + 1;
+        messages.splice(index, 0, message_item);
     }
-    messages.splice(index, 0, message_item);
 
     update_timestamps(message_item);
 }
@@ -401,12 +626,16 @@ var update_timestamp_at = function(message) {
     }
 }
 
+var invalidate_timestamp = function(message) {
+    dirty_timestamps.add(message);
+    request_frame();
+};
+
 var update_timestamps = function(start_at) {
-    console.log("updating timestamps starting at "+start_at);
-    update_timestamp_at(start_at);
+    invalidate_timestamp(start_at);
     var next = message_get_next(start_at);
     if (next !== null) {
-        update_timestamp_at(next);
+        invalidate_timestamp(next);
     }
     /* var message = start_at;
     var message_ts, prev_ts;
@@ -506,10 +735,12 @@ var add_attachment = function(message_item, attachment) {
     return null;
 };
 
-var add_message = function(info) {
+var make_message_item = function(info, post_insert_callbacks) {
     var message_item = document.createElement("div");
     message_item.classList.add("message");
     message_item.dataset.timestamp = info.timestamp;
+    message_item.timestamp_value = parse_timestamp_value(info.timestamp);
+    message_item.arrival_seq = message_arrival_counter++;
     message_item.dataset.from_jid = info.from_jid;
     message_item.dataset.from_self = info.from_self;
     message_item.dataset.display_name = info.display_name;
@@ -542,8 +773,6 @@ var add_message = function(info) {
 
     message_uid_index[info.message_uid] = message_item;
 
-    post_insert_callbacks = new Array();
-
     for (var i = 0; i < info.attachments.length; ++i) {
         var attachment = info.attachments[i];
         var cb = add_attachment(message_item, attachment);
@@ -552,7 +781,121 @@ var add_message = function(info) {
         }
     }
 
-    insert_message_item(message_item);
+    return message_item;
+}
+
+/**
+ * Append message items which are not older than any message in the view.
+ *
+ * The blocks are built in a DocumentFragment which is inserted in one go.
+ * The first items are merged into the last block of the view if possible.
+ */
+var append_message_items = function(message_items) {
+    var fragment = document.createDocumentFragment();
+    var tail_block = messages_parent.lastChild;
+    if (tail_block !== null && !toplevel_is_block(tail_block)) {
+        tail_block = null;
+    }
+
+    for (var i = 0; i < message_items.length; ++i) {
+        var message_item = message_items[i];
+        if (tail_block !== null &&
+                tail_block.dataset.from_jid == message_item.dataset.from_jid)
+        {
+            block_append_message(tail_block, message_item);
+        } else {
+            tail_block = make_message_block(message_item);
+            fragment.appendChild(tail_block);
+        }
+        messages.push(message_item);
+    }
+
+    messages_parent.appendChild(fragment);
+
+    for (var i = 0; i < message_items.length; ++i) {
+        invalidate_timestamp(message_items[i]);
+    }
+}
+
+/**
+ * Prepend message items which are older than all messages in the view.
+ *
+ * Like append_message_items, but at the head of the view.
+ */
+var prepend_message_items = function(message_items) {
+    var fragment = document.createDocumentFragment();
+    var head_block = messages_parent.firstChild;
+    if (head_block !== null && !toplevel_is_block(head_block)) {
+        head_block = null;
+    }
+
+    // the trailing items may be merged into the first block of the view
+    var split = message_items.length;
+    if (head_block !== null) {
+        while (split > 0 &&
+                message_items[split-1].dataset.from_jid ==
+                head_block.dataset.from_jid)
+        {
+            split--;
+        }
+    }
+
+    var block = null;
+    for (var i = 0; i < split; ++i) {
+        var message_item = message_items[i];
+        if (block !== null &&
+                block.dataset.from_jid == message_item.dataset.from_jid)
+        {
+            block_append_message(block, message_item);
+        } else {
+            block = make_message_block(message_item);
+            fragment.appendChild(block);
+        }
+    }
+
+    for (var i = message_items.length - 1; i >= split; --i) {
+        block_prepend_message(head_block, message_items[i]);
+    }
+
+    var former_first = messages.length > 0 ? messages[0] : null;
+    messages_parent.insertBefore(fragment, messages_parent.firstChild);
+    messages = message_items.concat(messages);
+
+    for (var i = 0; i < message_items.length; ++i) {
+        invalidate_timestamp(message_items[i]);
+    }
+    if (former_first !== null) {
+        invalidate_timestamp(former_first);
+    }
+}
+
+var add_messages = function(infos) {
+    if (infos.length === 0) {
+        return;
+    }
+    if (newer_unloaded) {
+        // these are requested from the archive with the unloaded messages
+        return;
+    }
+
+    var post_insert_callbacks = new Array();
+    var message_items = new Array();
+    for (var i = 0; i < infos.length; ++i) {
+        message_items.push(make_message_item(infos[i], post_insert_callbacks));
+    }
+
+    // arrival_seq follows the order of infos, so this is a stable sort
+    message_items.sort(message_compare);
+
+    var last_msg = messages.length > 0 ? messages[messages.length-1] : null;
+    if (last_msg === null || message_compare(message_items[0], last_msg) >= 0)
+    {
+        append_message_items(message_items);
+    } else {
+        for (var i = 0; i < message_items.length; ++i) {
+            insert_message_item(message_items[i]);
+        }
+    }
 
     for (var i = 0; i < post_insert_callbacks.length; ++i) {
         var cb = post_insert_callbacks[i];
@@ -562,6 +905,332 @@ var add_message = function(info) {
     scroll_to_bottom();
 }
 
+var maybe_request_older_messages = function(force) {
+    if (history_request_pending || history_exhausted) {
+        return;
+    }
+    if (messages.length === 0) {
+        return;
+    }
+    if (!force && window.scrollY > window.innerHeight) {
+        return;
+    }
+
+    var oldest = messages[0];
+    history_request_pending = true;
+    api_object.request_older_messages(
+        oldest.dataset.timestamp,
+        oldest.dataset.message_uid,
+        HISTORY_PAGE_SIZE
+    );
+}
+
+var older_messages = function(page) {
+    history_request_pending = false;
+    if (page.exhausted) {
+        history_exhausted = true;
+    }
+
+    var infos = page.messages;
+    if (infos.length === 0) {
+        if (pending_jump_uid !== null) {
+            jump_to_message(pending_jump_uid);
+        }
+        return;
+    }
+
+    var post_insert_callbacks = new Array();
+    var message_items = new Array();
+    for (var i = 0; i < infos.length; ++i) {
+        var message_item = make_message_item(infos[i], post_insert_callbacks);
+        if (messages.length > 0 && message_compare(message_item, messages[0]) > 0) {
+            // overlaps with what we have already; should not happen, but
+            // dropping it is better than scrambling the order
+            delete message_uid_index[message_item.dataset.message_uid];
+            continue;
+        }
+        message_items.push(message_item);
+    }
+
+    preserve_scroll_position(function() {
+        prepend_message_items(message_items);
+        for (var i = 0; i < post_insert_callbacks.length; ++i) {
+            var cb = post_insert_callbacks[i];
+            cb();
+        }
+    });
+
+    if (pending_jump_uid !== null) {
+        jump_to_message(pending_jump_uid);
+        return;
+    }
+
+    // keep loading while the loaded history does not fill the viewport
+    maybe_request_older_messages();
+}
+
+var maybe_request_newer_messages = function(force) {
+    if (newer_request_pending || !newer_unloaded) {
+        return;
+    }
+    if (messages.length === 0) {
+        return;
+    }
+    var below = document.body.scrollHeight -
+        (window.scrollY + window.innerHeight);
+    if (!force && below > window.innerHeight) {
+        return;
+    }
+
+    var newest = messages[messages.length-1];
+    newer_request_pending = true;
+    api_object.request_newer_messages(
+        newest.dataset.timestamp,
+        newest.dataset.message_uid,
+        HISTORY_PAGE_SIZE
+    );
+}
+
+var newer_messages = function(page) {
+    newer_request_pending = false;
+    if (page.exhausted) {
+        set_newer_unloaded(false);
+    }
+
+    var infos = page.messages;
+    var post_insert_callbacks = new Array();
+    var message_items = new Array();
+    for (var i = 0; i < infos.length; ++i) {
+        if (message_uid_index[infos[i].message_uid] !== undefined) {
+            continue;
+        }
+        var message_item = make_message_item(infos[i], post_insert_callbacks);
+        if (messages.length > 0 &&
+                message_compare(message_item,
+                                messages[messages.length-1]) < 0)
+        {
+            // see older_messages
+            delete message_uid_index[message_item.dataset.message_uid];
+            continue;
+        }
+        message_items.push(message_item);
+    }
+
+    if (message_items.length > 0) {
+        append_message_items(message_items);
+        for (var i = 0; i < post_insert_callbacks.length; ++i) {
+            var cb = post_insert_callbacks[i];
+            cb();
+        }
+    }
+
+    if (pending_jump_uid !== null) {
+        jump_to_message(pending_jump_uid);
+        return;
+    }
+
+    // keep loading while the loaded history does not fill the viewport
+    maybe_request_newer_messages();
+}
+
+/**
+ * Scroll to the message with the given uid and highlight it.
+ *
+ * If the message is not loaded, older history is requested page by page
+ * until it shows up or the history is exhausted; then the unloaded newer
+ * history is searched.
+ */
+var jump_to_message = function(message_uid) {
+    var msg = message_uid_index[message_uid];
+    if (msg === undefined) {
+        if (messages.length === 0 ||
+                (history_exhausted && !newer_unloaded))
+        {
+            console.log("message to jump to not found: " + message_uid);
+            pending_jump_uid = null;
+            return;
+        }
+        pending_jump_uid = message_uid;
+        if (!history_exhausted) {
+            maybe_request_older_messages(true);
+        } else {
+            maybe_request_newer_messages(true);
+        }
+        return;
+    }
+
+    pending_jump_uid = null;
+    stuck_to_bottom = false;
+    msg.scrollIntoView({block: "center"});
+    msg.classList.add("highlight");
+    window.setTimeout(function() {
+        msg.classList.remove("highlight");
+    }, JUMP_HIGHLIGHT_DURATION);
+}
+
+var unload_toplevel = function(toplevel) {
+    var nmessages = 0;
+    if (toplevel_is_block(toplevel)) {
+        var container = block_get_messages_container(toplevel);
+        for (var i = 0; i < container.children.length; ++i) {
+            var msg = container.children[i];
+            delete message_uid_index[msg.dataset.message_uid];
+            nmessages += 1;
+        }
+    } else if (marker_owner_index[toplevel.dataset.from_jid] === toplevel) {
+        delete marker_owner_index[toplevel.dataset.from_jid];
+    }
+    unregister_avatar_imgs_in(toplevel);
+    messages_parent.removeChild(toplevel);
+    return nmessages;
+}
+
+var set_newer_unloaded = function(value) {
+    newer_unloaded = value;
+    if (value) {
+        stuck_to_bottom = false;
+        // kept in the DOM so that it survives snapshots
+        messages_parent.dataset.newer_unloaded = "true";
+    } else {
+        delete messages_parent.dataset.newer_unloaded;
+    }
+}
+
+/**
+ * Unload the newest content if more than MAX_LOADED_MESSAGES are loaded and
+ * it is far enough below the viewport.
+ *
+ * Returns the number of messages unloaded.
+ */
+var trim_history_below = function() {
+    var limit = (1 + UNLOAD_DISTANCE) * window.innerHeight;
+    var nremoved = 0;
+    var toplevel = messages_parent.lastChild;
+    while (toplevel !== null &&
+            messages.length - nremoved > MAX_LOADED_MESSAGES &&
+            toplevel.getBoundingClientRect().top > limit)
+    {
+        var prev = toplevel_get_prev(toplevel);
+        nremoved += unload_toplevel(toplevel);
+        toplevel = prev;
+    }
+    if (nremoved > 0) {
+        messages.splice(messages.length - nremoved, nremoved);
+        set_newer_unloaded(true);
+    }
+    return nremoved;
+}
+
+/**
+ * Unload the oldest or newest content if more than MAX_LOADED_MESSAGES are
+ * loaded and it is far enough above or below the viewport.
+ *
+ * Unloaded history is requested again from the backend when the user scrolls
+ * back to it.
+ */
+var trim_history = function() {
+    if (messages.length <= MAX_LOADED_MESSAGES) {
+        return;
+    }
+    if (pending_jump_uid !== null) {
+        // the history is being loaded up to the message to jump to
+        return;
+    }
+
+    var limit = -UNLOAD_DISTANCE * window.innerHeight;
+    var nremoved = 0;
+    preserve_scroll_position(function() {
+        var toplevel = messages_parent.firstChild;
+        while (toplevel !== null &&
+                messages.length - nremoved > MAX_LOADED_MESSAGES &&
+                toplevel.getBoundingClientRect().bottom < limit)
+        {
+            var next = toplevel_get_next(toplevel);
+            nremoved += unload_toplevel(toplevel);
+            toplevel = next;
+        }
+        messages.splice(0, nremoved);
+    });
+
+    if (nremoved > 0) {
+        history_exhausted = false;
+        var first = messages.length > 0 ? messages[0] : null;
+        if (first !== null) {
+            invalidate_timestamp(first);
+        }
+    }
+
+    trim_history_below();
+}
+
+/**
+ * Rebuild the indices over the loaded messages from the DOM.
+ */
+var rebuild_indices = function() {
+    messages = Array.prototype.slice.call(
+        messages_parent.querySelectorAll(".message")
+    );
+    message_uid_index = {};
+    for (var i = 0; i < messages.length; ++i) {
+        var msg = messages[i];
+        msg.timestamp_value = parse_timestamp_value(msg.dataset.timestamp);
+        msg.arrival_seq = message_arrival_counter++;
+        message_uid_index[msg.dataset.message_uid] = msg;
+    }
+
+    marker_owner_index = {};
+    var markers = messages_parent.querySelectorAll(".marker");
+    for (var i = 0; i < markers.length; ++i) {
+        var marker = markers[i];
+        marker_owner_index[marker.dataset.from_jid] = marker;
+    }
+
+    avatar_img_index = {};
+    register_avatar_imgs_in(messages_parent);
+    for (var address in avatar_img_index) {
+        avatar_img_index[address].forEach(remember_avatar_url);
+    }
+}
+
+/**
+ * Restore the view from HTML previously obtained through the HTML request.
+ */
+var restore_snapshot = function(html_str) {
+    var container = document.createElement("div");
+    container.innerHTML = html_str;
+    var snapshot_parent = container.querySelector("#messages");
+    if (snapshot_parent === null) {
+        console.log("snapshot without messages container, ignoring");
+        return;
+    }
+
+    unregister_avatar_imgs_in(messages_parent);
+    messages_parent.innerHTML = "";
+    while (snapshot_parent.firstChild !== null) {
+        messages_parent.appendChild(snapshot_parent.firstChild);
+    }
+
+    rebuild_indices();
+    history_request_pending = false;
+    history_exhausted = false;
+    newer_request_pending = false;
+    pending_jump_uid = null;
+    set_newer_unloaded(snapshot_parent.dataset.newer_unloaded === "true");
+    // scrolling to the bottom requests the unloaded newer history, if any
+    stuck_to_bottom = true;
+    scroll_to_bottom();
+}
+
+var handle_scroll = function(event) {
+    stuck_to_bottom = is_at_bottom();
+    history_check_requested = true;
+    request_frame();
+}
+
+var add_message = function(info) {
+    add_messages([info]);
+}
+
 var avatar_changed = function(info) {
     var address = info.address;
     if (!inc_avatar_epoch(address)) {
@@ -569,23 +1238,18 @@ var avatar_changed = function(info) {
         return;
     }
 
-    console.log("avatar changed for "+address);
-    var avatars = document.getElementsByClassName("avatar");
-    for (var i = 0; i < avatars.length; i++) {
-        var avatar = avatars[i];
-        var block = avatar.parentNode;
-        var avatar_address = block.dataset.from_jid;
-        if (avatar_address !== address) {
-            console.log("mismatch: "+address+" !== "+avatar_address);
-            continue;
-        }
-
-        console.log("match!");
-        var display_name = block.dataset.display_name;
-        var img = avatar.children[0];
-        img.src = autoget_avatar_address(address, display_name);
+    var imgs = avatar_img_index[address];
+    if (imgs === undefined) {
+        return;
     }
 
+    imgs.forEach(function(img) {
+        img.src = autoget_avatar_address(
+            address,
+            img.dataset.avatar_display_name,
+            img.dataset.avatar_size
+        );
+    });
 }
 
 var handle_resize = function(event) {
@@ -599,7 +1263,12 @@ var handle_resize = function(event) {
 var make_marker = function(event) {
     var marker_el = document.createElement("div");
     marker_el.classList.add("marker");
-    marker_el.appendChild(create_avatar_img(event.from_jid, event.display_name));
+    marker_el.dataset.from_jid = event.from_jid;
+    marker_el.appendChild(create_avatar_img(
+        event.from_jid,
+        event.display_name,
+        INLINE_AVATAR_SIZE
+    ));
 
     var text_el = document.createElement("span");
     // FIXME: l10n/i18n
@@ -626,7 +1295,9 @@ var block_split_at = function(message_item) {
     var msg_container = block_get_messages_container(block);
     var child = block.firstChild;
     while (child !== null && child !== msg_container) {
-        new_block.appendChild(child.cloneNode(true));
+        var header_el = child.cloneNode(true);
+        register_avatar_imgs_in(header_el);
+        new_block.appendChild(header_el);
         child = child.nextSibling;
     }
 
@@ -675,10 +1346,11 @@ var block_try_join = function(block) {
     while (msg !== null) {
         var next = msg.nextSibling;
         their_container.appendChild(msg);
-        update_timestamp_at(msg);
+        invalidate_timestamp(msg);
         msg = next;
     }
 
+    unregister_avatar_imgs_in(block);
     block.parentNode.removeChild(block);
 
     return prev;
@@ -690,7 +1362,9 @@ var put_marker = function(event) {
 
     var message_item = message_uid_index[event.marked_message_uid];
     if (message_item === undefined) {
+        // the message may have been unloaded from the view
         console.log("marker for unknown uid "+event.marked_message_uid);
+        return;
     }
 
     var marker = marker_owner_index[event.from_jid];
@@ -718,7 +1392,7 @@ var put_marker = function(event) {
 
     var next_block = block_get_next(after_block);
     if (next_block !== null) {
-        update_timestamp_at(block_get_first_message(next_block));
+        invalidate_timestamp(block_get_first_message(next_block));
     }
 }
 
@@ -741,7 +1415,8 @@ var make_presence_item = function(event, is_join) {
     }
     presence_el.appendChild(create_avatar_img(
         event.from_jid,
-        event.display_name
+        event.display_name,
+        INLINE_AVATAR_SIZE
     ));
 
     // FIXME: i18n
@@ -753,66 +1428,177 @@ var make_presence_item = function(event, is_join) {
     return presence_el;
 }
 
-var remove_presence_item = function(presence_item) {
-    var block = presence_item.parentNode;
-    block.removeChild(presence_item);
-    if (block.firstChild === null) {
-        block.parentNode.removeChild(block);
+// presence blocks with more events than this show a summary which can be
+// expanded to the individual events
+var PRESENCE_SUMMARY_THRESHOLD = 5;
+
+// state of the presence blocks, see presence_block_get_state
+var presence_block_states = new WeakMap();
+
+/**
+ * Return the state of a presence block.
+ *
+ * The state holds the events of the block in order, the events of each
+ * occupant (to find the part which a join cancels out) and the counters
+ * shown in the summary. It is only serialised into the DOM when a snapshot
+ * is taken, see store_presence_events.
+ */
+var presence_block_get_state = function(block) {
+    var state = presence_block_states.get(block);
+    if (state === undefined) {
+        state = {
+            events: new Set(),
+            by_jid: new Map(),
+            njoined: 0,
+            nleft: 0,
+        };
+        presence_block_states.set(block, state);
+        // block restored from a snapshot
+        merge_presence_events(state, JSON.parse(block.dataset.events || "[]"));
+        delete block.dataset.events;
     }
+    return state;
 }
 
-var join = function(event) {
-    // FIXME: should probably insert based on timestamp instead of blind
-    // appending
+/**
+ * Merge join and part events into the state of a presence block.
+ *
+ * A join cancels out the preceding part of the same occupant, as this is
+ * only a reconnect.
+ */
+var merge_presence_events = function(state, events) {
+    for (var i = 0; i < events.length; ++i) {
+        var event = events[i];
+        var history = state.by_jid.get(event.from_jid);
+        if (history === undefined) {
+            history = new Array();
+            state.by_jid.set(event.from_jid, history);
+        }
+        if (event.is_join && history.length > 0 &&
+                !history[history.length - 1].is_join)
+        {
+            state.events.delete(history.pop());
+            state.nleft -= 1;
+            continue;
+        }
+        history.push(event);
+        state.events.add(event);
+        if (event.is_join) {
+            state.njoined += 1;
+        } else {
+            state.nleft += 1;
+        }
+    }
+}
 
-    var presence_block_el = messages_parent.lastChild;
-    if (presence_block_el === null ||
-            !toplevel_is_presence_block(presence_block_el))
-    {
-        var presence_block_el = document.createElement("div");
-        presence_block_el.dataset.element_type = "presence-block";
-        presence_block_el.classList.add("presence-block");
+/**
+ * Serialise the events of the presence blocks into the DOM, so that they
+ * survive snapshots.
+ */
+var store_presence_events = function() {
+    var blocks = messages_parent.querySelectorAll(".presence-block");
+    for (var i = 0; i < blocks.length; ++i) {
+        var state = presence_block_states.get(blocks[i]);
+        if (state !== undefined) {
+            blocks[i].dataset.events = JSON.stringify(
+                Array.from(state.events)
+            );
+        }
     }
+}
 
-    var child = presence_block_el.lastChild;
-    while (child !== null && child.dataset.from_jid !== event.from_jid) {
-        child = child.previousSibling;
+var make_presence_summary = function(state) {
+    // FIXME: i18n
+    var parts = new Array();
+    if (state.njoined > 0) {
+        parts.push(state.njoined + " joined");
     }
-    if (child !== null && !child.dataset.is_join) {
-        // annihilate
-        remove_presence_item(child);
+    if (state.nleft > 0) {
+        parts.push(state.nleft + " left");
+    }
+
+    var summary_el = document.createElement("div");
+    summary_el.classList.add("presence-summary");
+    summary_el.innerText = parts.join(", ");
+    return summary_el;
+}
+
+/**
+ * Re-create the contents of a presence block from its state.
+ *
+ * The items of a summarised block are only created while it is expanded.
+ */
+var render_presence_block = function(block) {
+    var state = presence_block_get_state(block);
+    unregister_avatar_imgs_in(block);
+    block.innerHTML = "";
+
+    if (state.events.size === 0) {
+        block.parentNode.removeChild(block);
         return;
     }
 
-    var presence_el = make_presence_item(event, true);
-    presence_block_el.appendChild(presence_el);
+    if (state.events.size > PRESENCE_SUMMARY_THRESHOLD) {
+        block.classList.add("summarised");
+        block.appendChild(make_presence_summary(state));
+        if (!block.classList.contains("expanded")) {
+            return;
+        }
+    } else {
+        block.classList.remove("summarised");
+    }
 
-    messages_parent.appendChild(presence_block_el);
+    var fragment = document.createDocumentFragment();
+    state.events.forEach(function(event) {
+        fragment.appendChild(make_presence_item(event, event.is_join));
+    });
+    block.appendChild(fragment);
+}
 
+var toggle_presence_block = function(block) {
+    block.classList.toggle("expanded");
+    render_presence_block(block);
     scroll_to_bottom();
 }
 
-var part = function(event) {
+var presence = function(batch) {
     // FIXME: should probably insert based on timestamp instead of blind
     // appending
 
+    if (newer_unloaded) {
+        // presence is not archived; it is lost like presence which happened
+        // while the conversation was closed
+        return;
+    }
+
     var presence_block_el = messages_parent.lastChild;
     if (presence_block_el === null ||
             !toplevel_is_presence_block(presence_block_el))
     {
-        var presence_block_el = document.createElement("div");
+        presence_block_el = document.createElement("div");
         presence_block_el.dataset.element_type = "presence-block";
         presence_block_el.classList.add("presence-block");
+        messages_parent.appendChild(presence_block_el);
     }
 
-    var presence_el = make_presence_item(event, false);
-    presence_block_el.appendChild(presence_el);
-
-    messages_parent.appendChild(presence_block_el);
+    merge_presence_events(
+        presence_block_get_state(presence_block_el),
+        batch.events
+    );
+    render_presence_block(presence_block_el);
 
     scroll_to_bottom();
 }
 
+var handle_messages_click = function(event) {
+    var summary = event.target.closest(".presence-summary");
+    if (summary !== null) {
+        defer_to_frame(function() {
+            toggle_presence_block(summary.parentNode);
+        });
+    }
+}
+
 var flag = function(event) {
     var message = message_uid_index[event.flagged_message_uid];
     if (!message) {
@@ -863,13 +1649,20 @@ var flag = function(event) {
 var init = function() {
     account_jid = api_object.account_jid;
     window.document.title = api_object.conversation_jid;
-    api_object.on_message.connect(add_message);
-    api_object.on_avatar_changed.connect(avatar_changed);
-    api_object.on_marker.connect(put_marker);
-    api_object.on_join.connect(join);
-    api_object.on_part.connect(part);
-    api_object.on_flag.connect(flag);
+    api_object.on_message.connect(deferred(add_message));
+    api_object.on_messages.connect(deferred(add_messages));
+    api_object.on_older_messages.connect(deferred(older_messages));
+    api_object.on_newer_messages.connect(deferred(newer_messages));
+    api_object.on_avatar_changed.connect(deferred(avatar_changed));
+    api_object.on_marker.connect(deferred(put_marker));
+    api_object.on_presence.connect(deferred(presence));
+    api_object.on_flag.connect(deferred(flag));
+    api_object.on_restore.connect(deferred(restore_snapshot));
+    api_object.on_jump_to_message.connect(deferred(jump_to_message));
     window.onresize = handle_resize;
+    window.onscroll = handle_scroll;
+    document.addEventListener("visibilitychange", handle_visibility_change);
+    messages_parent.addEventListener("click", handle_messages_click);
     var body = document.body;
     set_font_family(api_object.font_family);
     body.style.fontSize = api_object.font_size;
@@ -879,6 +1672,15 @@ var init = function() {
         set_font_family(new_family);
     });
 
+    api_object.on_account_jid_changed.connect(function(new_jid){
+        // pages are reused for different conversations
+        account_jid = new_jid;
+    });
+
+    api_object.on_conversation_jid_changed.connect(function(new_jid){
+        window.document.title = new_jid;
+    });
+
     api_object.on_font_size_changed.connect(function(new_size){
         console.log("font size changed");
         body.style.fontSize = new_size;
@@ -886,6 +1688,9 @@ var init = function() {
 
     api_object.on_request_html.connect(function() {
         console.log("received HTML request");
+        // apply pending updates right away instead of waiting for the frame
+        run_frame();
+        store_presence_events();
         api_object.push_html(body.innerHTML);
     });
 
@@ -894,7 +1699,16 @@ var init = function() {
     api_object.ready();
 };
 
-new QWebChannel(qt.webChannelTransport, function (channel) {
-    api_object = channel.objects.channel;
-    init();
-});
+var start = function() {
+    messages_parent = document.getElementById("messages");
+    new QWebChannel(qt.webChannelTransport, function (channel) {
+        api_object = channel.objects.channel;
+        init();
+    });
+};
+
+if (document.readyState === "loading") {
+    document.addEventListener("DOMContentLoaded", start);
+} else {
+    start();
+}
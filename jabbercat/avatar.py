@@ -1,7 +1,16 @@
 import abc
 import asyncio
+import collections
+import concurrent.futures
+import enum
 import functools
+import heapq
+import itertools
+import json
 import logging
+import pathlib
+import re
+import time
 import typing
 import unicodedata
 
@@ -10,7 +19,6 @@ import aioxmpp
 import jclib.client
 import jclib.identity
 import jclib.storage
-import jclib.utils
 
 import jabbercat.utils
 
@@ -19,6 +27,15 @@ from . import Qt
 
 BASE_SIZE = 48
 
+#: Width and height in pixels to which decoded avatar images are reduced.
+DECODED_AVATAR_SIZE = BASE_SIZE * 4
+
+#: Avatar image data larger than this many bytes is not decoded.
+MAX_AVATAR_DATA_SIZE = 1024*1024
+
+#: Avatar images wider or higher than this many pixels are not decoded.
+MAX_AVATAR_DIMENSION = 4096
+
 AVATAR_DUMMY_PATH = Qt.QPainterPath()
 AVATAR_DUMMY_PATH.moveTo(2.4732999999999947, 0.006839999999982638)
 AVATAR_DUMMY_PATH.cubicTo(2.3338799999999935, 0.00283999999999196,
@@ -131,9 +148,7 @@ def render_dummy_avatar(font: Qt.QFont,
                         name: str,
                         size: float,
                         colour_text: str=None):
-    colour = jabbercat.utils.text_to_qtcolor(
-        jclib.utils.normalise_text_for_hash(colour_text or name)
-    )
+    colour = jabbercat.utils.text_colours.qtcolor(colour_text or name)
     grapheme = first_grapheme(name)
     picture = Qt.QPicture()
     painter = Qt.QPainter(picture)
@@ -143,6 +158,181 @@ def render_dummy_avatar(font: Qt.QFont,
     return picture
 
 
+class GroupedLRUDict:
+    """
+    LRU mapping which indexes its keys by group.
+
+    :param maxsize: Maximum number of entries.
+    :param group_of: Function returning the group of a key.
+
+    All entries of a group can be removed at once with :meth:`pop_group`.
+    The index shrinks along with the mapping when entries are evicted.
+    """
+
+    def __init__(self, maxsize: int, group_of):
+        super().__init__()
+        self.maxsize = maxsize
+        self._group_of = group_of
+        self._entries = collections.OrderedDict()
+        self._groups = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, key):
+        value = self._entries[key]
+        self._entries.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        self._groups.setdefault(self._group_of(key), set()).add(key)
+        while len(self._entries) > self.maxsize:
+            evicted, _ = self._entries.popitem(last=False)
+            self._unindex(evicted)
+
+    def _unindex(self, key):
+        group = self._group_of(key)
+        keys = self._groups[group]
+        keys.discard(key)
+        if not keys:
+            del self._groups[group]
+
+    def discard(self, key):
+        """
+        Remove `key`, if it is present.
+        """
+        try:
+            del self._entries[key]
+        except KeyError:
+            return
+        self._unindex(key)
+
+    def groups(self) -> typing.List:
+        return list(self._groups)
+
+    def pop_group(self, group):
+        for key in self._groups.pop(group, ()):
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+        self._groups.clear()
+
+
+class DummyAvatarCache:
+    """
+    LRU cache of generated avatars.
+
+    :param maxsize: Maximum number of pictures to keep.
+
+    Pictures are keyed by the grapheme, the text the colour is derived from,
+    the font key and the size. Since the grapheme and the colour only depend
+    on the name and the colour text, most contacts without a real avatar
+    share very few distinct keys.
+
+    All pictures generated for a colour text can be dropped at once with
+    :meth:`invalidate`.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        super().__init__()
+        # grouped by colour text
+        self._cache = GroupedLRUDict(maxsize, lambda key: key[1])
+        self._graphemes = aioxmpp.cache.LRUDict()
+        self._graphemes.maxsize = maxsize
+
+    def _first_grapheme(self, name: str) -> str:
+        try:
+            return self._graphemes[name]
+        except KeyError:
+            pass
+        grapheme = first_grapheme(name)
+        self._graphemes[name] = grapheme
+        return grapheme
+
+    def get(self,
+            font: Qt.QFont,
+            name: str,
+            size: float,
+            colour_text: str=None) -> Qt.QPicture:
+        """
+        Return a generated avatar, rendering it if it is not cached.
+
+        The arguments are the same as for :func:`render_dummy_avatar`.
+        """
+        colour_key = colour_text or name
+        key = (self._first_grapheme(name), colour_key, font.key(), size)
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+
+        if colour_text is None:
+            picture = render_dummy_avatar(font, name, size)
+        else:
+            picture = render_dummy_avatar(font, name, size, colour_text)
+        self._cache[key] = picture
+        return picture
+
+    def invalidate(self, colour_text: str):
+        """
+        Drop all pictures whose colour was derived from `colour_text`.
+        """
+        self._cache.pop_group(colour_text)
+
+    def clear(self):
+        self._cache.clear()
+        self._graphemes.clear()
+
+
+def decode_avatar_image(data: bytes,
+                        size: int = DECODED_AVATAR_SIZE) \
+        -> typing.Optional[Qt.QImage]:
+    """
+    Decode avatar image data and reduce it to fit into `size` pixels.
+
+    Data larger than :data:`MAX_AVATAR_DATA_SIZE` and images larger than
+    :data:`MAX_AVATAR_DIMENSION` are rejected. If the image format reports
+    its dimensions up front, the image is scaled while it is decoded.
+
+    Return :data:`None` if the data is rejected or cannot be decoded.
+
+    This does not use any GUI resources and may be called from a worker
+    thread.
+    """
+    if len(data) > MAX_AVATAR_DATA_SIZE:
+        return None
+
+    buffer_ = Qt.QBuffer()
+    buffer_.setData(data)
+    buffer_.open(Qt.QIODevice.ReadOnly)
+    reader = Qt.QImageReader(buffer_)
+
+    original_size = reader.size()
+    if original_size.isValid():
+        if (original_size.width() > MAX_AVATAR_DIMENSION or
+                original_size.height() > MAX_AVATAR_DIMENSION):
+            return None
+        if original_size.width() > size or original_size.height() > size:
+            reader.setScaledSize(
+                original_size.scaled(size, size, Qt.Qt.KeepAspectRatio)
+            )
+
+    img = reader.read()
+    buffer_.close()
+    if img.isNull():
+        return None
+
+    if img.width() > size or img.height() > size:
+        img = img.scaled(size, size,
+                         Qt.Qt.KeepAspectRatio,
+                         Qt.Qt.SmoothTransformation)
+
+    return img
+
+
 def render_avatar_image(image: Qt.QImage, size: float):
     if image.isNull():
         return None
@@ -168,6 +358,608 @@ def render_avatar_image(image: Qt.QImage, size: float):
     return picture
 
 
+def render_avatar_pixmap(picture: Qt.QPicture,
+                         size: float,
+                         device_pixel_ratio: float) -> Qt.QPixmap:
+    """
+    Rasterise an avatar picture at a logical size and device pixel ratio.
+
+    The picture is assumed to be :data:`BASE_SIZE` logical pixels wide and
+    high and is scaled to fit `size`.
+    """
+    pixel_size = max(round(size * device_pixel_ratio), 1)
+    pixmap = Qt.QPixmap(pixel_size, pixel_size)
+    pixmap.fill(Qt.Qt.transparent)
+
+    painter = Qt.QPainter(pixmap)
+    painter.setRenderHint(Qt.QPainter.Antialiasing, True)
+    painter.setRenderHint(Qt.QPainter.SmoothPixmapTransform, True)
+    scale = pixel_size / BASE_SIZE
+    painter.scale(scale, scale)
+    painter.drawPicture(Qt.QPointF(), picture)
+    painter.end()
+
+    pixmap.setDevicePixelRatio(device_pixel_ratio)
+    return pixmap
+
+
+class AvatarPixmapCache:
+    """
+    LRU cache of rasterised avatars.
+
+    :param maxsize: Maximum number of pixmaps to keep.
+
+    Entries are keyed by ``(account, address, name_surrogate, size,
+    device_pixel_ratio)``. All entries of a peer can be dropped at once with
+    :meth:`invalidate`.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        super().__init__()
+        self._cache = GroupedLRUDict(maxsize, lambda key: key[:2])
+
+    def get(self, key) -> Qt.QPixmap:
+        """
+        Return the pixmap stored under `key`.
+
+        :raises KeyError: if no pixmap is stored under `key`.
+        """
+        return self._cache[key]
+
+    def put(self, key, pixmap: Qt.QPixmap):
+        self._cache[key] = pixmap
+
+    def invalidate(self, account: jclib.identity.Account,
+                   address: aioxmpp.JID):
+        """
+        Drop all pixmaps of a peer.
+        """
+        self._cache.pop_group((account, address))
+
+    def invalidate_account(self, account: jclib.identity.Account):
+        """
+        Drop all pixmaps which were rendered for an account.
+        """
+        for peer_account, address in self._cache.groups():
+            if peer_account == account:
+                self.invalidate(peer_account, address)
+
+    def clear(self):
+        self._cache.clear()
+
+
+class AvatarDiskCache:
+    """
+    Content-addressed on-disk store for avatar image data.
+
+    :param path: Directory in which the images and the index are kept.
+    :param max_size: Maximum total size of the stored image data in bytes.
+
+    Images are stored under their avatar hash (the normalised XEP-0084 or
+    vCard avatar id). An index maps peer addresses to the hash of their most
+    recently seen avatar, so that avatars can be loaded on startup without
+    asking the network.
+
+    When the total size of the images exceeds `max_size`, the least recently
+    used images are evicted.
+
+    The index is only written to disk by :meth:`flush`. Whenever the index
+    changes after a flush, :meth:`on_dirty` is emitted. Loading an image
+    only changes the order of use; that is written along with the next
+    change or by an explicit :meth:`flush`, without emitting
+    :meth:`on_dirty`.
+
+    .. signal:: on_dirty()
+
+        Emits when the in-memory index first differs from the on-disk index.
+    """
+
+    INDEX_NAME = "index.json"
+    HASH_RE = re.compile("[0-9a-f]{8,128}")
+
+    on_dirty = aioxmpp.callbacks.Signal()
+
+    def __init__(self, path: pathlib.Path, max_size: int = 32*1024*1024):
+        super().__init__()
+        self.path = path
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._peers = {}
+        # hash -> addresses of the peers in _peers which use it
+        self._hash_peers = {}
+        self._total_size = 0
+        self._dirty = False
+        self._order_changed = False
+        self.logger = logging.getLogger(
+            ".".join([__name__, type(self).__qualname__])
+        )
+        self._load_index()
+
+    def _image_path(self, hash_: str) -> pathlib.Path:
+        return self.path / hash_[:2] / hash_
+
+    def _load_index(self):
+        try:
+            with (self.path / self.INDEX_NAME).open("r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            self.logger.warning("discarding unreadable avatar cache index: %s",
+                                exc)
+            return
+
+        try:
+            for hash_, size in data["entries"]:
+                if not self.HASH_RE.fullmatch(hash_):
+                    continue
+                self._entries[hash_] = int(size)
+                self._total_size += int(size)
+            for address, hash_ in data["peers"].items():
+                if hash_ is None or hash_ in self._entries:
+                    self._set_peer(address, hash_)
+        except (KeyError, TypeError, ValueError) as exc:
+            self.logger.warning("discarding malformed avatar cache index: %s",
+                                exc)
+            self._entries.clear()
+            self._peers.clear()
+            self._hash_peers.clear()
+            self._total_size = 0
+
+    def _set_peer(self, address: str, hash_: typing.Optional[str]):
+        self._unset_peer(address)
+        self._peers[address] = hash_
+        if hash_ is not None:
+            self._hash_peers.setdefault(hash_, set()).add(address)
+
+    def _unset_peer(self, address: str) -> bool:
+        try:
+            hash_ = self._peers.pop(address)
+        except KeyError:
+            return False
+        if hash_ is not None:
+            addresses = self._hash_peers[hash_]
+            addresses.discard(address)
+            if not addresses:
+                del self._hash_peers[hash_]
+        return True
+
+    def _mark_dirty(self):
+        if self._dirty:
+            return
+        self._dirty = True
+        self.on_dirty()
+
+    def flush(self):
+        """
+        Write the index to disk, if it or the order of use has changed.
+        """
+        if not self._dirty and not self._order_changed:
+            return
+
+        data = {
+            "entries": list(self._entries.items()),
+            "peers": self._peers,
+        }
+
+        index_path = self.path / self.INDEX_NAME
+        tmp_path = index_path.with_suffix(".tmp")
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            with tmp_path.open("w") as f:
+                json.dump(data, f)
+            tmp_path.replace(index_path)
+        except OSError as exc:
+            self.logger.warning("failed to write avatar cache index: %s", exc)
+            return
+
+        self._dirty = False
+        self._order_changed = False
+
+    def lookup_peer(self, address: aioxmpp.JID) -> typing.Optional[str]:
+        """
+        Return the hash of the last known avatar of a peer.
+
+        :raises KeyError: if nothing is known about the peer.
+        :return: The avatar hash or :data:`None` if the peer is known to have
+            no avatar.
+        """
+        return self._peers[str(address)]
+
+    def set_peer_no_avatar(self, address: aioxmpp.JID):
+        """
+        Remember that a peer has no avatar.
+        """
+        if self._peers.get(str(address), False) is None:
+            return
+        self._set_peer(str(address), None)
+        self._mark_dirty()
+
+    def forget_peer(self, address: aioxmpp.JID):
+        """
+        Drop the association of a peer with an avatar.
+
+        The image data itself is kept, since other peers may use the same
+        image and it will be evicted eventually if it is not used anymore.
+        """
+        if self._unset_peer(str(address)):
+            self._mark_dirty()
+
+    def load(self, hash_: str) -> typing.Optional[bytes]:
+        """
+        Return the image data for an avatar hash.
+
+        If no image with that hash is stored, :data:`None` is returned.
+        """
+        if hash_ not in self._entries:
+            return None
+
+        try:
+            data = self._image_path(hash_).read_bytes()
+        except OSError:
+            self._evict_entry(hash_)
+            return None
+
+        self._entries.move_to_end(hash_)
+        self._order_changed = True
+        return data
+
+    def store(self, address: aioxmpp.JID, hash_: str, data: bytes):
+        """
+        Store image data and associate it with a peer.
+
+        Images which are larger than :attr:`max_size` or whose hash does not
+        look like a hash are not stored.
+        """
+        if (not isinstance(hash_, str) or
+                not self.HASH_RE.fullmatch(hash_) or
+                len(data) > self.max_size):
+            return
+
+        if hash_ in self._entries:
+            self._entries.move_to_end(hash_)
+        else:
+            path = self._image_path(hash_)
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_bytes(data)
+            except OSError as exc:
+                self.logger.warning("failed to store avatar %s: %s",
+                                    hash_, exc)
+                return
+            self._entries[hash_] = len(data)
+            self._total_size += len(data)
+
+        self._set_peer(str(address), hash_)
+        self._mark_dirty()
+
+        while self._total_size > self.max_size:
+            self._evict_entry(next(iter(self._entries)))
+
+    def _evict_entry(self, hash_: str):
+        self._total_size -= self._entries.pop(hash_)
+        for address in self._hash_peers.pop(hash_, ()):
+            del self._peers[address]
+        try:
+            self._image_path(hash_).unlink()
+        except OSError:
+            pass
+        self._mark_dirty()
+
+
+class FetchPriority(enum.IntEnum):
+    """
+    Priority of an avatar fetch; lower values are served first.
+
+    .. attribute:: VISIBLE
+
+        The avatar is currently being painted.
+
+    .. attribute:: RECENT
+
+        The avatar was asked for without being painted, for example by a
+        model or a web view which has only recently been shown.
+
+    .. attribute:: BACKGROUND
+
+        The avatar is refreshed because it changed remotely.
+    """
+
+    VISIBLE = 0
+    RECENT = 1
+    BACKGROUND = 2
+
+
+class AvatarFetchScheduler:
+    """
+    Run avatar fetches by priority with per-account concurrency limits.
+
+    :param max_concurrent: Maximum number of fetches running at once.
+    :param max_concurrent_per_account: Maximum number of fetches running at
+        once for a single account; defaults to `max_concurrent`.
+
+    Fetches are identified by ``(account, address)``. Scheduling a key which
+    is already pending only raises its priority if the new priority is
+    higher; scheduling a key which is already running is a no-op. Among
+    fetches of the same priority, the one scheduled first is started first.
+
+    Pending fetches are kept in one heap per account, so that accounts which
+    have reached their limit do not need to be looked at.
+    """
+
+    def __init__(self,
+                 max_concurrent: int = 10,
+                 max_concurrent_per_account: typing.Optional[int] = None):
+        super().__init__()
+        if max_concurrent_per_account is None:
+            max_concurrent_per_account = max_concurrent
+        self.max_concurrent = max_concurrent
+        self.max_concurrent_per_account = max_concurrent_per_account
+        self.logger = logging.getLogger(
+            ".".join([__name__, type(self).__qualname__])
+        )
+        self._counter = itertools.count()
+        # account -> heap of (priority, seq, key)
+        self._heaps = {}
+        # key -> (priority, seq, coroutine_func)
+        self._pending = {}
+        self._running = {}
+        self._running_per_account = collections.Counter()
+
+    def __contains__(self, key):
+        return key in self._pending or key in self._running
+
+    def schedule(self,
+                 account: jclib.identity.Account,
+                 address: aioxmpp.JID,
+                 coroutine_func,
+                 priority: FetchPriority = FetchPriority.BACKGROUND):
+        """
+        Schedule a fetch.
+
+        :param coroutine_func: Called without arguments to obtain the
+            coroutine to run when the fetch is started.
+        :param priority: Priority of the fetch.
+        """
+        key = account, address
+        if key in self._running:
+            return
+
+        try:
+            old_priority, *_ = self._pending[key]
+        except KeyError:
+            pass
+        else:
+            if old_priority <= priority:
+                return
+
+        self._push(key, priority, coroutine_func)
+
+    def reprioritise(self,
+                     account: jclib.identity.Account,
+                     address: aioxmpp.JID,
+                     priority: FetchPriority):
+        """
+        Raise the priority of a pending fetch.
+
+        If no fetch is pending for the key or its priority is already at
+        least `priority`, nothing happens.
+        """
+        key = account, address
+        try:
+            old_priority, _, coroutine_func = self._pending[key]
+        except KeyError:
+            return
+        if old_priority <= priority:
+            return
+
+        self._push(key, priority, coroutine_func)
+
+    def _push(self, key, priority, coroutine_func):
+        entry = (priority, next(self._counter), coroutine_func)
+        self._pending[key] = entry
+        heapq.heappush(self._heaps.setdefault(key[0], []),
+                       (entry[0], entry[1], key))
+        self._pump()
+
+    def _peek(self, account):
+        """
+        Return the next pending entry of an account or :data:`None`.
+
+        Entries of cancelled or reprioritised fetches are dropped on the way.
+        """
+        heap = self._heaps[account]
+        while heap:
+            priority, seq, key = heap[0]
+            entry = self._pending.get(key)
+            if entry is not None and entry[:2] == (priority, seq):
+                return heap[0]
+            heapq.heappop(heap)
+        del self._heaps[account]
+        return None
+
+    def _pump(self):
+        while len(self._running) < self.max_concurrent:
+            best = None
+            for account in list(self._heaps):
+                if (self._running_per_account[account] >=
+                        self.max_concurrent_per_account):
+                    continue
+                head = self._peek(account)
+                if head is not None and (best is None or head < best):
+                    best = head
+
+            if best is None:
+                # nothing pending or all accounts with pending fetches are
+                # at their limit
+                break
+
+            _, _, key = heapq.heappop(self._heaps[best[2][0]])
+            entry = self._pending.pop(key)
+            self._start(key, entry[2])
+
+    def _start(self, key, coroutine_func):
+        account, _ = key
+        task = asyncio.ensure_future(coroutine_func())
+        self._running[key] = task
+        self._running_per_account[account] += 1
+        task.add_done_callback(functools.partial(self._task_done, key))
+
+    def _forget_running(self, key):
+        account, _ = key
+        del self._running[key]
+        self._running_per_account[account] -= 1
+        if not self._running_per_account[account]:
+            del self._running_per_account[account]
+
+    def _task_done(self, key, task):
+        if self._running.get(key) is task:
+            self._forget_running(key)
+
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.warning("background job failed",
+                                exc_info=task.exception())
+
+        self._pump()
+
+    def cancel_account(self, account: jclib.identity.Account):
+        """
+        Drop pending fetches and cancel running fetches of an account.
+        """
+        for key in list(self._pending):
+            if key[0] == account:
+                del self._pending[key]
+        self._heaps.pop(account, None)
+
+        for key, task in list(self._running.items()):
+            if key[0] == account:
+                self._forget_running(key)
+                task.cancel()
+
+    def close(self):
+        """
+        Drop all pending fetches and cancel all running fetches.
+        """
+        self._pending.clear()
+        self._heaps.clear()
+        for key, task in list(self._running.items()):
+            self._forget_running(key)
+            task.cancel()
+
+
+NegativeCacheEntry = collections.namedtuple(
+    "NegativeCacheEntry",
+    ["account", "address", "failures", "retry_in", "reason"],
+)
+
+
+class NegativeAvatarCache:
+    """
+    Remember failed avatar fetches and back off from retrying them.
+
+    :param ttl: Time in seconds during which a peer is not asked again after
+        its first failure.
+    :param max_ttl: Upper bound for the backoff time in seconds.
+    :param maxsize: Maximum number of peers to remember.
+
+    Each consecutive failure of a peer doubles the time until the next
+    attempt, up to `max_ttl`. A success or :meth:`forget` removes the peer;
+    :meth:`reset` allows an immediate retry, but keeps the peer in the cache
+    until that retry succeeds.
+
+    Entries are keyed by ``(account, address)``. :meth:`entries` returns the
+    current state for diagnostic purposes.
+    """
+
+    def __init__(self,
+                 ttl: float = 60.0,
+                 max_ttl: float = 3600.0,
+                 maxsize: int = 4096):
+        super().__init__()
+        self.ttl = ttl
+        self.max_ttl = max_ttl
+        self.maxsize = maxsize
+        # key -> (failures, expires_at, reason)
+        self._entries = collections.OrderedDict()
+
+    def record_failure(self, key, reason: str):
+        """
+        Record a failed fetch for `key`, extending its backoff.
+        """
+        failures, *_ = self._entries.pop(key, (0,))
+        failures += 1
+        delay = min(self.ttl * 2 ** (failures - 1), self.max_ttl)
+        self._entries[key] = failures, time.monotonic() + delay, reason
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def record_success(self, key):
+        """
+        Record a successful fetch for `key`, resetting its backoff.
+        """
+        self._entries.pop(key, None)
+
+    forget = record_success
+
+    def reset(self, key):
+        """
+        Reset the backoff of `key`, if it has failed before.
+
+        The key is not blocked afterwards, but it stays in the cache (with
+        zero failures) until :meth:`record_success` or :meth:`forget` is
+        called.
+        """
+        try:
+            _, _, reason = self._entries[key]
+        except KeyError:
+            return
+        self._entries[key] = 0, time.monotonic(), reason
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def forget_account(self, account: jclib.identity.Account):
+        for key in list(self._entries):
+            if key[0] == account:
+                del self._entries[key]
+
+    def failures(self, key) -> int:
+        """
+        Return the number of consecutive failures recorded for `key`.
+        """
+        try:
+            failures, *_ = self._entries[key]
+        except KeyError:
+            return 0
+        return failures
+
+    def is_blocked(self, key) -> bool:
+        """
+        Return whether fetches for `key` should currently not be attempted.
+        """
+        try:
+            _, expires_at, _ = self._entries[key]
+        except KeyError:
+            return False
+        return time.monotonic() < expires_at
+
+    def entries(self) -> typing.List[NegativeCacheEntry]:
+        """
+        Return a snapshot of the remembered failures.
+
+        The `retry_in` field is the number of seconds until the next attempt
+        is allowed; it is zero or negative for peers whose backoff has
+        expired.
+        """
+        now = time.monotonic()
+        return [
+            NegativeCacheEntry(account, address, failures,
+                               expires_at - now, reason)
+            for (account, address), (failures, expires_at, reason)
+            in self._entries.items()
+        ]
+
+
 class XMPPAvatarProvider:
     """
     .. signal:: on_avatar_changed(address)
@@ -176,14 +968,34 @@ class XMPPAvatarProvider:
 
         The image needs to be fetched separately and explicitly.
 
+    If a :class:`AvatarDiskCache` is given, image data is looked up there by
+    hash before it is requested from the network and fetched images are
+    stored in it. Metadata notifications which carry the hash of the avatar
+    which is already known for a peer do not cause :meth:`on_avatar_changed`
+    to emit.
+
+    If a :class:`NegativeAvatarCache` is given, failed fetches are recorded
+    there and their results are not cached, so that they are retried once
+    the backoff has expired. Metadata notifications reset the backoff (see
+    :meth:`NegativeAvatarCache.reset`).
+
+    Image data is decoded with :func:`decode_avatar_image` on `executor`
+    (the default executor of the event loop if it is :data:`None`).
     """
 
     on_avatar_changed = aioxmpp.callbacks.Signal()
 
-    def __init__(self, account: jclib.identity.Account):
+    def __init__(self,
+                 account: jclib.identity.Account,
+                 disk_cache: typing.Optional[AvatarDiskCache]=None,
+                 negative_cache: typing.Optional[NegativeAvatarCache]=None,
+                 executor: typing.Optional[concurrent.futures.Executor]=None):
         super().__init__()
         self.__tokens = []
         self._account = account
+        self._disk_cache = disk_cache
+        self._negative_cache = negative_cache
+        self._executor = executor
         self._avatar_svc = None
         self._cache = aioxmpp.cache.LRUDict()
         self._cache.maxsize = 1024
@@ -207,8 +1019,62 @@ class XMPPAvatarProvider:
         self._avatar_svc = None
 
     def _on_metadata_changed(self, jid, metadata):
+        if self._negative_cache is not None:
+            self._negative_cache.reset((self._account, jid))
+
+        if self._disk_cache is not None:
+            hashes = {descriptor.normalized_id for descriptor in metadata}
+            try:
+                known_hash = self._disk_cache.lookup_peer(jid)
+            except KeyError:
+                pass
+            else:
+                if known_hash in hashes or (known_hash is None and
+                                            not hashes):
+                    return
+                self._disk_cache.forget_peer(jid)
+
         self.on_avatar_changed(jid)
 
+    def _record_failure(self, address: aioxmpp.JID, reason: str):
+        if self._negative_cache is not None:
+            self._negative_cache.record_failure((self._account, address),
+                                                reason)
+
+    @asyncio.coroutine
+    def _decode(self, data: bytes) -> typing.Optional[Qt.QImage]:
+        loop = asyncio.get_event_loop()
+        return (yield from loop.run_in_executor(
+            self._executor,
+            decode_avatar_image,
+            data,
+        ))
+
+    @asyncio.coroutine
+    def _load_from_disk_cache(self, address: aioxmpp.JID) \
+            -> typing.Tuple[bool, typing.Optional[Qt.QImage]]:
+        if self._disk_cache is None:
+            return False, None
+
+        try:
+            hash_ = self._disk_cache.lookup_peer(address)
+        except KeyError:
+            return False, None
+
+        if hash_ is None:
+            return True, None
+
+        data = self._disk_cache.load(hash_)
+        if data is None:
+            return False, None
+
+        img = yield from self._decode(data)
+        if img is None:
+            self._disk_cache.forget_peer(address)
+            return False, None
+
+        return True, img
+
     @asyncio.coroutine
     def _get_image(self, address: aioxmpp.JID) -> typing.Optional[Qt.QImage]:
         try:
@@ -217,25 +1083,55 @@ class XMPPAvatarProvider:
                 aioxmpp.errors.ErroneousStanza) as exc:
             self.logger.warning("cannot fetch avatar from %s: %s",
                                 address, exc)
+            self._record_failure(address, str(exc))
             return
 
         for descriptor in metadata:
-            try:
-                data = yield from descriptor.get_image_bytes()
-            except (NotImplementedError, RuntimeError,
-                    aioxmpp.errors.XMPPCancelError):
-                continue
-            img = Qt.QImage.fromData(data)
-            if not img.isNull():
+            data = None
+            if self._disk_cache is not None:
+                data = self._disk_cache.load(descriptor.normalized_id)
+
+            if data is None:
+                try:
+                    data = yield from descriptor.get_image_bytes()
+                except (NotImplementedError, RuntimeError,
+                        aioxmpp.errors.XMPPCancelError):
+                    continue
+
+            img = yield from self._decode(data)
+            if img is not None:
+                if self._disk_cache is not None:
+                    self._disk_cache.store(address,
+                                           descriptor.normalized_id,
+                                           data)
                 return img
 
+        if not metadata:
+            if self._disk_cache is not None:
+                self._disk_cache.set_peer_no_avatar(address)
+        else:
+            self._record_failure(address, "no usable avatar image")
+
     @asyncio.coroutine
     def fetch_avatar(self, address: aioxmpp.JID) \
             -> typing.Optional[Qt.QPicture]:
         """
         Fetch an avatar and wrap it in a QPicture.
+
+        If the disk cache knows the current avatar of the peer, the network is
+        not used. Failed fetches are not cached.
         """
-        img = yield from self._get_image(address)
+        key = self._account, address
+        known, img = yield from self._load_from_disk_cache(address)
+        if not known:
+            if self._negative_cache is None:
+                img = yield from self._get_image(address)
+            else:
+                failures = self._negative_cache.failures(key)
+                img = yield from self._get_image(address)
+                if self._negative_cache.failures(key) > failures:
+                    return None
+                self._negative_cache.record_success(key)
         if img is None:
             self._cache[address] = None
             return None
@@ -268,10 +1164,11 @@ class RosterNameAvatarProvider:
 
     on_avatar_changed = aioxmpp.callbacks.Signal()
 
-    def __init__(self):
+    def __init__(self, dummy_cache: typing.Optional[DummyAvatarCache]=None):
         super().__init__()
         self.__tokens = []
         self._roster_svc = None
+        self._dummy_cache = dummy_cache or DummyAvatarCache()
 
     def __connect(self, signal, handler):
         _connect(self.__tokens, signal, handler)
@@ -311,10 +1208,10 @@ class RosterNameAvatarProvider:
             return
         if name is None:
             return
-        return render_dummy_avatar(font, name, BASE_SIZE,
-                                   str(address))
+        return self._dummy_cache.get(font, name, BASE_SIZE, str(address))
 
     def _on_entry_updated(self, item):
+        self._dummy_cache.invalidate(str(item.jid))
         self.on_avatar_changed(item.jid)
 
 
@@ -335,33 +1232,59 @@ class AvatarManager:
                  client: jclib.client.Client,
                  writeman: jclib.storage.WriteManager):
         super().__init__()
-        self._queue = asyncio.Queue()
-        self._enqueued = set()
-        self._workers = [
-            asyncio.ensure_future(self._worker())
-            for i in range(10)
-        ]
+        self._writeman = writeman
+        self._disk_cache = AvatarDiskCache(self.get_disk_cache_path())
+        self._disk_cache.on_dirty.connect(self._disk_cache_dirty)
+        writeman.on_writeback.connect(self._writeback)
+        # a login burst of one account must not take all the slots
+        self._scheduler = AvatarFetchScheduler(
+            max_concurrent=10,
+            max_concurrent_per_account=4,
+        )
+        self._negative_cache = NegativeAvatarCache()
+        self._decode_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=2,
+        )
         self.logger = logging.getLogger(
             ".".join([__name__, type(self).__qualname__])
         )
 
         self.__accountmap = {}
+        self._pixmap_cache = AvatarPixmapCache()
+        self._dummy_cache = DummyAvatarCache()
 
         client.on_client_prepare.connect(self._prepare_client)
         client.on_client_stopped.connect(self._shutdown_client)
 
     def close(self):
-        for worker in self._workers:
-            worker.cancel()
+        self._scheduler.close()
+        self._decode_executor.shutdown(wait=False)
+        self._disk_cache.flush()
+
+    @staticmethod
+    def get_disk_cache_path() -> pathlib.Path:
+        return pathlib.Path(Qt.QStandardPaths.writableLocation(
+            Qt.QStandardPaths.CacheLocation
+        )) / "avatars"
+
+    def _disk_cache_dirty(self):
+        self._writeman.request_writeback()
 
     @asyncio.coroutine
-    def _worker(self):
-        while True:
-            task = yield from self._queue.get()
-            try:
-                yield from task
-            except Exception as exc:
-                self.logger.warning("background job failed", exc_info=True)
+    def _writeback(self):
+        self._disk_cache.flush()
+
+    @property
+    def negative_cache(self) -> NegativeAvatarCache:
+        """
+        The :class:`NegativeAvatarCache` of failed fetches.
+
+        Its :attr:`~NegativeAvatarCache.ttl` and
+        :attr:`~NegativeAvatarCache.max_ttl` can be adjusted and
+        :meth:`~NegativeAvatarCache.entries` lists the peers which are
+        currently backed off.
+        """
+        return self._negative_cache
 
     def get_avatar_font(self):
         return Qt.QFontDatabase.systemFont(
@@ -376,41 +1299,52 @@ class AvatarManager:
         except asyncio.TimeoutError:
             self.logger.info("failed to fetch avatar for %s (timeout)",
                              address)
+            self._negative_cache.record_failure((account, address),
+                                                "timeout")
+        # on failure, the avatar has not changed, but the pixmaps are dropped
+        # anyway so that cache hits do not keep the retry from happening
+        self._pixmap_cache.invalidate(account, address)
+        if (account, address) in self._negative_cache:
             return
-        finally:
-            self._enqueued.discard((account, address))
         self.logger.debug("avatar for %s fetched", address)
         self.on_avatar_changed(account, address)
 
-    def _fetch_in_background(self, account, provider, address):
-        key = account, address
-        if key in self._enqueued:
+    def _fetch_in_background(self, account, provider, address,
+                             priority=FetchPriority.BACKGROUND):
+        if self._negative_cache.is_blocked((account, address)):
             return
-        self._enqueued.add(key)
-        self._queue.put_nowait(
-            self._fetch_avatar_and_emit_signal(
+        self._scheduler.schedule(
+            account,
+            address,
+            functools.partial(
+                self._fetch_avatar_and_emit_signal,
                 provider.fetch_avatar,
                 account,
                 address,
-            )
+            ),
+            priority,
         )
 
     def get_avatar(self,
                    account: jclib.identity.Account,
                    address: aioxmpp.JID,
-                   name_surrogate: typing.Optional[str]=None) -> Qt.QPicture:
+                   name_surrogate: typing.Optional[str]=None,
+                   priority: FetchPriority=FetchPriority.RECENT) \
+            -> Qt.QPicture:
         """
         Return an avatar for an entity.
 
         :param address: Jabber address of the entity to return an avatar for.
         :param name_surrogate: Optional name surrogate to use in case no human
             readable name for the entity is known.
+        :param priority: Priority of the background fetch, if one is needed.
 
         If no avatar is available in the cache, a null avatar or a generated
         one is returned instead and an attempt is made to obtain the avatar
         from the remote entity (if there is one available). Once the avatar
         has been fetched in the background, the usual :meth:`on_avatar_changed`
-        signal will be emitted.
+        signal will be emitted. Asking again for an avatar whose fetch is still
+        queued raises the priority of the fetch if `priority` is higher.
 
         If `name_surrogate` is given and no human-readable display name is
         known for the `address`, the `name_surrogate` is used instead of the
@@ -424,8 +1358,15 @@ class AvatarManager:
             try:
                 result = xmpp_avatar.get_avatar(address)
             except KeyError:
-                self._fetch_in_background(account, xmpp_avatar, address)
                 result = None
+                fetch = True
+            else:
+                # the last fetch failed, retry once the backoff has expired
+                fetch = (account, address) in self._negative_cache
+
+            if fetch:
+                self._fetch_in_background(account, xmpp_avatar, address,
+                                          priority)
 
             if result is not None:
                 return result
@@ -435,9 +1376,51 @@ class AvatarManager:
             if result is not None:
                 return result
 
-        return render_dummy_avatar(font,
-                                   name_surrogate or str(address),
-                                   BASE_SIZE)
+        return self._dummy_cache.get(font,
+                                     name_surrogate or str(address),
+                                     BASE_SIZE)
+
+    def get_avatar_pixmap(self,
+                          account: jclib.identity.Account,
+                          address: aioxmpp.JID,
+                          size: float,
+                          device_pixel_ratio: float,
+                          name_surrogate: typing.Optional[str]=None,
+                          priority: FetchPriority=FetchPriority.VISIBLE) \
+            -> Qt.QPixmap:
+        """
+        Return a rasterised avatar for an entity.
+
+        :param size: Logical width and height of the avatar.
+        :param device_pixel_ratio: Device pixel ratio of the paint device the
+            avatar will be drawn on.
+
+        This works like :meth:`get_avatar`, but returns a :class:`QPixmap`
+        of the requested size. Pixmaps are cached until
+        :meth:`on_avatar_changed` emits for the entity. Pixmaps of entities
+        whose last fetch failed are not cached, so that the fetch is retried
+        once its backoff has expired.
+
+        Since this is meant to be called while painting, `priority` defaults
+        to :attr:`FetchPriority.VISIBLE`.
+        """
+        key = account, address, name_surrogate, size, device_pixel_ratio
+        try:
+            pixmap = self._pixmap_cache.get(key)
+        except KeyError:
+            pass
+        else:
+            self._scheduler.reprioritise(account, address, priority)
+            return pixmap
+
+        pixmap = render_avatar_pixmap(
+            self.get_avatar(account, address, name_surrogate, priority),
+            size,
+            device_pixel_ratio,
+        )
+        if (account, address) not in self._negative_cache:
+            self._pixmap_cache.put(key, pixmap)
+        return pixmap
 
     def _on_xmpp_avatar_changed(self,
                                 account: jclib.identity.Account,
@@ -445,26 +1428,31 @@ class AvatarManager:
                                 address: aioxmpp.JID):
         # first check if the current avatar is in cache, otherwise don’t bother
         # to fetch it
-        # if it is in cache, add a task to the queue to fetch it
+        # if it is in cache or its last fetch failed, add a task to the queue
+        # to fetch it
         try:
             service.get_avatar(address)
         except KeyError:
-            return
+            if (account, address) not in self._negative_cache:
+                return
 
         self._fetch_in_background(account, service, address)
 
     def _on_backend_avatar_changed(self,
                                    account: jclib.identity.Account,
                                    address: aioxmpp.JID):
+        self._pixmap_cache.invalidate(account, address)
         self.on_avatar_changed(account, address)
 
     def _prepare_client(self,
                         account: jclib.identity.Account,
                         client: jclib.client.Client):
-        xmpp_avatar = XMPPAvatarProvider(account)
+        xmpp_avatar = XMPPAvatarProvider(account, self._disk_cache,
+                                         self._negative_cache,
+                                         self._decode_executor)
         xmpp_avatar.prepare_client(client)
 
-        generator = RosterNameAvatarProvider()
+        generator = RosterNameAvatarProvider(self._dummy_cache)
         generator.prepare_client(client)
 
         tokens = []
@@ -475,9 +1463,13 @@ class AvatarManager:
                                    account, xmpp_avatar))
 
         self.__accountmap[account] = tokens, generator, xmpp_avatar
+        self._pixmap_cache.invalidate_account(account)
 
     def _shutdown_client(self,
                          account: jclib.identity.Account,
                          client: jclib.client.Client):
         tokens, *_ = self.__accountmap.pop(account)
         _disconnect_all(tokens)
+        self._scheduler.cancel_account(account)
+        self._negative_cache.forget_account(account)
+        self._pixmap_cache.invalidate_account(account)
@@ -0,0 +1,209 @@
+"""
+Nickname completion for conversations.
+"""
+import collections
+import heapq
+import itertools
+import typing
+
+from . import Qt, models
+
+
+class _TrieNode:
+    __slots__ = ("children", "values")
+
+    def __init__(self):
+        self.children = {}
+        self.values = collections.Counter()
+
+
+class PrefixTrie:
+    """
+    Case-insensitive prefix trie mapping texts to values.
+
+    A value may be added several times under the same text; it is only
+    removed from the trie once it has been removed as often.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._root = _TrieNode()
+
+    def add(self, text: str, value):
+        node = self._root
+        for ch in text.casefold():
+            try:
+                node = node.children[ch]
+            except KeyError:
+                new_node = _TrieNode()
+                node.children[ch] = new_node
+                node = new_node
+        node.values[value] += 1
+
+    def remove(self, text: str, value):
+        """
+        Remove one occurrence of `value` under `text`.
+
+        :raises KeyError: if `value` is not in the trie under `text`.
+        """
+        path = []
+        node = self._root
+        for ch in text.casefold():
+            path.append((node, ch))
+            node = node.children[ch]
+
+        if node.values.get(value, 0) <= 0:
+            raise KeyError(value)
+
+        node.values[value] -= 1
+        if node.values[value] == 0:
+            del node.values[value]
+
+        # prune nodes which have become empty
+        for parent, ch in reversed(path):
+            if node.values or node.children:
+                break
+            del parent.children[ch]
+            node = parent
+
+    def iter_prefix(self, prefix: str) -> typing.Iterator:
+        """
+        Iterate over the distinct values whose text starts with `prefix`.
+        """
+        node = self._root
+        for ch in prefix.casefold():
+            try:
+                node = node.children[ch]
+            except KeyError:
+                return
+
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            yield from node.values
+            stack.extend(node.children.values())
+
+    def clear(self):
+        self._root = _TrieNode()
+
+
+class NickCompletionIndex:
+    """
+    Index of the nicknames in a member list for completion.
+
+    :param members: The member list to follow.
+    :type members: :class:`~.conversation.MemberList`
+
+    The index is updated incrementally from the signals of the member list.
+    Completions are ranked by how recently the member last spoke (see
+    :meth:`note_speaker`) and then alphabetically.
+    """
+
+    def __init__(self, members):
+        super().__init__()
+        self._members = members
+        self._trie = PrefixTrie()
+        self._label_members = {}
+        self._last_spoke = {}
+        self._clock = itertools.count(1)
+
+        members.on_member_added.connect(self._member_added)
+        members.on_member_removed.connect(self._member_removed)
+        members.on_member_renamed.connect(self._member_renamed)
+        members.on_reset.connect(self._reset)
+        self._reset()
+
+    def _add_member(self, member, label):
+        self._trie.add(label, label)
+        self._label_members.setdefault(label, []).append(member)
+
+    def _remove_member(self, member, label):
+        try:
+            members = self._label_members[label]
+            members.remove(member)
+        except (KeyError, ValueError):
+            return
+        self._trie.remove(label, label)
+        if not members:
+            del self._label_members[label]
+            self._last_spoke.pop(label, None)
+
+    def _member_added(self, member, label):
+        self._add_member(member, label)
+
+    def _member_removed(self, member, label):
+        self._remove_member(member, label)
+
+    def _member_renamed(self, member, old_label, new_label):
+        last_spoke = self._last_spoke.get(old_label)
+        self._remove_member(member, old_label)
+        self._add_member(member, new_label)
+        if last_spoke is not None:
+            self._last_spoke[new_label] = last_spoke
+
+    def _reset(self):
+        self._trie.clear()
+        self._label_members.clear()
+        for member, label in self._members.labelled_members():
+            self._add_member(member, label)
+        for label in list(self._last_spoke):
+            if label not in self._label_members:
+                del self._last_spoke[label]
+
+    def note_speaker(self, label: str):
+        """
+        Record that the member with the nickname `label` has spoken.
+        """
+        if label in self._label_members:
+            self._last_spoke[label] = next(self._clock)
+
+    def complete(self, prefix: str, limit: int) \
+            -> typing.List[typing.Tuple[str, object]]:
+        """
+        Return the best `limit` nicknames starting with `prefix`.
+
+        :return: Pairs of nickname and member.
+        """
+        labels = heapq.nsmallest(
+            limit,
+            self._trie.iter_prefix(prefix),
+            key=lambda label: (-self._last_spoke.get(label, 0),
+                               label.casefold(),
+                               label),
+        )
+        return [(label, self._label_members[label][0]) for label in labels]
+
+
+class NickCompletionModel(Qt.QAbstractListModel):
+    """
+    List model holding the current completions only.
+
+    The member of a completion is available as :data:`~.models.ROLE_OBJECT`.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._completions = []
+
+    def set_completions(self,
+                        completions: typing.List[typing.Tuple[str, object]]):
+        if completions == self._completions:
+            return
+        self.beginResetModel()
+        self._completions = list(completions)
+        self.endResetModel()
+
+    def rowCount(self, parent=Qt.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._completions)
+
+    def data(self, index, role=Qt.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        label, member = self._completions[index.row()]
+        if role == Qt.Qt.DisplayRole or role == Qt.Qt.EditRole:
+            return label
+        elif role == models.ROLE_OBJECT:
+            return member
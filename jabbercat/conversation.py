@@ -1,9 +1,12 @@
 import asyncio
+import bisect
+import collections
 import functools
 import html
 import logging
 import re
 import pathlib
+import typing
 import urllib.parse
 
 from datetime import datetime, timedelta
@@ -12,6 +15,8 @@ import lxml.builder
 import lxml.etree
 
 import aioxmpp
+import aioxmpp.cache
+import aioxmpp.callbacks
 import aioxmpp.im.conversation
 import aioxmpp.im.p2p
 import aioxmpp.im.service
@@ -26,11 +31,12 @@ import jclib.identity
 import jclib.instrumentable_list
 import jclib.metadata
 import jclib.roster
-import jclib.utils
 
 import jabbercat.avatar
 
-from . import Qt, utils, models, avatar, emoji, model_adaptor
+from . import (
+    Qt, utils, models, avatar, emoji, model_adaptor, search, completion,
+)
 from .widgets import messageinput, member_list
 
 from .ui import p2p_conversation
@@ -45,15 +51,89 @@ def _connect_and_store_token(tokens, signal, handler):
     )
 
 
+def _member_sort_key(label: str):
+    return label.casefold(), label
+
+
+def _member_label(member) -> str:
+    return getattr(member, "nick", None) or str(member.conversation_jid)
+
+
 class MemberList(jclib.instrumentable_list.ModelListView):
+    """
+    List of the members of a conversation, sorted by their nickname.
+
+    The sort key of each member is kept in a list parallel to the members,
+    so that members are located by bisection instead of a linear search.
+    Nickname changes move the member to its new row with a single move.
+
+    In addition to the model list signals, changes are reported with the
+    labels (nicknames) of the members.
+
+    .. signal:: on_member_added(member, label)
+
+    .. signal:: on_member_removed(member, label)
+
+    .. signal:: on_member_renamed(member, old_label, new_label)
+
+    .. signal:: on_reset()
+
+        Emits when the list has been cleared or filled at once.
+    """
+
+    on_member_added = aioxmpp.callbacks.Signal()
+    on_member_removed = aioxmpp.callbacks.Signal()
+    on_member_renamed = aioxmpp.callbacks.Signal()
+    on_reset = aioxmpp.callbacks.Signal()
+
     def __init__(self):
         self._backend = jclib.instrumentable_list.ModelList()
         super().__init__(self._backend)
         self._conversation = None
         self._tokens = []
+        self._keys = []
+        self._key_map = {}
+
+    def _populate(self, members):
+        keyed = sorted(
+            ((_member_sort_key(_member_label(member)), member)
+             for member in members),
+            key=lambda x: x[0],
+        )
+        self._clear()
+        self._keys = [key for key, _ in keyed]
+        self._key_map = {member: key for key, member in keyed}
+        if keyed:
+            # a single insertion of all rows
+            self._backend.extend([member for _, member in keyed])
+        self.on_reset()
+
+    def _clear(self):
+        if self._backend:
+            self._backend.clear()
+        self._keys.clear()
+        self._key_map.clear()
+
+    def labels(self) -> typing.Iterator[str]:
+        """
+        Iterate over the labels of the members, in order.
+        """
+        return (label for _, label in self._keys)
+
+    def labelled_members(self) -> typing.Iterator[typing.Tuple[object, str]]:
+        """
+        Iterate over pairs of member and label, in order.
+        """
+        return zip(self._backend, self.labels())
+
+    def _find(self, member) -> int:
+        i = bisect.bisect_left(self._keys, self._key_map[member])
+        while self._backend[i] is not member:
+            i += 1
+        return i
 
     def _connect(self):
-        self._backend[:] = self._conversation.members
+        self._populate(self._conversation.members)
         if self._conversation.me is None:
             _connect_and_store_token(
                 self._tokens,
@@ -72,14 +152,21 @@ class MemberList(jclib.instrumentable_list.ModelListView):
             self._conversation.on_leave,
             self._on_leave,
         )
+        _connect_and_store_token(
+            self._tokens,
+            self._conversation.on_nick_changed,
+            self._on_nick_changed,
+        )
 
     def _disconnect(self):
         for signal, token in self._tokens:
             signal.disconnect(token)
-        self._backend.clear()
+        self._tokens.clear()
+        self._clear()
+        self.on_reset()
 
     def _on_enter(self, **kwargs):
-        self._backend[:] = self._conversation.members
+        self._populate(self._conversation.members)
         _connect_and_store_token(
             self._tokens,
             self._conversation.on_join,
@@ -87,14 +174,46 @@ class MemberList(jclib.instrumentable_list.ModelListView):
         )
 
     def _on_join(self, member, **kwargs):
-        self._backend.append(member)
+        if member in self._key_map:
+            return
+        key = _member_sort_key(_member_label(member))
+        index = bisect.bisect_right(self._keys, key)
+        self._keys.insert(index, key)
+        self._key_map[member] = key
+        self._backend.insert(index, member)
+        self.on_member_added(member, key[1])
 
     def _on_leave(self, member, **kwargs):
-        self._backend.remove(member)
+        try:
+            index = self._find(member)
+        except KeyError:
+            return
+        _, label = self._keys.pop(index)
+        del self._key_map[member]
+        del self._backend[index]
+        self.on_member_removed(member, label)
 
-    def _on_nick_changed(self, member, old_nick, new_nickm, **kwargs):
-        member_index = self._backend.index(member)
-        self._backend.refresh_data(slice(member_index, member_index+1))
+    def _on_nick_changed(self, member, old_nick, new_nick, **kwargs):
+        try:
+            old_index = self._find(member)
+        except KeyError:
+            return
+
+        key = _member_sort_key(new_nick or _member_label(member))
+        _, old_label = self._keys.pop(old_index)
+        new_index = bisect.bisect_right(self._keys, key)
+        self._keys.insert(new_index, key)
+        self._key_map[member] = key
+
+        if new_index != old_index:
+            # like with beginMoveRows, the destination is the row before
+            # which the member is put, counted before it is removed
+            self._backend.move(
+                old_index,
+                new_index + 1 if new_index > old_index else new_index,
+            )
+        self._backend.refresh_data(slice(new_index, new_index+1))
+        self.on_member_renamed(member, old_label, key[1])
 
     @property
     def conversation(self):
@@ -121,6 +240,50 @@ class MemberModel(Qt.QAbstractListModel):
         self.__metadata = metadata
         self.__avatar_manager = avatar_manager
         self.__adaptor = model_adaptor.ModelListAdaptor(self.__members, self)
+        self.__tooltips = models.TooltipCache()
+        self.__members.data_changed.connect(self._data_changed)
+        self.__members.on_member_removed.connect(self._member_removed)
+        self.__members.on_reset.connect(self._reset)
+        self.__avatar_manager.on_avatar_changed.connect(
+            self._on_avatar_changed,
+            self.__avatar_manager.on_avatar_changed.WEAK,
+        )
+        self.__metadata.changed_signal(
+            jclib.roster.RosterMetadata.NAME
+        ).connect(
+            self._on_name_changed,
+            aioxmpp.callbacks.AdHocSignal.WEAK,
+        )
+
+    def _data_changed(self, _, index1, index2, column1, column2, roles):
+        # nickname changes are reported as data changes
+        for i in range(index1, index2 + 1):
+            member = self.__members[i]
+            self.__tooltips.invalidate(member, self.__account,
+                                       self._avatar_address(member))
+        self.dataChanged.emit(
+            self.index(index1, 0),
+            self.index(index2, 0),
+            roles or [],
+        )
+
+    def _member_removed(self, member, label):
+        self.__tooltips.invalidate(member, self.__account,
+                                   self._avatar_address(member))
+
+    def _reset(self):
+        self.__tooltips.clear()
+
+    def _on_avatar_changed(self, account, address):
+        if account != self.__account:
+            return
+        self.__tooltips.avatar_changed(account, address)
+
+    def _on_name_changed(self, key, account, peer, value):
+        # members without nickname are labelled with their roster name
+        if account != self.__account:
+            return
+        self.__tooltips.peer_changed(account, peer)
 
     def _display_name(self, member):
         if hasattr(member, "nick"):
@@ -133,14 +296,28 @@ class MemberModel(Qt.QAbstractListModel):
             )
         return label
 
+    @staticmethod
+    def _avatar_address(member):
+        return member.direct_jid or member.conversation_jid
+
     def _format_tooltip(self, member):
-        picture = self.__avatar_manager.get_avatar(
+        return self.__tooltips.get(
+            member,
             self.__account,
-            member.direct_jid or member.conversation_jid,
-            getattr(member, "nick", None)
+            self._avatar_address(member),
+            functools.partial(self._render_tooltip, member),
         )
 
-        picture_base64 = jabbercat.utils.qtpicture_to_data_uri(picture)
+    def _render_tooltip(self, member):
+        address = self._avatar_address(member)
+        nick = getattr(member, "nick", None)
+        picture_base64 = self.__tooltips.avatar_data_uri(
+            self.__account, address, nick,
+            functools.partial(
+                self.__avatar_manager.get_avatar,
+                self.__account, address, nick,
+            ),
+        )
 
         label = self._display_name(member)
 
@@ -221,13 +398,19 @@ class MessageViewPageChannelObject(Qt.QObject):
 
     on_ready = Qt.pyqtSignal([])
     on_message = Qt.pyqtSignal(['QVariantMap'])
+    on_messages = Qt.pyqtSignal(['QVariantList'])
     on_font_family_changed = Qt.pyqtSignal([str])
     on_avatar_changed = Qt.pyqtSignal(['QVariantMap'])
     on_marker = Qt.pyqtSignal(['QVariantMap'])
-    on_join = Qt.pyqtSignal(['QVariantMap'])
-    on_part = Qt.pyqtSignal(['QVariantMap'])
+    on_presence = Qt.pyqtSignal(['QVariantMap'])
     on_flag = Qt.pyqtSignal(['QVariantMap'])
     on_request_html = Qt.pyqtSignal([])
+    on_older_messages = Qt.pyqtSignal(['QVariantMap'])
+    on_older_messages_requested = Qt.pyqtSignal([str, str, int])
+    on_newer_messages = Qt.pyqtSignal(['QVariantMap'])
+    on_newer_messages_requested = Qt.pyqtSignal([str, str, int])
+    on_restore = Qt.pyqtSignal([str])
+    on_jump_to_message = Qt.pyqtSignal([str])
 
     @Qt.pyqtProperty(str, notify=on_font_family_changed)
     def font_family(self):
@@ -276,6 +459,20 @@ class MessageViewPageChannelObject(Qt.QObject):
         self.logger.debug("web page called in ready!")
         self.on_ready.emit()
 
+    @Qt.pyqtSlot(str, str, int)
+    def request_older_messages(self, before_timestamp: str, before_uid: str,
+                               count: int):
+        self.on_older_messages_requested.emit(
+            before_timestamp, before_uid, count
+        )
+
+    @Qt.pyqtSlot(str, str, int)
+    def request_newer_messages(self, after_timestamp: str, after_uid: str,
+                               count: int):
+        self.on_newer_messages_requested.emit(
+            after_timestamp, after_uid, count
+        )
+
     @Qt.pyqtSlot(str)
     def push_html(self, html_str: str):
         self.logger.debug("push_html received")
@@ -307,6 +504,69 @@ class MessageViewPageChannelObject(Qt.QObject):
             if not fut.done():
                 fut.cancel()
             raise
+        finally:
+            if self._html_fut is fut:
+                self._html_fut = None
+
+    def cancel_html_request(self):
+        """
+        Cancel a running :meth:`request_html`, if any.
+        """
+        if self._html_fut is not None and not self._html_fut.done():
+            self._html_fut.cancel()
+        self._html_fut = None
+
+
+_script_cache = {}
+
+
+def _read_script(path: str) -> str:
+    try:
+        return _script_cache[path]
+    except KeyError:
+        pass
+
+    f = Qt.QFile(path)
+    f.open(Qt.QFile.ReadOnly)
+    assert f.isOpen()
+    try:
+        data = bytes(f.readAll()).decode("utf-8")
+    finally:
+        f.close()
+
+    _script_cache[path] = data
+    return data
+
+
+PAGE_SCRIPT_NAME = "jabbercat-message-view"
+PAGE_SCRIPT_PATHS = [
+    ":/qtwebchannel/qwebchannel.js",
+    ":/js/jabbercat-api.js",
+]
+
+
+def install_page_scripts(web_profile: Qt.QWebEngineProfile):
+    """
+    Register the scripts of the message view on a web profile.
+
+    The scripts are injected into every page of the profile at document
+    creation. Installing them more than once is a no-op.
+    """
+    scripts = web_profile.scripts()
+    if not scripts.findScript(PAGE_SCRIPT_NAME).isNull():
+        return
+
+    script = Qt.QWebEngineScript()
+    script.setName(PAGE_SCRIPT_NAME)
+    # a single script guarantees that qwebchannel.js is evaluated first
+    script.setSourceCode("\n;\n".join(
+        _read_script(path)
+        for path in PAGE_SCRIPT_PATHS
+    ))
+    script.setInjectionPoint(Qt.QWebEngineScript.DocumentCreation)
+    script.setWorldId(Qt.QWebEngineScript.ApplicationWorld)
+    script.setRunsOnSubFrames(False)
+    scripts.insert(script)
 
 
 class MessageViewPage(Qt.QWebEnginePage):
@@ -315,6 +575,7 @@ class MessageViewPage(Qt.QWebEnginePage):
     def __init__(self, web_profile, logger, account_jid,
                  conversation_jid, parent=None):
         super().__init__(web_profile, parent)
+        install_page_scripts(web_profile)
         self._loaded = False
         self.logger = logger
         self.channel = MessageViewPageChannelObject(
@@ -345,16 +606,23 @@ class MessageViewPage(Qt.QWebEnginePage):
         Qt.QDesktopServices.openUrl(url)
         return False
 
-    def _load_script(self, path: str):
-        f = Qt.QFile(path)
-        f.open(Qt.QFile.ReadOnly)
-        assert f.isOpen()
-        data = bytes(f.readAll()).decode("utf-8")
-        self.runJavaScript(
-            data,
-            Qt.QWebEngineScript.ApplicationWorld
-        )
-        f.close()
+    def assign(self, account_jid, conversation_jid):
+        """
+        Assign the page to a different conversation.
+
+        Only valid for pages which have been :meth:`recycle`\ -d.
+        """
+        self.channel.account_jid = str(account_jid)
+        self.channel.conversation_jid = str(conversation_jid)
+
+    def recycle(self):
+        """
+        Drop the document and load a fresh copy of the template.
+        """
+        self._loaded = False
+        self.ready_event.clear()
+        self.channel.cancel_html_request()
+        self.setUrl(self.URL)
 
     def _load_finished(self, ok: bool):
         if self._loaded:
@@ -365,9 +633,6 @@ class MessageViewPage(Qt.QWebEnginePage):
                 )
             return
         self._loaded = True
-        # self._load_script(":/js/jquery.min.js")
-        self._load_script(":/qtwebchannel/qwebchannel.js")
-        self._load_script(":/js/jabbercat-api.js")
 
     def _full_screen_requested(self, request: Qt.QWebEngineFullScreenRequest):
         request.reject()
@@ -377,6 +642,77 @@ class MessageViewPage(Qt.QWebEnginePage):
         self.channel.font_size = "{}pt".format(font.pointSizeF())
 
 
+class MessageViewPagePool:
+    """
+    Hand out :class:`MessageViewPage` instances to conversation views.
+
+    :param web_profile: The profile to create pages in.
+    :param max_live: Number of views which may hold a page at the same time.
+    :param max_idle: Number of released pages to keep for reuse.
+
+    Each page keeps a renderer DOM alive. When more than `max_live` views
+    hold a page, the least recently shown views which are not visible are
+    asked to :meth:`~ConversationView.hibernate`. Released pages are reset
+    and kept for the next view which needs one, up to `max_idle`.
+    """
+
+    def __init__(self, web_profile, max_live=8, max_idle=2):
+        super().__init__()
+        self.web_profile = web_profile
+        self.max_live = max_live
+        self.max_idle = max_idle
+        self._live = collections.OrderedDict()
+        self._hibernating = set()
+        self._idle = []
+
+    def acquire(self, view, account_jid, conversation_jid):
+        try:
+            page = self._idle.pop()
+        except IndexError:
+            page = MessageViewPage(
+                self.web_profile,
+                logging.getLogger(__name__),
+                account_jid,
+                conversation_jid,
+            )
+        else:
+            page.assign(account_jid, conversation_jid)
+
+        self._live[view] = page
+        self._evict()
+        return page
+
+    def touch(self, view):
+        self._hibernating.discard(view)
+        try:
+            self._live.move_to_end(view)
+        except KeyError:
+            pass
+
+    def release(self, view):
+        self._hibernating.discard(view)
+        page = self._live.pop(view, None)
+        if page is None:
+            return
+
+        if len(self._idle) < self.max_idle:
+            page.recycle()
+            self._idle.append(page)
+        else:
+            page.deleteLater()
+
+    def _evict(self):
+        excess = len(self._live) - len(self._hibernating) - self.max_live
+        for view in list(self._live):
+            if excess <= 0:
+                break
+            if view in self._hibernating or view.isVisible():
+                continue
+            self._hibernating.add(view)
+            view.hibernate()
+            excess -= 1
+
+
 class MessageView(Qt.QWebEngineView):
     def __init__(self, parent=None):
         super().__init__(parent=parent)
@@ -457,19 +793,425 @@ def urls_to_attachments(urls):
             yield attachment
 
 
+_URL_PATTERN = r"https?://\S+|xmpp:\S+"
+
+# matches everything htmlify_body has to act on in a single pass: line
+# breaks and URLs, in the three forms also recognised by
+# ConversationView.URL_RE
+BODY_TOKEN_RE = re.compile(
+    r"(?P<newline>\n)|"
+    r"[<\(\[\{{](?P<url_paren>{url})[>\)\]\}}]|"
+    r"(?P<url_delim>\W)(?P<url_nonword>{url})(?P=url_delim)|"
+    r"\b(?P<url_name>{url})\b".format(
+        url=_URL_PATTERN,
+    ),
+    re.I,
+)
+
+
+def _htmlify_line_start(body, pos, display_name, parts):
+    if body.startswith("/me ", pos):
+        parts.append("<span class='action'>* {}</span> ".format(
+            html.escape(display_name)
+        ))
+        return pos + 3
+    return pos
+
+
+def htmlify_body(body, display_name):
+    """
+    Convert a plain text message body to HTML for the conversation view.
+
+    :param body: The message body.
+    :param display_name: Display name of the sender, used for ``/me``.
+    :return: The HTML and a tuple containing the list of URLs found in the
+        body.
+
+    Line breaks and URLs are found in a single pass over the body. A last
+    line consisting only of emoji is rendered enlarged.
+    """
+    parts = []
+    urls = []
+
+    end = len(body)
+    hugify = None
+    last_line_start = body.rfind("\n") + 1
+    if emoji.DATABASE.emoji_or_space_multi_re.fullmatch(body,
+                                                         last_line_start):
+        hugify = body[last_line_start:]
+        end = last_line_start
+
+    last = _htmlify_line_start(body, 0, display_name, parts)
+    for match in BODY_TOKEN_RE.finditer(body, 0, end):
+        if match.start() > last:
+            parts.append(html.escape(body[last:match.start()]))
+
+        if match.group("newline"):
+            parts.append("<br/>")
+            last = _htmlify_line_start(body, match.end(), display_name,
+                                       parts)
+            continue
+
+        match_s = match.group(0)
+        inner_prefix, prefix, inner_suffix, suffix = "", "", "", ""
+        if match.group("url_paren"):
+            inner_prefix = match_s[0]
+            inner_suffix = match_s[-1]
+            url = match_s[1:-1]
+        elif match.group("url_nonword"):
+            prefix = match_s[0]
+            suffix = match_s[-1]
+            url = match_s[1:-1]
+        else:
+            url = match_s
+
+        if prefix:
+            parts.append(html.escape(prefix))
+        parts.append("<a href='{0}'>{1}</a>".format(
+            html.escape(url),
+            html.escape(inner_prefix + url + inner_suffix),
+        ))
+        urls.append(url)
+        if suffix:
+            parts.append(html.escape(suffix))
+        last = match.end()
+
+    if end > last:
+        parts.append(html.escape(body[last:end]))
+
+    if hugify is not None:
+        parts.append("<span class='emoji-hugify'>{}</span>".format(hugify))
+
+    return "".join(parts), (urls,)
+
+
+class LazyConversationView(Qt.QWidget):
+    """
+    Placeholder for a :class:`ConversationView` which is built on first use.
+
+    The arguments are passed on to :class:`ConversationView`.
+
+    Building a conversation view is expensive (models, delegates and a web
+    page), so the real view is only created when the placeholder is first
+    shown or focused. Live messages and markers which arrive before that are
+    buffered and replayed into the view.
+    """
+
+    MAX_BUFFERED_EVENTS = 1000
+
+    def __init__(self,
+                 conversation_node,
+                 avatars: avatar.AvatarManager,
+                 metadata: jclib.metadata.MetadataFrontend,
+                 page_pool: MessageViewPagePool,
+                 search_index: search.MessageSearchIndex = None,
+                 parent=None):
+        super().__init__(parent=parent)
+        self.logger = logging.getLogger(
+            ".".join([__name__, type(self).__name__])
+        )
+        layout = Qt.QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(layout)
+
+        self.__node = conversation_node
+        self.__args = (conversation_node, avatars, metadata, page_pool,
+                       search_index)
+        self.__view = None
+        self.__buffer = collections.deque(maxlen=self.MAX_BUFFERED_EVENTS)
+        self.__node_tokens = []
+        _connect_and_store_token(
+            self.__node_tokens,
+            conversation_node.on_message,
+            self._buffer_message,
+        )
+        _connect_and_store_token(
+            self.__node_tokens,
+            conversation_node.on_marker,
+            self._buffer_marker,
+        )
+
+    def _buffer_event(self, event):
+        if len(self.__buffer) == self.__buffer.maxlen:
+            self.logger.warning(
+                "more than %d events buffered for %s, dropping the oldest",
+                self.__buffer.maxlen,
+                self.__node.conversation_address,
+            )
+        self.__buffer.append(event)
+
+    def _buffer_message(self, timestamp, message_uid, is_self, *args,
+                        **kwargs):
+        self._buffer_event(
+            ("message", ((timestamp, message_uid, is_self) + args, kwargs))
+        )
+        if not is_self:
+            Qt.QApplication.alert(self.window())
+
+    def _buffer_marker(self, *args):
+        self._buffer_event(("marker", args))
+
+    @property
+    def view(self):
+        """
+        The :class:`ConversationView` or :data:`None` if not built yet.
+        """
+        return self.__view
+
+    def materialise(self) -> "ConversationView":
+        """
+        Build the conversation view if needed and return it.
+        """
+        if self.__view is not None:
+            return self.__view
+
+        for signal, token in self.__node_tokens:
+            signal.disconnect(token)
+        self.__node_tokens.clear()
+
+        self.__view = ConversationView(*self.__args, parent=self)
+        self.layout().addWidget(self.__view)
+
+        events = list(self.__buffer)
+        self.__buffer.clear()
+        self.__view.replay_live_events(events)
+        return self.__view
+
+    def showEvent(self, event: Qt.QShowEvent):
+        self.materialise()
+        return super().showEvent(event)
+
+    def set_focus_to_message_input(self):
+        self.materialise().set_focus_to_message_input()
+
+    def discard_view(self):
+        """
+        Release the web page of the view, if it has been built.
+
+        See :meth:`ConversationView.discard_view`.
+        """
+        if self.__view is not None:
+            self.__view.discard_view()
+
+    def teardown(self):
+        """
+        Disconnect from the conversation node for good.
+
+        This is called when the conversation is removed; see
+        :meth:`ConversationView.teardown`.
+        """
+        if self.__view is not None:
+            self.__view.teardown()
+        for signal, token in self.__node_tokens:
+            signal.disconnect(token)
+        self.__node_tokens.clear()
+        self.__buffer.clear()
+
+
+def coalesce_presence_events(events):
+    """
+    Merge a sequence of join and part events.
+
+    :param events: Event dicts with ``from_jid`` and ``is_join`` keys, in
+        order.
+    :return: The remaining events, in order.
+
+    A join cancels out the preceding part of the same occupant, as this is
+    only a reconnect.
+    """
+    history_by_jid = {}
+    cancelled = set()
+    for i, event in enumerate(events):
+        history = history_by_jid.setdefault(event["from_jid"], [])
+        if event["is_join"] and history and not events[history[-1]]["is_join"]:
+            cancelled.add(history.pop())
+            cancelled.add(i)
+            continue
+        history.append(i)
+    return [
+        event
+        for i, event in enumerate(events)
+        if i not in cancelled
+    ]
+
+
+def _parse_page_timestamp(s):
+    s = s.rstrip("Z")
+    for fmt in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return datetime.strptime(s, fmt)
+        except ValueError:
+            pass
+    return None
+
+
+class HistoryWindow:
+    """
+    Serve pages of the archive of a conversation around anchor messages.
+
+    :param node: The conversation node whose archive is paged.
+
+    The node can only be asked for its most recent messages, optionally
+    limited to those not older than a timestamp. The window of most recent
+    messages is therefore kept between requests. It is read again, at least
+    twice as large, only when a page reaches beyond its start and it is
+    extended with the messages which arrived since it was read when a page
+    reaches beyond its end. Paging through the archive thus reads each
+    message a constant number of times on average.
+    """
+
+    EXTEND_COUNT = 16
+
+    def __init__(self, node):
+        self._node = node
+        self._history = []
+        self._timestamps = []
+        self._max_count = 0
+        self._complete = False
+
+    def _reload(self, max_count):
+        history = self._node.get_last_messages(max_count=max_count)
+        self._complete = len(history) < max_count
+        self._max_count = max_count
+        self._history = sorted(history, key=lambda argv: argv[0])
+        self._timestamps = [argv[0] for argv in self._history]
+
+    def _grow(self, count):
+        self._reload(max(2 * self._max_count, 2 * count))
+
+    def _extend(self):
+        if not self._history:
+            self._grow(self.EXTEND_COUNT)
+            return
+
+        last_ts = self._timestamps[-1]
+        known_uids = set()
+        i = len(self._history)
+        while i > 0 and self._timestamps[i-1] == last_ts:
+            i -= 1
+            known_uids.add(self._history[i][1])
+
+        max_count = self.EXTEND_COUNT
+        while True:
+            newer = self._node.get_last_messages(max_count=max_count,
+                                                 max_age=last_ts)
+            if len(newer) < max_count:
+                break
+            max_count *= 2
+
+        newer = sorted(
+            (argv for argv in newer
+             if argv[0] > last_ts or
+             (argv[0] == last_ts and argv[1] not in known_uids)),
+            key=lambda argv: argv[0],
+        )
+        self._history.extend(newer)
+        self._timestamps.extend(argv[0] for argv in newer)
+        self._max_count += len(newer)
+
+    def _find(self, timestamp, message_uid):
+        if timestamp is not None:
+            lo = bisect.bisect_left(self._timestamps, timestamp)
+            hi = bisect.bisect_right(self._timestamps, timestamp, lo)
+        else:
+            lo, hi = 0, len(self._history)
+
+        for i in range(lo, hi):
+            if str(self._history[i][1]) == message_uid:
+                return i
+        return None
+
+    def _before_window(self, timestamp):
+        if self._complete:
+            return False
+        if not self._history:
+            return True
+        # messages with the same timestamp as the first one may be missing
+        return timestamp is not None and timestamp <= self._timestamps[0]
+
+    def page_before(self, timestamp, message_uid, count):
+        """
+        Return up to `count` messages older than the anchor message.
+
+        :param timestamp: Timestamp of the anchor, if known.
+        :param message_uid: UID of the anchor.
+        :param count: Maximum number of messages to return.
+        :return: The messages, oldest first, and whether they reach back to
+            the start of the archive.
+
+        If the anchor is not found, the messages older than `timestamp` are
+        returned, or the most recent ones if `timestamp` is :data:`None`.
+        """
+        if self._max_count == 0:
+            self._grow(count)
+
+        while True:
+            end = self._find(timestamp, message_uid)
+            if end is None:
+                if timestamp is None:
+                    end = len(self._history)
+                else:
+                    end = bisect.bisect_left(self._timestamps, timestamp)
+            if end >= count or self._complete:
+                break
+            self._grow(count)
+
+        start = max(end - count, 0)
+        return self._history[start:end], self._complete and start == 0
+
+    def page_after(self, timestamp, message_uid, count):
+        """
+        Return up to `count` messages newer than the anchor message.
+
+        :param timestamp: Timestamp of the anchor, if known.
+        :param message_uid: UID of the anchor.
+        :param count: Maximum number of messages to return.
+        :return: The messages, oldest first, and whether they reach up to
+            the most recent message of the archive.
+        """
+        if self._max_count == 0:
+            self._grow(count)
+
+        while True:
+            index = self._find(timestamp, message_uid)
+            if index is not None or not self._before_window(timestamp):
+                break
+            self._grow(count)
+
+        if index is not None:
+            start = index + 1
+        elif timestamp is not None:
+            start = bisect.bisect_right(self._timestamps, timestamp)
+        else:
+            start = len(self._history)
+
+        if start + count >= len(self._history):
+            # the page reaches the end of the window
+            self._extend()
+
+        end = min(start + count, len(self._history))
+        return self._history[start:end], end == len(self._history)
+
+
 class ConversationView(Qt.QWidget):
     URL_RE = re.compile(
         r"([<\(\[\{{](?P<url_paren>{url})[>\)\]\}}]|(\W)(?P<url_nonword>{url})\3|\b(?P<url_name>{url})\b)".format(
-            url=r"https?://\S+|xmpp:\S+",
+            url=_URL_PATTERN,
         ),
         re.I,
     )
 
+    MAX_HISTORY_PAGE_SIZE = 200
+    MAX_HIBERNATED_EVENTS = 1000
+    PRESENCE_BATCH_INTERVAL = 0.5
+    RENDERED_BODY_CACHE_SIZE = 1024
+
     def __init__(self,
                  conversation_node,
                  avatars: avatar.AvatarManager,
                  metadata: jclib.metadata.MetadataFrontend,
-                 web_profile: Qt.QWebEngineProfile,
+                 page_pool: MessageViewPagePool,
+                 search_index: search.MessageSearchIndex = None,
                  parent=None):
         super().__init__(parent=parent)
         self.logger = logging.getLogger(
@@ -483,7 +1225,8 @@ class ConversationView(Qt.QWidget):
         frame_layout = Qt.QHBoxLayout()
         frame_layout.setContentsMargins(0, 0, 0, 0)
         self.ui.history_frame.setLayout(frame_layout)
-        self.__web_profile = web_profile
+        self.__page_pool = page_pool
+        self.__search_index = search_index
 
         self.ui.message_input.activated.connect(self._message_input_activated)
 
@@ -497,15 +1240,11 @@ class ConversationView(Qt.QWidget):
             avatars,
         )
 
-        self.__sorted_member_model = Qt.QSortFilterProxyModel()
-        self.__sorted_member_model.setSortRole(Qt.Qt.DisplayRole)
-        self.__sorted_member_model.setSortCaseSensitivity(Qt.Qt.CaseInsensitive)
-        self.__sorted_member_model.setSourceModel(self.__member_model)
-        self.__sorted_member_model.sort(0, Qt.Qt.AscendingOrder)
-
-        self.ui.member_view.setModel(self.__sorted_member_model)
+        # the member list is kept sorted already
+        self.ui.member_view.setModel(self.__member_model)
 
         self._ui_initialised = False
+        self.__nick_index = None
 
         if isinstance(conversation_node,
                       jclib.conversation.P2PConversationNode):
@@ -513,10 +1252,10 @@ class ConversationView(Qt.QWidget):
             self.ui.member_view.hide()
         else:
             # this is a multi-user thing
-            completer = messageinput.MemberCompleter()
-            completer.setModel(self.__sorted_member_model)
-            completer.setCompletionRole(Qt.Qt.DisplayRole)
-            completer.setCompletionColumn(0)
+            self.__nick_index = completion.NickCompletionIndex(
+                self.__member_list,
+            )
+            completer = messageinput.MemberCompleter(self.__nick_index)
             self.ui.message_input.completer = completer
 
             item_delegate_wide = member_list.MemberItemDelegate(
@@ -576,6 +1315,28 @@ class ConversationView(Qt.QWidget):
         )
         self.__conv_tokens = []
         self.__msgidmap = {}
+        self.__pending_messages = []
+        self.__early_markers = {}
+        self.__pending_jump = None
+        # live messages which arrived before the view was built, see
+        # replay_live_events
+        self.__replayed_messages = []
+        self.__backlog_uids = frozenset()
+        # archive window for history pages, see HistoryWindow
+        self.__history_window = None
+        self.__pending_presence = []
+        self.__presence_flush_handle = None
+        self.__rendered_bodies = aioxmpp.cache.LRUDict()
+        self.__rendered_bodies.maxsize = self.RENDERED_BODY_CACHE_SIZE
+
+        # while hibernated, events for the page are queued here and the last
+        # state of the page is kept as HTML snapshot
+        self.__hibernated_events = None
+        self.__snapshot = None
+        self.__snapshot_stale = False
+
+        self.history = None
+        self.history_view = None
 
         self.ui.btnSendFile.setDefaultAction(self.ui.action_send_file)
         self.ui.action_send_file.triggered.connect(
@@ -655,14 +1416,20 @@ class ConversationView(Qt.QWidget):
 
     def create_view(self):
         self.history_view = MessageView(self.ui.history_frame)
-        self.history = MessageViewPage(self.__web_profile,
-                                       logging.getLogger(__name__),
-                                       self.__node.account.jid,
-                                       self.__node.conversation_address,
-                                       self.history_view)
+        self.history = self.__page_pool.acquire(
+            self,
+            self.__node.account.jid,
+            self.__node.conversation_address,
+        )
         self.history.channel.on_ready.connect(
             self.handle_page_ready,
         )
+        self.history.channel.on_older_messages_requested.connect(
+            self.handle_older_messages_requested,
+        )
+        self.history.channel.on_newer_messages_requested.connect(
+            self.handle_newer_messages_requested,
+        )
         self._update_zoom_factor()
         self.history_view.setPage(self.history)
         self.history_view.setContextMenuPolicy(Qt.Qt.CustomContextMenu)
@@ -670,6 +1437,130 @@ class ConversationView(Qt.QWidget):
             self._history_view_context_menu
         )
         self.ui.history_frame.layout().addWidget(self.history_view)
+        if self.history.ready_event.is_set():
+            # reused page which has finished loading already
+            self.handle_page_ready()
+
+    def discard_view(self):
+        """
+        Release the web page of this view back to the pool.
+
+        Events for the page are queued from then on. The view is created
+        again by :meth:`restore`.
+        """
+        if self.history is None:
+            return
+
+        if self.__hibernated_events is None:
+            self.__hibernated_events = []
+            self.__snapshot_stale = True
+
+        self.history.channel.on_ready.disconnect(
+            self.handle_page_ready,
+        )
+        self.history.channel.on_older_messages_requested.disconnect(
+            self.handle_older_messages_requested,
+        )
+        self.history.channel.on_newer_messages_requested.disconnect(
+            self.handle_newer_messages_requested,
+        )
+        self.ui.history_frame.layout().removeWidget(self.history_view)
+        self.history_view.deleteLater()
+        self.history_view = None
+        self.history = None
+        self.__history_window = None
+        self.__page_pool.release(self)
+
+    def teardown(self):
+        """
+        Disconnect the view from the conversation and release its page.
+
+        Unlike :meth:`discard_view`, this also drops all queued events and
+        cancels pending timers. The view cannot be used afterwards.
+        """
+        for signal, token in self.__node_tokens:
+            signal.disconnect(token)
+        self.__node_tokens.clear()
+        self._stale()
+
+        if self.__presence_flush_handle is not None:
+            self.__presence_flush_handle.cancel()
+            self.__presence_flush_handle = None
+        self.__pending_presence = []
+        self.__pending_messages = []
+        self.__replayed_messages = []
+        self.__pending_jump = None
+
+        self.discard_view()
+        self._page_ready = False
+        self.__hibernated_events = None
+        self.__snapshot = None
+
+    @utils.asyncify
+    @asyncio.coroutine
+    def hibernate(self):
+        """
+        Snapshot the page and release it to the pool.
+        """
+        if self.history is None or self.__hibernated_events is not None:
+            return
+
+        if not self._page_ready:
+            self.discard_view()
+            return
+
+        self._flush_pending_messages()
+        self.__hibernated_events = []
+        self.__snapshot_stale = False
+        try:
+            self.__snapshot = yield from self.history.channel.request_html()
+        except RuntimeError:
+            # another snapshot is being taken; stay awake
+            self._replay_hibernated_events()
+            self.__page_pool.touch(self)
+            return
+
+        if self.isVisible():
+            # shown again while the snapshot was being taken
+            self.__snapshot = None
+            self._replay_hibernated_events()
+            self.__page_pool.touch(self)
+            return
+
+        self.logger.debug("hibernating with %d bytes of snapshot",
+                          len(self.__snapshot))
+        self.discard_view()
+
+    def restore(self):
+        """
+        Re-create the web page of a hibernated view.
+
+        The page is restored from the snapshot plus the events which have
+        been queued in the meantime once it is ready.
+        """
+        if self.history is not None:
+            return
+        self.create_view()
+
+    def _replay_hibernated_events(self):
+        events = self.__hibernated_events or []
+        self.__hibernated_events = None
+        for signal_name, payload in events:
+            getattr(self.history.channel, signal_name).emit(payload)
+
+    def _emit_to_page(self, signal_name, payload):
+        if self.__hibernated_events is not None:
+            if self.__snapshot_stale:
+                return
+            if len(self.__hibernated_events) >= self.MAX_HIBERNATED_EVENTS:
+                # too much happened; load from the archive on restore
+                self.__snapshot_stale = True
+                self.__hibernated_events.clear()
+                return
+            self.__hibernated_events.append((signal_name, payload))
+            return
+
+        getattr(self.history.channel, signal_name).emit(payload)
 
     def _history_view_context_menu(self, pos):
         cmd = self.history.contextMenuData()
@@ -714,16 +1605,117 @@ class ConversationView(Qt.QWidget):
         menu.aboutToHide.connect(menu.deleteLater)
 
     def _update_zoom_factor(self):
+        if self.history is None:
+            return
         self.history.setZoomFactor(1./self.devicePixelRatioF())
 
     def handle_page_ready(self):
         self._page_ready = True
+        self.__history_window = None
+        if self.__hibernated_events is not None:
+            snapshot = self.__snapshot
+            self.__snapshot = None
+            if snapshot is not None and not self.__snapshot_stale:
+                self.logger.debug("page ready, restoring from snapshot")
+                self.history.channel.on_restore.emit(snapshot)
+                self._replay_hibernated_events()
+                self._flush_pending_jump()
+                return
+            self.__hibernated_events = None
+            # messages which were queued for the page are in the archive
+            self.__pending_messages.clear()
+
         self.logger.debug("page called in ready, loading logs")
         start_at = datetime.utcnow() - timedelta(hours=2)
         max_count = 100
-        for argv in self.__node.get_last_messages(max_count=max_count,
-                                                  max_age=start_at):
+        backlog = self.__node.get_last_messages(max_count=max_count,
+                                                max_age=start_at)
+        self._index_messages(backlog)
+        for argv in backlog:
             self.handle_live_message(*argv)
+        self.__backlog_uids = frozenset(str(argv[1]) for argv in backlog)
+        self._flush_replayed_messages()
+        # send the whole backlog to the page in a single batch
+        self._flush_pending_messages()
+
+        markers = list(self.__early_markers.values())
+        self.__early_markers.clear()
+        for argv in markers:
+            self.handle_live_marker(*argv)
+
+        self._flush_pending_jump()
+
+    def _index_messages(self, messages):
+        if self.__search_index is None:
+            return
+        search.index_messages(self.__search_index, self.__node, messages)
+
+    def jump_to_message(self, message_uid: str):
+        """
+        Scroll the history to a message and highlight it.
+
+        If the message is not loaded in the page yet, older history is loaded
+        until it is found or the archive is exhausted.
+        """
+        self.restore()
+        if not self._page_ready or self.__hibernated_events is not None:
+            # sent once the page is (re-)loaded
+            self.__pending_jump = message_uid
+            return
+        self._emit_to_page("on_jump_to_message", message_uid)
+
+    def _flush_pending_jump(self):
+        message_uid = self.__pending_jump
+        self.__pending_jump = None
+        if message_uid is not None:
+            self._emit_to_page("on_jump_to_message", message_uid)
+
+    def _get_history_window(self):
+        if self.__history_window is None:
+            self.__history_window = HistoryWindow(self.__node)
+        return self.__history_window
+
+    def _send_history_page(self, signal_name, page, exhausted):
+        self._index_messages(page)
+
+        self._emit_to_page(signal_name, {
+            "messages": [
+                self._format_message(*argv[:7])
+                for argv in page
+            ],
+            "exhausted": exhausted,
+        })
+
+        for argv in page:
+            message_uid = argv[1]
+            tracker = argv[7] if len(argv) > 7 else None
+            if tracker is not None:
+                self._emit_tracker_event(message_uid, tracker.state)
+
+    def handle_older_messages_requested(self, before_timestamp, before_uid,
+                                        count):
+        count = max(1, min(count, self.MAX_HISTORY_PAGE_SIZE))
+        page, exhausted = self._get_history_window().page_before(
+            _parse_page_timestamp(before_timestamp),
+            before_uid,
+            count,
+        )
+        self.logger.debug("sending %d older messages to JS", len(page))
+        self._send_history_page("on_older_messages", page, exhausted)
+
+    def handle_newer_messages_requested(self, after_timestamp, after_uid,
+                                        count):
+        count = max(1, min(count, self.MAX_HISTORY_PAGE_SIZE))
+        # the page drops live messages while newer history is unloaded; those
+        # which are still queued are part of the archive already
+        self._flush_pending_messages()
+        page, exhausted = self._get_history_window().page_after(
+            _parse_page_timestamp(after_timestamp),
+            after_uid,
+            count,
+        )
+        self.logger.debug("sending %d newer messages to JS", len(page))
+        self._send_history_page("on_newer_messages", page, exhausted)
 
     def showEvent(self, event: Qt.QShowEvent):
         self._update_zoom_factor()
@@ -786,6 +1778,36 @@ class ConversationView(Qt.QWidget):
             "color_weak": color_weak,
         }
 
+    def _queue_presence(self, member, is_join):
+        self._flush_pending_messages()
+        event = self._member_to_event(member)
+        event["is_join"] = is_join
+        # presence is sent to the page in batches; netsplits and reconnects
+        # thus become a single summary instead of one item per occupant
+        self.__pending_presence.append(event)
+        if self.__presence_flush_handle is None:
+            self.__presence_flush_handle = \
+                asyncio.get_event_loop().call_later(
+                    self.PRESENCE_BATCH_INTERVAL,
+                    self._flush_pending_presence,
+                )
+
+    def _flush_pending_presence(self):
+        if self.__presence_flush_handle is not None:
+            self.__presence_flush_handle.cancel()
+            self.__presence_flush_handle = None
+
+        if not self.__pending_presence:
+            return
+
+        events = coalesce_presence_events(self.__pending_presence)
+        self.__pending_presence = []
+        if not events:
+            return
+
+        self.logger.debug("sending %d presence events to JS", len(events))
+        self._emit_to_page("on_presence", {"events": events})
+
     def _conv_join(self, member, **kwargs):
         state = getattr(
             self.__conversation,
@@ -795,14 +1817,10 @@ class ConversationView(Qt.QWidget):
         if state == aioxmpp.muc.RoomState.JOIN_PRESENCE:
             # we don’t show join presence in the message view
             return
-        self.history.channel.on_join.emit(
-            self._member_to_event(member)
-        )
+        self._queue_presence(member, True)
 
     def _conv_leave(self, member, **kwargs):
-        self.history.channel.on_part.emit(
-            self._member_to_event(member)
-        )
+        self._queue_presence(member, False)
 
     def _message_input_activated(self):
         if not self.ui.message_input.document().isEmpty():
@@ -845,97 +1863,27 @@ class ConversationView(Qt.QWidget):
         yield from self._send_message_stanza(msg)
 
     def htmlify_body(self, body, display_name):
-        out_lines = []
-        lines = body.split("\n")
-        urls = []
-        for i, line in enumerate(lines):
-            if (i == len(lines)-1 and
-                    emoji.DATABASE.emoji_or_space_multi_re.fullmatch(line)):
-                out_lines.append("<span class='emoji-hugify'>{}</span>".format(
-                    line
-                ))
-                continue
-
-            parts = []
-            if line.startswith("/me "):
-                parts.append("<span class='action'>* {}</span> ".format(
-                    html.escape(display_name)
-                ))
-                line = line[3:]
-
-            last = 0
-            for match in self.URL_RE.finditer(line):
-                prev = line[last:match.start()]
-                if prev:
-                    parts.append(html.escape(prev))
-
-                info = match.groupdict()
-                match_s = match.group(0)
-                inner_prefix, prefix, inner_suffix, suffix = "", "", "", ""
-                url = None
-                if info["url_paren"]:
-                    inner_prefix = match_s[0]
-                    inner_suffix = match_s[-1]
-                    url = match_s[1:-1]
-                elif info["url_nonword"]:
-                    prefix = match_s[0]
-                    suffix = match_s[-1]
-                    url = match_s[1:-1]
-                elif info["url_name"]:
-                    url = match_s
-                if prefix:
-                    parts.append(html.escape(prefix))
-                parts.append("<a href='{0}'>{1}</a>".format(
-                    html.escape(url),
-                    html.escape(inner_prefix + url + inner_suffix),
-                ))
-                urls.append(url)
-                if suffix:
-                    parts.append(html.escape(suffix))
-                last = match.end()
-
-            parts.append(html.escape(line[last:]))
-            out_lines.append("".join(parts))
-
-        return "<br/>".join(out_lines), (urls,)
+        return htmlify_body(body, display_name)
 
     def make_css_colors(self, color_input):
-        if color_input is not None:
-            qtcolor = utils.text_to_qtcolor(
-                jclib.utils.normalise_text_for_hash(color_input)
-            )
-            color_full = "rgba({:d}, {:d}, {:d}, 1.0)".format(
-                round(qtcolor.red() * 0.8),
-                round(qtcolor.green() * 0.8),
-                round(qtcolor.blue() * 0.8),
-            )
-            light_factor = 0.1
-            inv_light_factor = 1 - light_factor
-            color_weak = (
-                "linear-gradient(135deg, "
-                "rgba({:d}, {:d}, {:d}, {}), "
-                "transparent 10em)".format(
-                    round(qtcolor.red()),
-                    round(qtcolor.green()),
-                    round(qtcolor.blue()),
-                    light_factor,
-                )
-            )
-        else:
-            color_full = "inherit"
-            color_weak = color_full
-
-        return color_full, color_weak
+        if color_input is None:
+            return "inherit", "inherit"
+        return utils.text_colours.css_colors(color_input)
 
     def handle_live_marker(self, timestamp, is_self, from_jid,
                            display_name, color_input, marked_message_uid):
         if not self._page_ready:
-            self.logger.debug("dropping marker since page isn’t ready")
+            self.logger.debug("deferring marker since page isn’t ready")
+            self.__early_markers[from_jid] = (
+                timestamp, is_self, from_jid, display_name, color_input,
+                marked_message_uid,
+            )
             return
 
         color_full, color_weak = self.make_css_colors(color_input)
 
-        self.history.channel.on_marker.emit({
+        self._flush_pending_messages()
+        self._emit_to_page("on_marker", {
             "timestamp": str(
                 timestamp.isoformat() + "Z"
             ),
@@ -947,8 +1895,8 @@ class ConversationView(Qt.QWidget):
             "color_weak": color_weak,
         })
 
-    def handle_live_message(self, timestamp, message_uid, is_self, from_jid,
-                            from_, color_input, message, tracker=None):
+    def _note_live_message(self, timestamp, message_uid, is_self,
+                           alert=True):
         if (self.__most_recent_message_ts is None or
                 timestamp >= self.__most_recent_message_ts):
             self.__most_recent_message_uid = message_uid
@@ -959,15 +1907,85 @@ class ConversationView(Qt.QWidget):
                     self._page_ready) or is_self:
                 self.__node.set_read_up_to(self.__most_recent_message_uid)
 
-            if not is_self:
+            if alert and not is_self:
                 Qt.QApplication.alert(self.window())
 
+    def replay_live_events(self, events):
+        """
+        Catch up with live events which arrived before the view existed.
+
+        :param events: Events, oldest first. Messages are given as
+            ``("message", (args, kwargs))`` and markers as
+            ``("marker", args)``, with the arguments of the respective
+            signal.
+
+        Messages are sent to the page once the backlog from the archive has
+        been loaded, unless the backlog contains them already. Markers are
+        forwarded to the page.
+        """
+        for kind, argv in events:
+            if kind == "message":
+                args, kwargs = argv
+                timestamp, message_uid, is_self, _, from_ = args[:5]
+                self._note_live_message(timestamp, message_uid, is_self,
+                                        alert=False)
+                self._note_speaker(is_self, from_)
+                self.__replayed_messages.append((args, kwargs))
+            elif kind == "marker":
+                self.handle_live_marker(*argv)
+
+        if self._page_ready and self.__hibernated_events is None:
+            # a pooled page has been ready already and the backlog is loaded
+            self._flush_replayed_messages()
+
+    def _flush_replayed_messages(self):
+        messages = self.__replayed_messages
+        self.__replayed_messages = []
+        for args, kwargs in messages:
+            if str(args[1]) in self.__backlog_uids:
+                continue
+            self._queue_live_message(*args, **kwargs)
+
+    def _note_speaker(self, is_self, from_):
+        if self.__nick_index is not None and not is_self:
+            self.__nick_index.note_speaker(from_)
+
+    def handle_live_message(self, timestamp, message_uid, is_self, from_jid,
+                            from_, color_input, message, tracker=None):
+        self._note_live_message(timestamp, message_uid, is_self)
+        self._note_speaker(is_self, from_)
+        self._queue_live_message(timestamp, message_uid, is_self, from_jid,
+                                 from_, color_input, message,
+                                 tracker=tracker)
+
+    def _queue_live_message(self, timestamp, message_uid, is_self, from_jid,
+                            from_, color_input, message, tracker=None):
         if not self._page_ready:
             self.logger.debug("dropping message since page isn’t ready")
             return
 
-        body_html, (urls,) = self.htmlify_body(message.body.any(),
-                                               from_)
+        data = self._format_message(timestamp, message_uid, is_self,
+                                    from_jid, from_, color_input, message)
+
+        self.logger.debug("queueing data for JS: %r", data)
+
+        # messages are sent to the page in batches; this coalesces bursts of
+        # live messages into a single update of the view
+        self.__pending_messages.append((data, message_uid, tracker))
+        if len(self.__pending_messages) == 1:
+            asyncio.get_event_loop().call_soon(self._flush_pending_messages)
+
+    def _format_message(self, timestamp, message_uid, is_self, from_jid,
+                        from_, color_input, message):
+        body = message.body.any()
+        try:
+            key, rendered = self.__rendered_bodies[message_uid]
+        except KeyError:
+            key, rendered = None, None
+        if key != (body, from_):
+            rendered = self.htmlify_body(body, from_)
+            self.__rendered_bodies[message_uid] = (body, from_), rendered
+        body_html, (urls,) = rendered
         color_full, color_weak = self.make_css_colors(color_input)
 
         attachments = []
@@ -999,11 +2017,28 @@ class ConversationView(Qt.QWidget):
         }
 
         self.logger.debug("detected URLs: %s", urls)
-        self.logger.debug("sending data to JS: %r", data)
 
-        self.history.channel.on_message.emit(data)
+        return data
 
-        if tracker is not None:
+    def _flush_pending_messages(self):
+        if not self.__pending_messages:
+            return
+
+        # presence which happened before these messages goes first
+        self._flush_pending_presence()
+
+        pending = self.__pending_messages
+        self.__pending_messages = []
+
+        self.logger.debug("sending %d messages to JS", len(pending))
+        self._emit_to_page(
+            "on_messages",
+            [data for data, _, _ in pending],
+        )
+
+        for _, message_uid, tracker in pending:
+            if tracker is None:
+                continue
             self._emit_tracker_event(message_uid, tracker.state)
             if not tracker.closed:
                 tracker.on_state_changed.connect(
@@ -1017,6 +2052,7 @@ class ConversationView(Qt.QWidget):
         if not self._page_ready:
             return
 
+        self._flush_pending_messages()
         self._emit_tracker_event(message_uid, new_state, response=response)
 
     def _emit_tracker_event(self, message_uid, new_state, response=None):
@@ -1049,7 +2085,8 @@ class ConversationView(Qt.QWidget):
         self.logger.debug("forwarding flag to view: message_uid=%r, flag=%s",
                           message_uid,
                           state_name)
-        self.history.channel.on_flag.emit(
+        self._emit_to_page(
+            "on_flag",
             {
                 "flagged_message_uid": str(message_uid),
                 "flag": state_name,
@@ -1058,6 +2095,8 @@ class ConversationView(Qt.QWidget):
         )
 
     def showEvent(self, event: Qt.QShowEvent):
+        self.restore()
+        self.__page_pool.touch(self)
         self.__node.set_read_up_to(self.__most_recent_message_uid)
         return super().showEvent(event)
 
@@ -1072,7 +2111,8 @@ class ConversationView(Qt.QWidget):
         if self.__node.account != account:
             return
 
-        self.history.channel.on_avatar_changed.emit(
+        self._emit_to_page(
+            "on_avatar_changed",
             {
                 "address": str(address),
             }
@@ -0,0 +1,150 @@
+import html
+
+from datetime import datetime
+
+from .. import Qt, search
+
+from ..ui import dlg_search_history
+
+
+def _local_datetime(timestamp: datetime) -> Qt.QDateTime:
+    # timestamps in the index are naive UTC
+    return Qt.QDateTime(
+        Qt.QDate(timestamp.year, timestamp.month, timestamp.day),
+        Qt.QTime(timestamp.hour, timestamp.minute, timestamp.second),
+        Qt.Qt.UTC,
+    ).toLocalTime()
+
+
+class SearchResultsModel(Qt.QAbstractListModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._results = []
+
+    def rowCount(self, parent):
+        if parent.isValid():
+            return 0
+        return len(self._results)
+
+    def clear(self):
+        self.beginResetModel()
+        self._results.clear()
+        self.endResetModel()
+
+    def extend(self, results):
+        if not results:
+            return
+        start = len(self._results)
+        self.beginInsertRows(Qt.QModelIndex(),
+                             start, start + len(results) - 1)
+        self._results.extend(results)
+        self.endInsertRows()
+
+    def result(self, index):
+        return self._results[index.row()]
+
+    def data(self, index, role):
+        if not index.isValid():
+            return None
+
+        result = self._results[index.row()]
+
+        if role == Qt.Qt.DisplayRole:
+            snippet = result.snippet.replace(
+                search.MATCH_START, ""
+            ).replace(
+                search.MATCH_END, ""
+            )
+            return "{} — {}: {}".format(
+                result.conversation,
+                result.display_name,
+                " ".join(snippet.split()),
+            )
+        elif role == Qt.Qt.ToolTipRole:
+            return "<p><b>{}</b> ({})</p><p>{}: {}</p>".format(
+                html.escape(_local_datetime(result.timestamp).toString()),
+                html.escape(result.conversation),
+                html.escape(result.display_name),
+                search.snippet_to_html(result.snippet),
+            )
+
+
+class DlgSearchHistory(Qt.QDialog):
+    """
+    Search the local index of all conversations.
+
+    Activating a result emits :attr:`jump_requested` with the account JID,
+    the conversation JID and the message uid, all as strings.
+    """
+
+    PAGE_SIZE = 50
+
+    jump_requested = Qt.pyqtSignal([str, str, str])
+
+    def __init__(self, index: search.MessageSearchIndex, parent=None):
+        super().__init__(parent)
+        self.ui = dlg_search_history.Ui_DlgSearchHistory()
+        self.ui.setupUi(self)
+
+        self._index = index
+        self._next_cursor = None
+
+        self._model = SearchResultsModel(self)
+        self.ui.results.setModel(self._model)
+        self.ui.results.activated.connect(self._result_activated)
+
+        # run the search only once the user stopped typing for a moment
+        self._search_timer = Qt.QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(200)
+        self._search_timer.timeout.connect(self._search)
+
+        self.ui.query.textChanged.connect(self._search_timer.start)
+        self.ui.more.clicked.connect(self._load_more)
+
+    def _search(self):
+        self._model.clear()
+        self._next_cursor = None
+        self._load_more()
+
+    def _load_more(self):
+        page = self._index.search(
+            self.ui.query.text(),
+            limit=self.PAGE_SIZE,
+            cursor=self._next_cursor,
+        )
+        self._model.extend(page.results)
+        self._next_cursor = page.next_cursor
+        self.ui.more.setEnabled(page.next_cursor is not None)
+
+        nresults = self._model.rowCount(Qt.QModelIndex())
+        if not self.ui.query.text().strip():
+            self.ui.status.setText("")
+        elif nresults == 0:
+            self.ui.status.setText(Qt.translate(
+                "DlgSearchHistory",
+                "No messages found",
+            ))
+        elif page.next_cursor is not None:
+            self.ui.status.setText(Qt.translate(
+                "DlgSearchHistory",
+                "Showing the {} most recent matches",
+            ).format(nresults))
+        else:
+            self.ui.status.setText(Qt.translate(
+                "DlgSearchHistory",
+                "{} matches",
+            ).format(nresults))
+
+    def _result_activated(self, index):
+        result = self._model.result(index)
+        self.jump_requested.emit(
+            result.account,
+            result.conversation,
+            result.message_uid,
+        )
+
+    def showEvent(self, event):
+        self.ui.query.setFocus()
+        self.ui.query.selectAll()
+        return super().showEvent(event)
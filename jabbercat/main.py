@@ -18,7 +18,7 @@ import jabbercat.avatar
 
 from . import (
     Qt, client, utils,
-    conversation, models, taskmanager,
+    conversation, models, search, taskmanager,
     webintegration,
 )
 
@@ -29,6 +29,7 @@ from .dialogs import (
     add_contact,
     python_console,
     contact_requests,
+    search_history,
 )
 
 from .widgets import (
@@ -272,6 +273,20 @@ class MainWindow(Qt.QMainWindow):
             Qt.QApplication.aboutQt,
         )
 
+        self.search_history = search_history.DlgSearchHistory(
+            self.main.history_index.index,
+            self,
+        )
+        self.search_history.jump_requested.connect(
+            self._jump_to_message
+        )
+        self.ui.action_search_history.triggered.connect(
+            self._open_search_history
+        )
+        self.ui.action_search_history.setEnabled(
+            self.main.history_index.index.available
+        )
+
         self.ui.conversations_view.placeholder_text = (
             "Start a conversation by double-clicking an item from the roster!"
         )
@@ -354,6 +369,40 @@ class MainWindow(Qt.QMainWindow):
     def _open_python_console(self):
         self.python_console.show()
 
+    def _open_search_history(self):
+        self.search_history.show()
+        self.search_history.raise_()
+        self.search_history.activateWindow()
+
+    def _find_conversation(self, account_jid, conversation_jid):
+        for wrapper in self.__convmap:
+            if (str(wrapper.account.jid) == account_jid and
+                    str(wrapper.conversation_address) == conversation_jid):
+                return wrapper
+
+        # conversations with contacts can be opened from the roster
+        for item in self.main.roster:
+            if isinstance(item, jclib.roster.SubscriptionRequestItem):
+                continue
+            if (str(item.account.jid) == account_jid and
+                    str(item.address) == conversation_jid):
+                return self._open_roster_item(item)
+
+        return None
+
+    def _jump_to_message(self, account_jid, conversation_jid, message_uid):
+        wrapper = self._find_conversation(account_jid, conversation_jid)
+        if wrapper is None:
+            logger.info("cannot open conversation %s of %s to jump to a "
+                        "message",
+                        conversation_jid, account_jid)
+            return
+
+        page = self.__convmap[wrapper]
+        self._select_conversation(wrapper)
+        self._activate_conversation_page(page, transfer_focus=False)
+        page.materialise().jump_to_message(message_uid)
+
     def _find_tag_index(self, tag):
         for i in range(self.checked_tags.rowCount()):
             index = self.checked_tags.index(i, 0)
@@ -438,23 +487,29 @@ class MainWindow(Qt.QMainWindow):
             unfiltered_index,
             models.ROLE_OBJECT,
         )
+        wrapper = self._open_roster_item(item)
+        if wrapper is None:
+            # FIXME: show a user-visible error here
+            return
+
+        # we need to clear first so that the roster is hidden
+        if self.filtered_roster.rowCount() == 1:
+            self.ui.magic_bar.clear()
+
+        self._select_conversation(wrapper)
+
+    def _open_roster_item(self, item):
         account = item.account
         try:
             client = self.main.client.client_by_account(account)
         except KeyError:
-            # FIXME: show a user-visible error here
-            return
+            return None
 
         conv = item.create_conversation(client)
         wrapper = self.main.conversations.adopt_conversation(account, conv)
         page = self.__convmap[wrapper]
         self.__pagemap[page] = wrapper
-
-        # we need to clear first so that the roster is hidden
-        if self.filtered_roster.rowCount() == 1:
-            self.ui.magic_bar.clear()
-
-        self._select_conversation(wrapper)
+        return wrapper
 
     def _roster_context_menu_requested(self, pos):
         self._roster_item_menu.popup(self.ui.roster_view.mapToGlobal(pos))
@@ -520,11 +575,12 @@ class MainWindow(Qt.QMainWindow):
         self.ui.roster_view.edit(index)
 
     def _conversation_added(self, wrapper):
-        page = conversation.ConversationView(
+        page = conversation.LazyConversationView(
             wrapper,
             self.main.avatar,
             self.main.metadata,
-            self.main.web_profile,
+            self.main.page_pool,
+            search_index=self.main.history_index.index,
         )
         self.__convmap[wrapper] = page
         self.__pagemap[page] = wrapper
@@ -535,6 +591,7 @@ class MainWindow(Qt.QMainWindow):
     def _conversation_removed(self, wrapper):
         page = self.__convmap.pop(wrapper)
         self.ui.conversation_pages.removeWidget(page)
+        page.teardown()
         del self.__pagemap[page]
 
     def _activate_conversation_page(
@@ -772,6 +829,12 @@ class QtMain(jclib.main.Main):
             b"avatar",
             self.avatar_urls,
         )
+        self.page_pool = conversation.MessageViewPagePool(self.web_profile)
+        self.history_index = search.HistoryIndexer(
+            self.conversations,
+            self.writeman,
+            search.HistoryIndexer.get_default_path(),
+        )
         self.window = MainWindow(self)
 
     @asyncio.coroutine
@@ -779,6 +842,7 @@ class QtMain(jclib.main.Main):
         self.window.show()
         yield from super().run_core()
         self.avatar.close()
+        self.history_index.close()
         try:
             yield from asyncio.wait_for(self.client.shutdown(),
                                         timeout=5)
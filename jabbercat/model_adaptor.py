@@ -1,3 +1,5 @@
+import typing
+
 from . import Qt
 
 
@@ -50,6 +52,109 @@ class ModelListAdaptor:
         self.model.endMoveRows()
 
 
+class ModelListIndex:
+    """
+    Map keys of the items in a model list to the rows they occupy.
+
+    :param mlist: The model list to index.
+    :param key_func: Function returning the key of an item.
+
+    The index is built lazily on the first lookup. Appending or removing
+    rows at the end of the list updates it in place; any other structural
+    change causes a rebuild on the next lookup. Changes to the keys of
+    existing items are not tracked.
+    """
+
+    def __init__(self, mlist, key_func):
+        super().__init__()
+        self._mlist = mlist
+        self._key_func = key_func
+        self._rows = None
+        self._pending_insert = None
+
+        mlist.begin_insert_rows.connect(self._begin_insert_rows)
+        mlist.end_insert_rows.connect(self._end_insert_rows)
+
+        mlist.begin_remove_rows.connect(self._begin_remove_rows)
+
+        mlist.begin_move_rows.connect(self._begin_move_rows)
+
+    def _rebuild(self):
+        rows = {}
+        for i, item in enumerate(self._mlist):
+            rows.setdefault(self._key_func(item), []).append(i)
+        self._rows = rows
+
+    def invalidate(self):
+        """
+        Force a rebuild of the index on the next lookup.
+        """
+        self._rows = None
+
+    def _begin_insert_rows(self, _, index1, index2):
+        if self._rows is not None and index1 == len(self._mlist):
+            self._pending_insert = index1, index2
+        else:
+            self._rows = None
+
+    def _end_insert_rows(self):
+        pending, self._pending_insert = self._pending_insert, None
+        if pending is None or self._rows is None:
+            return
+
+        index1, index2 = pending
+        for i in range(index1, index2 + 1):
+            self._rows.setdefault(self._key_func(self._mlist[i]),
+                                  []).append(i)
+
+    def _begin_remove_rows(self, _, index1, index2):
+        if self._rows is None:
+            return
+
+        if index2 != len(self._mlist) - 1:
+            self._rows = None
+            return
+
+        for i in range(index1, index2 + 1):
+            key = self._key_func(self._mlist[i])
+            rows = self._rows[key]
+            rows.remove(i)
+            if not rows:
+                del self._rows[key]
+
+    def _begin_move_rows(self, *args):
+        self._rows = None
+
+    def lookup(self, key) -> typing.List[int]:
+        """
+        Return the rows of the items with the given `key`.
+
+        The list is sorted and empty if no item has the key.
+        """
+        if self._rows is None:
+            self._rebuild()
+        return list(self._rows.get(key, ()))
+
+
+def contiguous_ranges(rows: typing.Iterable[int]) \
+        -> typing.Iterator[typing.Tuple[int, int]]:
+    """
+    Group row numbers into inclusive ``(first, last)`` ranges.
+
+    The rows are sorted and deduplicated first.
+    """
+    first = last = None
+    for row in sorted(set(rows)):
+        if last is not None and row == last + 1:
+            last = row
+            continue
+        if first is not None:
+            yield first, last
+        first = last = row
+    if first is not None:
+        yield first, last
+
+
 # class ListModel(Qt.QAbstractListModel):
 #     def __init__(self, mlist, handler, *, parent=None):
 #         super().__init__(parent)
@@ -1,12 +1,16 @@
+import asyncio
 import bisect
+import collections
 import collections.abc
 import enum
+import functools
 import typing
 import unicodedata
 
 import lxml.builder
 import lxml.etree
 
+import aioxmpp.cache
 import aioxmpp.callbacks
 import aioxmpp.structs
 
@@ -15,10 +19,8 @@ import jclib.identity
 import jclib.instrumentable_list
 import jclib.metadata
 import jclib.roster
-import jclib.utils
 
 import jabbercat.avatar
-import jabbercat.utils
 
 from . import Qt, model_adaptor, utils
 
@@ -143,6 +145,11 @@ class ConversationsModel(Qt.QAbstractTableModel):
         self.__adaptor = model_adaptor.ModelListAdaptor(
             self.__conversations, self
         )
+        self.__index = model_adaptor.ModelListIndex(
+            self.__conversations,
+            lambda item: (item.account, item.conversation_address),
+        )
+        self.__pending_avatar_changes = set()
 
     def columnCount(self, index):
         return self.COLUMN_COUNT
@@ -179,12 +186,18 @@ class ConversationsModel(Qt.QAbstractTableModel):
             return self.__conversations[index.row()]
 
     def _on_avatar_changed(self, account, address):
-        for i, item in enumerate(self.__conversations):
-            if item.account != account or item.conversation_address != address:
-                continue
-            index = self.index(i, 0)
-            self.dataChanged.emit(index, index, [Qt.Qt.DecorationRole])
-            return
+        if not self.__pending_avatar_changes:
+            asyncio.get_event_loop().call_soon(self._flush_avatar_changes)
+        self.__pending_avatar_changes.add((account, address))
+
+    def _flush_avatar_changes(self):
+        keys = self.__pending_avatar_changes
+        self.__pending_avatar_changes = set()
+        rows = [row for key in keys for row in self.__index.lookup(key)]
+        for first, last in model_adaptor.contiguous_ranges(rows):
+            self.dataChanged.emit(self.index(first, 0),
+                                  self.index(last, 0),
+                                  [Qt.Qt.DecorationRole])
 
 
 class RosterTagsModel(Qt.QAbstractListModel):
@@ -566,6 +579,86 @@ class FlattenModelToSeparators(Qt.QAbstractProxyModel):
         return self._map_firstlevel_to_source(proxyIndex)
 
 
+class TooltipCache:
+    """
+    Cache for rendered tooltips of list items showing an avatar.
+
+    :param maxsize: Maximum number of tooltips and avatar data URIs to keep.
+
+    Tooltips are keyed by the identity of the item they belong to and are
+    grouped by the address of the avatar they show. Changes of the avatar or
+    of other information about the address thus drop the whole group (see
+    :meth:`avatar_changed` and :meth:`peer_changed`), everything else which
+    is shown in a tooltip must be invalidated explicitly with
+    :meth:`invalidate`.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        super().__init__()
+        # keyed by (account, address, key), grouped by (account, address)
+        self._tooltips = jabbercat.avatar.GroupedLRUDict(
+            maxsize,
+            lambda key: key[:2],
+        )
+        # keyed by (account, address, nickname), grouped likewise
+        self._avatar_uris = jabbercat.avatar.GroupedLRUDict(
+            maxsize,
+            lambda key: key[:2],
+        )
+
+    def avatar_changed(self, account, address):
+        self._avatar_uris.pop_group((account, address))
+        self.peer_changed(account, address)
+
+    def peer_changed(self, account, address):
+        """
+        Invalidate the tooltips of an address, but not its avatar.
+        """
+        self._tooltips.pop_group((account, address))
+
+    def avatar_data_uri(self, account, address, nickname,
+                        get_picture: typing.Callable[[], Qt.QPicture]) -> str:
+        """
+        Return the avatar as data URI, rendering it only once per change.
+        """
+        key = account, address, nickname
+        try:
+            return self._avatar_uris[key]
+        except KeyError:
+            pass
+        uri = utils.qtpicture_to_data_uri(get_picture())
+        self._avatar_uris[key] = uri
+        return uri
+
+    def get(self, key, account, address,
+            render: typing.Callable[[], str]) -> str:
+        """
+        Return the tooltip for `key`, rendering it with `render` if needed.
+
+        :param account: Account of the avatar shown in the tooltip.
+        :param address: Address of the avatar shown in the tooltip.
+        """
+        full_key = account, address, key
+        try:
+            return self._tooltips[full_key]
+        except KeyError:
+            pass
+
+        tooltip = render()
+        self._tooltips[full_key] = tooltip
+        return tooltip
+
+    def invalidate(self, key, account, address):
+        """
+        Invalidate the tooltip for `key` showing the avatar of `address`.
+        """
+        self._tooltips.discard((account, address, key))
+
+    def clear(self):
+        self._tooltips.clear()
+        self._avatar_uris.clear()
+
+
 class RosterModel(Qt.QAbstractListModel):
     on_label_edited = aioxmpp.callbacks.Signal()
 
@@ -595,13 +688,61 @@ class RosterModel(Qt.QAbstractListModel):
         self.__adaptor = model_adaptor.ModelListAdaptor(
             self._items, self
         )
+        self.__index = model_adaptor.ModelListIndex(
+            self._items,
+            lambda item: (item.account, item.address),
+        )
+        self.__pending_avatar_changes = set()
+        self.__tooltips = TooltipCache()
+        self._items.data_changed.connect(self._data_changed)
+        self._items.begin_remove_rows.connect(self._begin_remove_rows)
+        self._metadata.changed_signal(
+            jclib.metadata.PresenceMetadata.STANZA
+        ).connect(
+            self._on_presence_changed,
+            aioxmpp.callbacks.AdHocSignal.WEAK,
+        )
+
+    def _data_changed(self, _, index1, index2, column1, column2, roles):
+        # labels, subscription and tags are shown in the tooltip
+        for i in range(index1, index2 + 1):
+            item = self._items[i]
+            self.__tooltips.invalidate((item.account, item.address),
+                                       item.account, item.address)
+        self.dataChanged.emit(
+            self.index(index1, 0),
+            self.index(index2, 0),
+            roles or [],
+        )
+
+    def _begin_remove_rows(self, _, index1, index2):
+        for i in range(index1, index2 + 1):
+            item = self._items[i]
+            self.__tooltips.invalidate((item.account, item.address),
+                                       item.account, item.address)
+
+    def _on_presence_changed(self, key, account, peer, value):
+        if peer is None:
+            return
+        self.__tooltips.invalidate((account, peer), account, peer)
+        bare = peer.bare()
+        self.__tooltips.invalidate((account, bare), account, bare)
 
     def _format_tooltip(self, item):
-        picture = self._avatar_manager.get_avatar(
+        return self.__tooltips.get(
+            (item.account, item.address),
             item.account, item.address,
+            functools.partial(self._render_tooltip, item),
         )
 
-        picture_base64 = jabbercat.utils.qtpicture_to_data_uri(picture)
+    def _render_tooltip(self, item):
+        picture_base64 = self.__tooltips.avatar_data_uri(
+            item.account, item.address, None,
+            functools.partial(
+                self._avatar_manager.get_avatar,
+                item.account, item.address,
+            ),
+        )
 
         H = lxml.builder.ElementMaker()
 
@@ -736,15 +877,39 @@ class RosterModel(Qt.QAbstractListModel):
         return False
 
     def _on_avatar_changed(self, account, address):
-        for i, item in enumerate(self._items):
-            if item.account != account or item.address != address:
-                continue
-            index = self.index(i, 0)
-            self.dataChanged.emit(index, index, [Qt.Qt.DecorationRole])
-            return
+        self.__tooltips.avatar_changed(account, address)
+        if not self.__pending_avatar_changes:
+            asyncio.get_event_loop().call_soon(self._flush_avatar_changes)
+        self.__pending_avatar_changes.add((account, address))
+
+    def _flush_avatar_changes(self):
+        keys = self.__pending_avatar_changes
+        self.__pending_avatar_changes = set()
+        rows = [row for key in keys for row in self.__index.lookup(key)]
+        for first, last in model_adaptor.contiguous_ranges(rows):
+            self.dataChanged.emit(self.index(first, 0),
+                                  self.index(last, 0),
+                                  [Qt.Qt.DecorationRole])
 
 
 class RosterFilterModel(Qt.QSortFilterProxyModel):
+    """
+    Filter roster items by tags and text.
+
+    The normalised texts which are searched by :attr:`filter_by_text` are
+    computed once per item and kept until the source model reports a change
+    of the item's data, its removal or a reset.
+
+    The set of items matching a filter text is kept for the most recently
+    used texts. When the filter text is refined, only the items matching a
+    cached part of the new text are checked; going back to a cached text
+    does not check any item. Changes of the filter are applied once per
+    iteration of the event loop.
+    """
+
+    #: Number of filter texts for which the matching items are kept.
+    TEXT_MATCH_CACHE_SIZE = 32
+
     def __init__(self, parent: Qt.QObject=None):
         super().__init__(parent)
 
@@ -752,11 +917,136 @@ class RosterFilterModel(Qt.QSortFilterProxyModel):
         self._tags_filter_set = None
         self._tags_filter_set_connections = []
         self._filter_by_text = None
+        self._search_keys = {}
+        self._text_matches = collections.OrderedDict()
+        self._current_text_matches = None
+        self._source_connections = []
+        self._invalidate_pending = False
 
     @staticmethod
     def _normalize_for_find(s: str):
         return unicodedata.normalize("NFKC", s).casefold()
 
+    def setSourceModel(self, model: Qt.QAbstractItemModel):
+        for signal, slot in self._source_connections:
+            signal.disconnect(slot)
+        self._source_connections.clear()
+        self._source_reset()
+
+        if model is not None:
+            # connect before the base class does, so that stale keys and
+            # matches are updated before rows are re-filtered
+            self._source_connections = [
+                (model.dataChanged, self._source_data_changed),
+                (model.rowsInserted, self._source_rows_inserted),
+                (model.rowsAboutToBeRemoved, self._source_rows_removed),
+                (model.modelAboutToBeReset, self._source_reset),
+            ]
+            for signal, slot in self._source_connections:
+                signal.connect(slot)
+
+        super().setSourceModel(model)
+
+    def _source_items(self, parent=Qt.QModelIndex(), index1=0, index2=None):
+        source = self.sourceModel()
+        if index2 is None:
+            index2 = source.rowCount(parent) - 1
+        for i in range(index1, index2 + 1):
+            item = source.data(source.index(i, 0, parent), ROLE_OBJECT)
+            if (item is None or
+                    isinstance(item, jclib.roster.SubscriptionRequestItem)):
+                continue
+            yield item
+
+    def _update_text_matches(self, items):
+        for text, matches in self._text_matches.items():
+            for item in items:
+                if self._item_matches_text(item, text):
+                    matches.add(item)
+                else:
+                    matches.discard(item)
+
+    def _source_data_changed(self, topleft, bottomright, roles=[]):
+        items = list(self._source_items(topleft.parent(),
+                                        topleft.row(),
+                                        bottomright.row()))
+        for item in items:
+            self._search_keys.pop(item, None)
+        self._update_text_matches(items)
+
+    def _source_rows_inserted(self, parent, index1, index2):
+        self._update_text_matches(
+            list(self._source_items(parent, index1, index2))
+        )
+
+    def _source_rows_removed(self, parent, index1, index2):
+        for item in self._source_items(parent, index1, index2):
+            self._search_keys.pop(item, None)
+            for matches in self._text_matches.values():
+                matches.discard(item)
+
+    def _source_reset(self):
+        self._search_keys.clear()
+        self._text_matches.clear()
+        self._current_text_matches = None
+
+    def _get_search_keys(self, item) -> typing.Tuple[str, str]:
+        try:
+            return self._search_keys[item]
+        except KeyError:
+            pass
+        keys = (
+            self._normalize_for_find(str(item.address)),
+            self._normalize_for_find(item.label),
+        )
+        self._search_keys[item] = keys
+        return keys
+
+    def _item_matches_text(self, item, text: str) -> bool:
+        address_key, label_key = self._get_search_keys(item)
+        return text in address_key or text in label_key
+
+    def _get_text_matches(self, text: str) -> typing.Set:
+        try:
+            matches = self._text_matches[text]
+        except KeyError:
+            pass
+        else:
+            self._text_matches.move_to_end(text)
+            return matches
+
+        # an item which does not match a part of the text cannot match the
+        # whole text, so only the matches of the longest such part are
+        # checked
+        base = max(
+            (cached for cached in self._text_matches if cached in text),
+            key=len,
+            default=None,
+        )
+        if base is None:
+            candidates = self._source_items()
+        else:
+            candidates = self._text_matches[base]
+
+        matches = {
+            item for item in candidates
+            if self._item_matches_text(item, text)
+        }
+        self._text_matches[text] = matches
+        if len(self._text_matches) > self.TEXT_MATCH_CACHE_SIZE:
+            self._text_matches.popitem(last=False)
+        return matches
+
+    def _schedule_invalidate_filter(self):
+        if self._invalidate_pending:
+            return
+        self._invalidate_pending = True
+        asyncio.get_event_loop().call_soon(self._flush_invalidate_filter)
+
+    def _flush_invalidate_filter(self):
+        self._invalidate_pending = False
+        self.invalidateFilter()
+
     @property
     def tags_filter_model(self):
         return self._tags_filter_model
@@ -787,7 +1077,7 @@ class RosterFilterModel(Qt.QSortFilterProxyModel):
         self.invalidateFilter()
 
     def _tags_set_changed(self):
-        self.invalidateFilter()
+        self._schedule_invalidate_filter()
 
     @property
     def filter_by_text(self):
@@ -795,15 +1085,17 @@ class RosterFilterModel(Qt.QSortFilterProxyModel):
 
     @filter_by_text.setter
     def filter_by_text(self, value: str):
-        self._filter_by_text = self._normalize_for_find(value)
-        self.invalidateFilter()
+        value = self._normalize_for_find(value)
+        if value == self._filter_by_text:
+            return
+        self._filter_by_text = value
+        self._current_text_matches = None
+        self._schedule_invalidate_filter()
 
     @filter_by_text.deleter
     def filter_by_text(self):
         self._filter_by_text = None
-
-    def _contains_normalized(self, normed: str, other: str):
-        return normed in self._normalize_for_find(other)
+        self._current_text_matches = None
 
     def filterAcceptsRow(self,
                          source_row: int,
@@ -818,10 +1110,11 @@ class RosterFilterModel(Qt.QSortFilterProxyModel):
             return False
 
         if self._filter_by_text is not None:
-            if (not self._contains_normalized(self._filter_by_text,
-                                              str(item.address)) and
-                    not self._contains_normalized(self._filter_by_text,
-                                                  item.label)):
+            if self._current_text_matches is None:
+                self._current_text_matches = self._get_text_matches(
+                    self._filter_by_text
+                )
+            if item not in self._current_text_matches:
                 return False
 
         filter_tags = self._tags_filter_set.checked
@@ -856,9 +1149,7 @@ class TagsModel(Qt.QAbstractListModel):
         if role == Qt.Qt.DisplayRole or role == ROLE_OBJECT:
             return tag
         elif role == Qt.Qt.DecorationRole:
-            return utils.text_to_qtcolor(
-                jclib.utils.normalise_text_for_hash(tag)
-            )
+            return utils.text_colours.qtcolor(tag)
 
 
 class CheckModel(Qt.QIdentityProxyModel):
@@ -0,0 +1,434 @@
+"""
+Local full-text index over conversation history.
+
+The index is kept in an SQLite database using the FTS5 extension. Messages
+are added as they are received and whenever history is loaded from the
+archive; they are written in batches on writeback.
+"""
+import asyncio
+import collections
+import functools
+import html
+import logging
+import pathlib
+import re
+import sqlite3
+import typing
+
+from datetime import datetime, timedelta
+
+import aioxmpp.callbacks
+
+import jclib.storage
+
+from . import Qt
+
+
+logger = logging.getLogger(__name__)
+
+
+#: Marks the start of a matched term in :attr:`SearchResult.snippet`.
+MATCH_START = "\x02"
+
+#: Marks the end of a matched term in :attr:`SearchResult.snippet`.
+MATCH_END = "\x03"
+
+_EPOCH = datetime(1970, 1, 1)
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+SearchResult = collections.namedtuple(
+    "SearchResult",
+    [
+        "account",
+        "conversation",
+        "message_uid",
+        "timestamp",
+        "display_name",
+        "snippet",
+    ]
+)
+
+SearchPage = collections.namedtuple(
+    "SearchPage",
+    [
+        "results",
+        "next_cursor",
+    ]
+)
+
+
+def make_fts_query(text: str) -> typing.Optional[str]:
+    """
+    Convert user input into an FTS5 query.
+
+    :return: The query or :data:`None` if `text` contains nothing to search
+        for.
+
+    All words must match; the last word is matched as prefix so that results
+    show up while typing. Operators of the FTS5 query syntax are not exposed.
+    """
+    tokens = _TOKEN_RE.findall(text)
+    if not tokens:
+        return None
+    parts = ['"{}"'.format(token) for token in tokens]
+    parts[-1] += "*"
+    return " ".join(parts)
+
+
+def snippet_to_html(snippet: str) -> str:
+    """
+    Render a snippet as HTML with the matched terms in bold.
+    """
+    return html.escape(snippet).replace(
+        MATCH_START, "<b>"
+    ).replace(
+        MATCH_END, "</b>"
+    )
+
+
+def _to_timestamp_value(timestamp: datetime) -> float:
+    return (timestamp - _EPOCH).total_seconds()
+
+
+def _from_timestamp_value(value: float) -> datetime:
+    return _EPOCH + timedelta(seconds=value)
+
+
+class MessageSearchIndex:
+    """
+    Full-text index of messages.
+
+    :param path: Path of the database file or :data:`None` for an index which
+        is only kept in memory.
+
+    Messages are identified by account, conversation and message uid; adding
+    a message twice has no effect.
+
+    Added messages are buffered and written by :meth:`flush`, which happens
+    implicitly before each search. Whenever the buffer becomes non-empty,
+    :meth:`on_dirty` is emitted.
+
+    If SQLite was built without FTS5, :attr:`available` is false; messages
+    are then not indexed and searches return no results.
+
+    .. signal:: on_dirty()
+
+        Emits when the first message is buffered after a flush.
+    """
+
+    on_dirty = aioxmpp.callbacks.Signal()
+
+    def __init__(self, path: typing.Optional[pathlib.Path] = None):
+        super().__init__()
+        self.logger = logging.getLogger(
+            ".".join([__name__, type(self).__qualname__])
+        )
+        if path is None:
+            database = ":memory:"
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            database = str(path)
+        self._db = sqlite3.connect(database)
+        self._pending = []
+        self.available = True
+        try:
+            self._init_schema()
+        except sqlite3.OperationalError:
+            self.logger.error("failed to create the full-text index, "
+                              "history search is disabled",
+                              exc_info=True)
+            self.available = False
+
+    def _init_schema(self):
+        with self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS message ("
+                " id INTEGER PRIMARY KEY,"
+                " account TEXT NOT NULL,"
+                " conversation TEXT NOT NULL,"
+                " message_uid TEXT NOT NULL,"
+                " timestamp REAL NOT NULL,"
+                " display_name TEXT NOT NULL,"
+                " body TEXT NOT NULL,"
+                " UNIQUE (account, conversation, message_uid)"
+                ")"
+            )
+            # the FTS table only stores the index; the text is taken from
+            # the message table
+            self._db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5("
+                " body, display_name,"
+                " content='message', content_rowid='id',"
+                " tokenize='unicode61 remove_diacritics 1'"
+                ")"
+            )
+
+    def add_message(self,
+                    account: str,
+                    conversation: str,
+                    message_uid: str,
+                    timestamp: datetime,
+                    display_name: str,
+                    body: str):
+        """
+        Add a message to the index.
+
+        :param timestamp: Naive UTC timestamp of the message.
+        """
+        if not body or not self.available:
+            return
+        self._pending.append((
+            account,
+            conversation,
+            message_uid,
+            _to_timestamp_value(timestamp),
+            display_name or "",
+            body,
+        ))
+        if len(self._pending) == 1:
+            self.on_dirty()
+
+    def flush(self):
+        """
+        Write all buffered messages to the database.
+        """
+        if not self._pending:
+            return
+
+        pending = self._pending
+        self._pending = []
+
+        nadded = 0
+        with self._db:
+            cursor = self._db.cursor()
+            for row in pending:
+                cursor.execute(
+                    "INSERT OR IGNORE INTO message"
+                    " (account, conversation, message_uid, timestamp,"
+                    "  display_name, body)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    row,
+                )
+                if cursor.rowcount != 1:
+                    continue
+                cursor.execute(
+                    "INSERT INTO message_fts (rowid, body, display_name)"
+                    " VALUES (?, ?, ?)",
+                    (cursor.lastrowid, row[5], row[4]),
+                )
+                nadded += 1
+
+        self.logger.debug("indexed %d of %d messages", nadded, len(pending))
+
+    def search(self,
+               text: str,
+               *,
+               account: typing.Optional[str] = None,
+               conversation: typing.Optional[str] = None,
+               limit: int = 50,
+               cursor: typing.Optional[int] = None) -> SearchPage:
+        """
+        Search the index.
+
+        :param text: The words to search for.
+        :param account: If given, only return messages of this account.
+        :param conversation: If given, only return messages of this
+            conversation.
+        :param limit: Maximum number of results to return.
+        :param cursor: The :attr:`SearchPage.next_cursor` of the previous
+            page, to continue a search.
+        :return: A page of results.
+
+        Results are ordered from the most recently indexed message to the
+        oldest. This order is the one of the full-text index itself, which
+        keeps searches fast on large indices regardless of how common the
+        search terms are. :attr:`SearchPage.next_cursor` is :data:`None` on
+        the last page.
+        """
+        self.flush()
+
+        query = make_fts_query(text)
+        if query is None or not self.available:
+            return SearchPage([], None)
+
+        conditions = ["message_fts MATCH ?"]
+        args = [query]
+        if cursor is not None:
+            conditions.append("message_fts.rowid < ?")
+            args.append(cursor)
+        if account is not None:
+            conditions.append("m.account = ?")
+            args.append(account)
+        if conversation is not None:
+            conditions.append("m.conversation = ?")
+            args.append(conversation)
+        args.append(limit + 1)
+
+        rows = self._db.execute(
+            "SELECT m.id, m.account, m.conversation, m.message_uid,"
+            "  m.timestamp, m.display_name,"
+            "  snippet(message_fts, 0, ?, ?, '…', 16)"
+            " FROM message_fts JOIN message m ON m.id = message_fts.rowid"
+            " WHERE " + " AND ".join(conditions) +
+            " ORDER BY message_fts.rowid DESC"
+            " LIMIT ?",
+            [MATCH_START, MATCH_END] + args,
+        ).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1][0]
+
+        return SearchPage(
+            [
+                SearchResult(
+                    account,
+                    conversation,
+                    message_uid,
+                    _from_timestamp_value(timestamp),
+                    display_name,
+                    snippet,
+                )
+                for (_, account, conversation, message_uid, timestamp,
+                     display_name, snippet) in rows
+            ],
+            next_cursor,
+        )
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+
+def index_messages(index: MessageSearchIndex, node, messages):
+    """
+    Add messages of a conversation node to the index.
+
+    :param messages: Iterable of argument tuples as emitted by the
+        ``on_message`` signal of the node or returned by its
+        ``get_last_messages`` method.
+    """
+    account = str(node.account.jid)
+    conversation = str(node.conversation_address)
+    for timestamp, message_uid, _, _, display_name, _, message, *_ \
+            in messages:
+        index.add_message(
+            account,
+            conversation,
+            str(message_uid),
+            timestamp,
+            display_name,
+            message.body.any(),
+        )
+
+
+class HistoryIndexer:
+    """
+    Keep a :class:`MessageSearchIndex` up to date with all conversations.
+
+    :param conversations: The conversation manager.
+    :param writeman: Write manager used to schedule flushes of the index.
+    :param path: Path of the index database, see :class:`MessageSearchIndex`.
+
+    Live messages of every open conversation are indexed, as is the recent
+    history of each conversation when it is opened. The history is read from
+    the archive one conversation per iteration of the event loop, so that
+    opening many conversations at once (e.g. at startup) does not block.
+    """
+
+    BACKFILL_COUNT = 100
+
+    def __init__(self,
+                 conversations,
+                 writeman: jclib.storage.WriteManager,
+                 path: typing.Optional[pathlib.Path] = None):
+        super().__init__()
+        self.logger = logging.getLogger(
+            ".".join([__name__, type(self).__qualname__])
+        )
+        self._writeman = writeman
+        self.index = MessageSearchIndex(path)
+        self.index.on_dirty.connect(self._index_dirty)
+        writeman.on_writeback.connect(self._writeback)
+
+        self._tokens = {}
+        self._backfill_queue = collections.deque()
+        self._backfill_scheduled = False
+        conversations.on_conversation_added.connect(
+            self._conversation_added,
+        )
+        conversations.on_conversation_removed.connect(
+            self._conversation_removed,
+        )
+        for node in conversations:
+            self._conversation_added(node)
+
+    @staticmethod
+    def get_default_path() -> pathlib.Path:
+        return pathlib.Path(Qt.QStandardPaths.writableLocation(
+            Qt.QStandardPaths.AppDataLocation
+        )) / "history-index.sqlite"
+
+    def _conversation_added(self, node):
+        if node in self._tokens:
+            return
+        self._tokens[node] = node.on_message.connect(
+            functools.partial(self._on_message, node)
+        )
+        self._backfill_queue.append(node)
+        self._schedule_backfill()
+
+    def _conversation_removed(self, node):
+        try:
+            token = self._tokens.pop(node)
+        except KeyError:
+            return
+        node.on_message.disconnect(token)
+        try:
+            self._backfill_queue.remove(node)
+        except ValueError:
+            pass
+
+    def _schedule_backfill(self):
+        if self._backfill_scheduled or not self._backfill_queue:
+            return
+        self._backfill_scheduled = True
+        asyncio.get_event_loop().call_soon(self._backfill_next)
+
+    def _backfill_next(self):
+        self._backfill_scheduled = False
+        if not self._backfill_queue:
+            return
+
+        node = self._backfill_queue.popleft()
+        try:
+            index_messages(
+                self.index,
+                node,
+                node.get_last_messages(max_count=self.BACKFILL_COUNT),
+            )
+        except Exception:
+            self.logger.warning("failed to index history of %s",
+                                node.conversation_address,
+                                exc_info=True)
+
+        self._schedule_backfill()
+
+    def _on_message(self, node, *args, **kwargs):
+        index_messages(self.index, node, [args])
+
+    def _index_dirty(self):
+        self._writeman.request_writeback()
+
+    @asyncio.coroutine
+    def _writeback(self):
+        self.index.flush()
+
+    def close(self):
+        self._backfill_queue.clear()
+        self.index.close()
@@ -6,9 +6,11 @@ import hashlib
 import math
 import random
 import struct
+import typing
 import unicodedata
 import urllib.parse
 
+import aioxmpp.cache
 import aioxmpp.structs
 
 import jclib.utils
@@ -314,6 +316,86 @@ def text_to_qtcolor(text):
     return Qt.QColor(r * 255, g * 255, b * 255)
 
 
+class TextColourCache:
+    """
+    Bounded cache of the colours derived from texts.
+
+    :param maxsize: Maximum number of texts to keep colours for.
+
+    The texts are normalised with
+    :func:`jclib.utils.normalise_text_for_hash` before the colour is
+    derived, so that all call sites agree on the colour of a name or tag.
+
+    The shared instance is :data:`text_colours`.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        super().__init__()
+        self._qtcolors = aioxmpp.cache.LRUDict()
+        self._qtcolors.maxsize = maxsize
+        self._css_colors = aioxmpp.cache.LRUDict()
+        self._css_colors.maxsize = maxsize
+
+    def _get_qtcolor(self, text: str) -> Qt.QColor:
+        try:
+            return self._qtcolors[text]
+        except KeyError:
+            pass
+        colour = text_to_qtcolor(jclib.utils.normalise_text_for_hash(text))
+        self._qtcolors[text] = colour
+        return colour
+
+    def qtcolor(self, text: str) -> Qt.QColor:
+        """
+        Return the colour for `text`.
+
+        The returned object is a copy and may be modified freely.
+        """
+        return Qt.QColor(self._get_qtcolor(text))
+
+    def css_colors(self, text: str) -> typing.Tuple[str, str]:
+        """
+        Return the CSS colours for `text`.
+
+        :return: A pair of a full colour for text and a weak gradient for
+            backgrounds.
+        """
+        try:
+            return self._css_colors[text]
+        except KeyError:
+            pass
+
+        qtcolor = self._get_qtcolor(text)
+        color_full = "rgba({:d}, {:d}, {:d}, 1.0)".format(
+            round(qtcolor.red() * 0.8),
+            round(qtcolor.green() * 0.8),
+            round(qtcolor.blue() * 0.8),
+        )
+        light_factor = 0.1
+        color_weak = (
+            "linear-gradient(135deg, "
+            "rgba({:d}, {:d}, {:d}, {}), "
+            "transparent 10em)".format(
+                round(qtcolor.red()),
+                round(qtcolor.green()),
+                round(qtcolor.blue()),
+                light_factor,
+            )
+        )
+
+        result = color_full, color_weak
+        self._css_colors[text] = result
+        return result
+
+    def clear(self):
+        self._qtcolors.clear()
+        self._css_colors.clear()
+
+
+#: Shared :class:`TextColourCache`.
+text_colours = TextColourCache()
+
+
 def qtpicture_to_data_uri(picture, w=48, h=48):
     canvas = Qt.QImage(w, h, Qt.QImage.Format_ARGB32_Premultiplied)
     canvas.fill(0)
@@ -13,19 +13,80 @@ logger = logging.getLogger(__name__)
 
 
 class AvatarURLSchemeHandler(Qt.QWebEngineUrlSchemeHandler):
+    """
+    Serve avatars as PNG images for the ``avatar:`` URL scheme.
+
+    The query of the URL selects the avatar: ``account`` and ``peer`` are
+    required, ``nick`` is the optional name surrogate and ``size`` and
+    ``dpr`` select the logical size (defaulting to :data:`DEFAULT_SIZE`)
+    and the device pixel ratio (defaulting to 1) of the image.
+
+    Encoded images are cached until the avatar of the peer changes or they
+    are evicted by more recently used ones.
+    """
+
+    DEFAULT_SIZE = avatar.BASE_SIZE
+    MAX_SIZE = 256
+    MAX_DEVICE_PIXEL_RATIO = 8
+
     def __init__(self,
                  accounts: jclib.identity.Accounts,
                  avatar_manager: avatar.AvatarManager,
-                 parent: Qt.QObject = None) -> None:
+                 parent: Qt.QObject = None,
+                 cache_size: int = 256) -> None:
         super().__init__(parent)
         self._accounts = accounts
         self._avatar_manager = avatar_manager
         self._buffers = set()
+        # grouped by peer, so that changed avatars can be dropped
+        self._png_cache = avatar.GroupedLRUDict(cache_size,
+                                                lambda key: key[:2])
+        avatar_manager.on_avatar_changed.connect(self._on_avatar_changed)
+
+    def _on_avatar_changed(self, account, address):
+        self._png_cache.pop_group((account, address))
 
     def buffer_closing(self, buf):
         self._buffers.discard(buf)
         buf.deleteLater()
 
+    def _parse_float_arg(self, args, name, default, maximum):
+        try:
+            value_s, = args[name]
+        except KeyError:
+            return default
+        value = float(value_s)
+        if not 0 < value <= maximum:
+            raise ValueError("{} out of range: {}".format(name, value))
+        return value
+
+    def _render_png(self,
+                    account: jclib.identity.Account,
+                    peer: aioxmpp.JID,
+                    nickname: str,
+                    size: float,
+                    device_pixel_ratio: float) -> Qt.QByteArray:
+        key = account, peer, nickname, size, device_pixel_ratio
+        try:
+            return self._png_cache[key]
+        except KeyError:
+            pass
+
+        pixmap = self._avatar_manager.get_avatar_pixmap(
+            account, peer, size, device_pixel_ratio, nickname,
+        )
+
+        buffer_ = Qt.QBuffer()
+        buffer_.open(Qt.QIODevice.WriteOnly)
+        assert buffer_.isOpen()
+        assert buffer_.isWritable()
+        pixmap.toImage().save(buffer_, "PNG")
+        buffer_.close()
+
+        data = buffer_.data()
+        self._png_cache[key] = data
+        return data
+
     @utils.asyncify
     async def requestStarted(self, request: Qt.QWebEngineUrlRequestJob):
         url = request.requestUrl()
@@ -49,6 +110,12 @@ class AvatarURLSchemeHandler(Qt.QWebEngineUrlSchemeHandler):
             account_address = aioxmpp.JID.fromstr(account_s)
             peer_s, = args["peer"]
             peer = aioxmpp.JID.fromstr(peer_s)
+            size = self._parse_float_arg(
+                args, "size", self.DEFAULT_SIZE, self.MAX_SIZE,
+            )
+            device_pixel_ratio = self._parse_float_arg(
+                args, "dpr", 1.0, self.MAX_DEVICE_PIXEL_RATIO,
+            )
         except ValueError:
             request.fail(Qt.QWebEngineUrlRequestJob.UrlInvalid)
             return
@@ -65,20 +132,12 @@ class AvatarURLSchemeHandler(Qt.QWebEngineUrlSchemeHandler):
             request.fail(Qt.QWebEngineUrlRequestJob.UrlNotFound)
             return
 
-        picture = self._avatar_manager.get_avatar(account, peer, nickname)
-        canvas = Qt.QImage(48, 48, Qt.QImage.Format_ARGB32_Premultiplied)
-        canvas.fill(0)
-        painter = Qt.QPainter(canvas)
-        painter.drawPicture(0, 0, picture)
-        painter.end()
+        data = self._render_png(account, peer, nickname,
+                                size, device_pixel_ratio)
 
+        # QByteArray is implicitly shared, the buffer does not copy the data
         buffer_ = Qt.QBuffer()
-        buffer_.open(Qt.QIODevice.WriteOnly)
-        assert buffer_.isOpen()
-        assert buffer_.isWritable()
-        canvas.save(buffer_, "PNG")
-        buffer_.close()
-
+        buffer_.setData(data)
         buffer_.open(Qt.QIODevice.ReadOnly)
         assert buffer_.isOpen()
         assert buffer_.isReadable()
@@ -87,6 +146,7 @@ class AvatarURLSchemeHandler(Qt.QWebEngineUrlSchemeHandler):
                      peer,
                      account_address)
 
+        self._buffers.add(buffer_)
         request.reply(b"image/png", buffer_)
 
         buffer_.aboutToClose.connect(
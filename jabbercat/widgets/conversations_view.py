@@ -1,6 +1,6 @@
 import typing
 
-from .. import Qt, models, avatar
+from .. import Qt, models
 from .misc import PlaceholderListView
 
 
@@ -218,16 +218,13 @@ class ConversationItemDelegate(Qt.QItemDelegate):
             self.PADDING + self.UNREAD_COUNTER_VERT_PADDING,
         )
 
-        pic = self.avatar_manager.get_avatar(
+        pixmap = self.avatar_manager.get_avatar_pixmap(
             item.account,
             item.conversation_address,
+            avatar_size,
+            painter.device().devicePixelRatioF(),
         )
-        backup = painter.worldTransform()
-        avatar_scale_factor = avatar_size / avatar.BASE_SIZE
-        painter.translate(top_left)
-        painter.scale(avatar_scale_factor, avatar_scale_factor)
-        painter.drawPicture(Qt.QPointF(), pic)
-        painter.setWorldTransform(backup)
+        painter.drawPixmap(top_left, pixmap)
 
         top_left += Qt.QPoint(
             avatar_size + self.AVATAR_PADDING,
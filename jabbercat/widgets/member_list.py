@@ -67,18 +67,14 @@ class MemberItemDelegate(Qt.QItemDelegate):
                      option.rect.bottomRight() - padding_point)
         )
 
-        pic = self.avatar_manager.get_avatar(
+        pixmap = self.avatar_manager.get_avatar_pixmap(
             self.account,
             item.direct_jid or item.conversation_jid,
+            self.AVATAR_SIZE,
+            painter.device().devicePixelRatioF(),
             getattr(item, "nick", None),
         )
-
-        backup = painter.worldTransform()
-        avatar_scale_factor = self.AVATAR_SIZE / avatar.BASE_SIZE
-        painter.translate(top_left)
-        painter.scale(avatar_scale_factor, avatar_scale_factor)
-        painter.drawPicture(Qt.QPointF(), pic)
-        painter.setWorldTransform(backup)
+        painter.drawPixmap(top_left, pixmap)
 
         painter.setRenderHint(Qt.QPainter.Antialiasing, True)
 
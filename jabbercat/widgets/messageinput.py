@@ -1,7 +1,34 @@
-from .. import Qt
+from .. import Qt, completion
 
 
 class MemberCompleter(Qt.QCompleter):
+    """
+    Completer for nicknames backed by a
+    :class:`~.completion.NickCompletionIndex`.
+
+    The model of the completer only holds the best matches for the current
+    prefix, which are looked up in the index whenever the prefix changes.
+    """
+
+    MAX_COMPLETIONS = 20
+
+    def __init__(self, index: completion.NickCompletionIndex, parent=None):
+        super().__init__(parent)
+        self._index = index
+        self._model = completion.NickCompletionModel(self)
+        self.setModel(self._model)
+        self.setCompletionRole(Qt.Qt.DisplayRole)
+        self.setCompletionColumn(0)
+        # the model is filtered already
+        self.setCompletionMode(Qt.QCompleter.UnfilteredPopupCompletion)
+        self.setCaseSensitivity(Qt.Qt.CaseInsensitive)
+
+    def setCompletionPrefix(self, prefix: str):
+        self._model.set_completions(
+            self._index.complete(prefix, self.MAX_COMPLETIONS)
+        )
+        super().setCompletionPrefix(prefix)
+
     def complete(self, rect: Qt.QRect = Qt.QRect()):
         super().complete(rect)
         if self.popup().isVisible():
@@ -63,8 +90,6 @@ class MessageInput(Qt.QTextEdit):
         self._completer = new
         if self._completer is not None:
             self._completer.setWidget(self)
-            self._completer.setCompletionMode(Qt.QCompleter.PopupCompletion)
-            self._completer.setCaseSensitivity(Qt.Qt.CaseInsensitive)
             self._completer.activated.connect(self._completer_activated)
 
     def mousePressEvent(self, event: Qt.QMouseEvent):
@@ -108,6 +133,9 @@ class MessageInput(Qt.QTextEdit):
                 self._completer.popup().hide()
                 return
             self._completer.setCompletionPrefix(text)
+            if self._completer.completionCount() == 0:
+                self._completer.popup().hide()
+                return
             popup = self._completer.popup()
             cr = self.cursorRect(completion_cursor)
             cr.setWidth(
@@ -72,8 +72,8 @@ class RosterItemDelegate(Qt.QItemDelegate):
         ]
 
         text_colours = [
-            self._desaturate_tag_color(utils.text_to_qtcolor(normalized_tag))
-            for _, normalized_tag in tags
+            self._desaturate_tag_color(utils.text_colours.qtcolor(tag))
+            for tag, _ in tags
         ]
 
         tag_widths = [
@@ -245,10 +245,6 @@ class RosterItemDelegate(Qt.QItemDelegate):
 
         name = item.label
 
-        colour = utils.text_to_qtcolor(
-            name,
-        )
-
         avatar_size = min(option.rect.height() - self.PADDING * 2,
                           self.MAX_AVATAR_SIZE)
 
@@ -258,11 +254,13 @@ class RosterItemDelegate(Qt.QItemDelegate):
             option.rect.height() / 2 - avatar_size / 2
         )
 
-        pic = self.avatar_manager.get_avatar(
+        pixmap = self.avatar_manager.get_avatar_pixmap(
             item.account,
             item.address,
+            avatar_size,
+            painter.device().devicePixelRatioF(),
         )
-        painter.drawPicture(avatar_origin, pic)
+        painter.drawPixmap(avatar_origin, pixmap)
 
         if (option.state & Qt.QStyle.State_Selected and
                 option.state & Qt.QStyle.State_Active):
@@ -2,8 +2,6 @@ import functools
 
 import aioxmpp.callbacks
 
-import jclib.utils
-
 from .. import Qt, utils
 from ..ui import tags_input, tag_bubble
 
@@ -103,9 +101,7 @@ class TagBubble(Qt.QWidget):
     @text.setter
     def text(self, text):
         self._ui.label.setText(text)
-        color = utils.text_to_qtcolor(
-            jclib.utils.normalise_text_for_hash(text)
-        )
+        color = utils.text_colours.qtcolor(text)
         self._palette.setColor(Qt.QPalette.Window, color)
         self.setPalette(self._palette)
 
@@ -1,6 +1,10 @@
 import asyncio
+import concurrent.futures
 import contextlib
 import itertools
+import pathlib
+import tempfile
+import threading
 import unittest
 import unittest.mock
 
@@ -21,6 +25,136 @@ from aioxmpp.testutils import (
 
 TEST_JID1 = aioxmpp.JID.fromstr("romeo@montague.lit")
 TEST_JID2 = aioxmpp.JID.fromstr("juliet@capulet.lit")
+TEST_JID3 = aioxmpp.JID.fromstr("mercutio@montague.lit")
+
+
+class TestDummyAvatarCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = avatar.DummyAvatarCache()
+        self.font = unittest.mock.Mock(spec=Qt.QFont)
+        self.font.key.return_value = "font-key"
+
+    def test_get_renders_on_miss(self):
+        with contextlib.ExitStack() as stack:
+            render_dummy_avatar = stack.enter_context(unittest.mock.patch(
+                "jabbercat.avatar.render_dummy_avatar"
+            ))
+
+            result = self.cache.get(self.font, "Romeo", 48, "romeo@x.test")
+
+        render_dummy_avatar.assert_called_once_with(
+            self.font, "Romeo", 48, "romeo@x.test",
+        )
+        self.assertEqual(result, render_dummy_avatar())
+
+    def test_get_does_not_pass_colour_text_if_not_given(self):
+        with contextlib.ExitStack() as stack:
+            render_dummy_avatar = stack.enter_context(unittest.mock.patch(
+                "jabbercat.avatar.render_dummy_avatar"
+            ))
+
+            self.cache.get(self.font, "Romeo", 48)
+
+        render_dummy_avatar.assert_called_once_with(self.font, "Romeo", 48)
+
+    def test_get_shares_entries_by_grapheme_colour_font_and_size(self):
+        with contextlib.ExitStack() as stack:
+            render_dummy_avatar = stack.enter_context(unittest.mock.patch(
+                "jabbercat.avatar.render_dummy_avatar"
+            ))
+
+            self.cache.get(self.font, "Romeo", 48, "romeo@x.test")
+            self.cache.get(self.font, "Romeo", 48, "romeo@x.test")
+            self.cache.get(self.font, "Rom", 48, "romeo@x.test")
+
+            self.assertEqual(len(render_dummy_avatar.mock_calls), 1)
+
+            self.cache.get(self.font, "Juliet", 48, "romeo@x.test")
+            self.cache.get(self.font, "Romeo", 48, "juliet@x.test")
+            self.cache.get(self.font, "Romeo", 16, "romeo@x.test")
+            self.font.key.return_value = "other-font-key"
+            self.cache.get(self.font, "Romeo", 48, "romeo@x.test")
+
+        self.assertEqual(len(render_dummy_avatar.mock_calls), 5)
+
+    def test_invalidate_drops_entries_for_colour_text(self):
+        with contextlib.ExitStack() as stack:
+            render_dummy_avatar = stack.enter_context(unittest.mock.patch(
+                "jabbercat.avatar.render_dummy_avatar"
+            ))
+
+            self.cache.get(self.font, "Romeo", 48, "romeo@x.test")
+            self.cache.get(self.font, "Juliet", 48, "juliet@x.test")
+            self.cache.invalidate("romeo@x.test")
+            self.cache.get(self.font, "Romeo", 48, "romeo@x.test")
+            self.cache.get(self.font, "Juliet", 48, "juliet@x.test")
+
+        self.assertEqual(len(render_dummy_avatar.mock_calls), 3)
+
+    def test_respects_maxsize(self):
+        cache = avatar.DummyAvatarCache(maxsize=1)
+
+        with contextlib.ExitStack() as stack:
+            render_dummy_avatar = stack.enter_context(unittest.mock.patch(
+                "jabbercat.avatar.render_dummy_avatar"
+            ))
+
+            cache.get(self.font, "Romeo", 48)
+            cache.get(self.font, "Juliet", 48)
+            cache.get(self.font, "Romeo", 48)
+
+        self.assertEqual(len(render_dummy_avatar.mock_calls), 3)
+
+    def test_eviction_prunes_colour_index(self):
+        cache = avatar.DummyAvatarCache(maxsize=1)
+
+        with unittest.mock.patch("jabbercat.avatar.render_dummy_avatar"):
+            cache.get(self.font, "Romeo", 48, "romeo@x.test")
+            cache.get(self.font, "Juliet", 48, "juliet@x.test")
+
+        self.assertSequenceEqual(cache._cache.groups(), ["juliet@x.test"])
+
+
+def encode_png(width, height):
+    img = Qt.QImage(width, height, Qt.QImage.Format_ARGB32)
+    img.fill(Qt.QColor(255, 0, 0))
+    buffer_ = Qt.QBuffer()
+    buffer_.open(Qt.QIODevice.WriteOnly)
+    img.save(buffer_, "PNG")
+    buffer_.close()
+    return bytes(buffer_.data())
+
+
+class Testdecode_avatar_image(unittest.TestCase):
+    def test_decodes_small_image_unchanged(self):
+        img = avatar.decode_avatar_image(encode_png(32, 16))
+        self.assertEqual(img.width(), 32)
+        self.assertEqual(img.height(), 16)
+
+    def test_downscales_large_image_keeping_aspect_ratio(self):
+        img = avatar.decode_avatar_image(encode_png(400, 200), 100)
+        self.assertEqual(img.width(), 100)
+        self.assertEqual(img.height(), 50)
+
+    def test_defaults_to_DECODED_AVATAR_SIZE(self):
+        img = avatar.decode_avatar_image(encode_png(1000, 1000))
+        self.assertEqual(img.width(), avatar.DECODED_AVATAR_SIZE)
+        self.assertEqual(img.height(), avatar.DECODED_AVATAR_SIZE)
+
+    def test_returns_None_for_garbage(self):
+        self.assertIsNone(avatar.decode_avatar_image(b"foobar"))
+
+    def test_rejects_too_much_data(self):
+        data = encode_png(32, 32)
+        with unittest.mock.patch("jabbercat.avatar.MAX_AVATAR_DATA_SIZE",
+                                 len(data) - 1):
+            self.assertIsNone(avatar.decode_avatar_image(data))
+
+    def test_rejects_too_large_dimensions(self):
+        data = encode_png(64, 32)
+        with unittest.mock.patch("jabbercat.avatar.MAX_AVATAR_DIMENSION",
+                                 63):
+            self.assertIsNone(avatar.decode_avatar_image(data))
 
 
 class Testrender_avatar_image(unittest.TestCase):
@@ -90,6 +224,201 @@ class Testrender_avatar_image(unittest.TestCase):
         QPainter.assert_not_called()
 
 
+class TestAvatarPixmapCache(unittest.TestCase):
+    def setUp(self):
+        self.account = unittest.mock.sentinel.account
+        self.cache = avatar.AvatarPixmapCache(maxsize=2)
+
+    def _key(self, address, size=32):
+        return (self.account, address, None, size, 1.0)
+
+    def test_get_returns_stored_pixmap(self):
+        self.cache.put(self._key(TEST_JID1), unittest.mock.sentinel.pixmap)
+        self.assertEqual(
+            self.cache.get(self._key(TEST_JID1)),
+            unittest.mock.sentinel.pixmap,
+        )
+
+    def test_get_raises_KeyError_on_miss(self):
+        with self.assertRaises(KeyError):
+            self.cache.get(self._key(TEST_JID1))
+
+    def test_invalidate_drops_all_sizes_of_peer(self):
+        self.cache.put(self._key(TEST_JID1, 32), unittest.mock.sentinel.p1)
+        self.cache.put(self._key(TEST_JID1, 48), unittest.mock.sentinel.p2)
+
+        self.cache.invalidate(self.account, TEST_JID1)
+
+        with self.assertRaises(KeyError):
+            self.cache.get(self._key(TEST_JID1, 32))
+        with self.assertRaises(KeyError):
+            self.cache.get(self._key(TEST_JID1, 48))
+
+    def test_invalidate_account(self):
+        other_key = (unittest.mock.sentinel.other, TEST_JID1, None, 32, 1.0)
+        self.cache.put(self._key(TEST_JID1), unittest.mock.sentinel.p1)
+        self.cache.put(other_key, unittest.mock.sentinel.p2)
+
+        self.cache.invalidate_account(self.account)
+
+        with self.assertRaises(KeyError):
+            self.cache.get(self._key(TEST_JID1))
+        self.assertEqual(self.cache.get(other_key), unittest.mock.sentinel.p2)
+
+    def test_eviction_prunes_peer_index(self):
+        self.cache.put(self._key(TEST_JID1), unittest.mock.sentinel.p1)
+        self.cache.put(self._key(TEST_JID2), unittest.mock.sentinel.p2)
+        # touch TEST_JID1 so that TEST_JID2 is evicted
+        self.cache.get(self._key(TEST_JID1))
+        self.cache.put(self._key(TEST_JID3), unittest.mock.sentinel.p3)
+
+        with self.assertRaises(KeyError):
+            self.cache.get(self._key(TEST_JID2))
+        self.assertCountEqual(
+            self.cache._cache.groups(),
+            [(self.account, TEST_JID1), (self.account, TEST_JID3)],
+        )
+
+
+class TestAvatarDiskCache(unittest.TestCase):
+    HASH1 = "0123456789abcdef"
+    HASH2 = "fedcba9876543210"
+    HASH3 = "00112233445566778899"
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = pathlib.Path(self.tmpdir.name) / "avatars"
+        self.dc = avatar.AvatarDiskCache(self.path, max_size=16)
+        self.listener = make_listener(self.dc)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_lookup_peer_raises_KeyError_for_unknown_peer(self):
+        with self.assertRaises(KeyError):
+            self.dc.lookup_peer(TEST_JID1)
+
+    def test_load_returns_None_for_unknown_hash(self):
+        self.assertIsNone(self.dc.load(self.HASH1))
+
+    def test_store_and_load(self):
+        self.dc.store(TEST_JID1, self.HASH1, b"foo")
+
+        self.assertEqual(self.dc.lookup_peer(TEST_JID1), self.HASH1)
+        self.assertEqual(self.dc.load(self.HASH1), b"foo")
+
+    def test_store_emits_on_dirty_once(self):
+        self.dc.store(TEST_JID1, self.HASH1, b"foo")
+        self.dc.store(TEST_JID2, self.HASH2, b"bar")
+
+        self.listener.on_dirty.assert_called_once_with()
+
+    def test_store_ignores_invalid_hashes(self):
+        self.dc.store(TEST_JID1, "../../foo", b"foo")
+
+        with self.assertRaises(KeyError):
+            self.dc.lookup_peer(TEST_JID1)
+        self.assertFalse(self.path.exists())
+
+    def test_store_ignores_images_larger_than_max_size(self):
+        self.dc.store(TEST_JID1, self.HASH1, b"x" * 17)
+
+        with self.assertRaises(KeyError):
+            self.dc.lookup_peer(TEST_JID1)
+
+    def test_store_evicts_least_recently_used(self):
+        self.dc.store(TEST_JID1, self.HASH1, b"x" * 6)
+        self.dc.store(TEST_JID2, self.HASH2, b"y" * 6)
+        self.assertIsNotNone(self.dc.load(self.HASH1))
+
+        self.dc.store(TEST_JID2, self.HASH3, b"z" * 6)
+
+        self.assertIsNone(self.dc.load(self.HASH2))
+        self.assertEqual(self.dc.load(self.HASH1), b"x" * 6)
+        self.assertEqual(self.dc.load(self.HASH3), b"z" * 6)
+
+    def test_eviction_drops_peer_association(self):
+        self.dc.store(TEST_JID1, self.HASH1, b"x" * 10)
+        self.dc.store(TEST_JID2, self.HASH2, b"y" * 10)
+
+        with self.assertRaises(KeyError):
+            self.dc.lookup_peer(TEST_JID1)
+        self.assertEqual(self.dc.lookup_peer(TEST_JID2), self.HASH2)
+
+    def test_eviction_drops_all_peers_of_image(self):
+        self.dc.store(TEST_JID1, self.HASH1, b"x" * 10)
+        self.dc.store(TEST_JID3, self.HASH1, b"x" * 10)
+        self.dc.store(TEST_JID2, self.HASH2, b"y" * 10)
+
+        with self.assertRaises(KeyError):
+            self.dc.lookup_peer(TEST_JID1)
+        with self.assertRaises(KeyError):
+            self.dc.lookup_peer(TEST_JID3)
+        self.assertEqual(self.dc.lookup_peer(TEST_JID2), self.HASH2)
+
+    def test_eviction_keeps_peers_which_moved_to_other_image(self):
+        self.dc.store(TEST_JID1, self.HASH1, b"x" * 6)
+        self.dc.store(TEST_JID1, self.HASH2, b"y" * 6)
+        self.dc.store(TEST_JID2, self.HASH3, b"z" * 6)
+
+        self.assertIsNone(self.dc.load(self.HASH1))
+        self.assertEqual(self.dc.lookup_peer(TEST_JID1), self.HASH2)
+        self.assertEqual(self.dc.lookup_peer(TEST_JID2), self.HASH3)
+
+    def test_load_does_not_emit_on_dirty(self):
+        self.dc.store(TEST_JID1, self.HASH1, b"foo")
+        self.dc.flush()
+        self.listener.on_dirty.reset_mock()
+
+        self.dc.load(self.HASH1)
+
+        self.listener.on_dirty.assert_not_called()
+
+    def test_flush_persists_order_of_use(self):
+        self.dc.store(TEST_JID1, self.HASH1, b"x" * 6)
+        self.dc.store(TEST_JID2, self.HASH2, b"y" * 6)
+        self.dc.flush()
+        self.dc.load(self.HASH1)
+        self.dc.flush()
+
+        dc2 = avatar.AvatarDiskCache(self.path, max_size=16)
+        dc2.store(TEST_JID3, self.HASH3, b"z" * 6)
+
+        self.assertIsNone(dc2.load(self.HASH2))
+        self.assertEqual(dc2.load(self.HASH1), b"x" * 6)
+
+    def test_set_peer_no_avatar(self):
+        self.dc.set_peer_no_avatar(TEST_JID1)
+
+        self.assertIsNone(self.dc.lookup_peer(TEST_JID1))
+
+    def test_forget_peer(self):
+        self.dc.store(TEST_JID1, self.HASH1, b"foo")
+        self.dc.forget_peer(TEST_JID1)
+
+        with self.assertRaises(KeyError):
+            self.dc.lookup_peer(TEST_JID1)
+        self.assertEqual(self.dc.load(self.HASH1), b"foo")
+
+    def test_flush_persists_index(self):
+        self.dc.store(TEST_JID1, self.HASH1, b"foo")
+        self.dc.set_peer_no_avatar(TEST_JID2)
+        self.dc.flush()
+
+        dc2 = avatar.AvatarDiskCache(self.path, max_size=16)
+        self.assertEqual(dc2.lookup_peer(TEST_JID1), self.HASH1)
+        self.assertIsNone(dc2.lookup_peer(TEST_JID2))
+        self.assertEqual(dc2.load(self.HASH1), b"foo")
+
+    def test_discards_malformed_index(self):
+        self.path.mkdir(parents=True)
+        (self.path / avatar.AvatarDiskCache.INDEX_NAME).write_text("{")
+
+        dc2 = avatar.AvatarDiskCache(self.path, max_size=16)
+        with self.assertRaises(KeyError):
+            dc2.lookup_peer(TEST_JID1)
+
+
 class XMPPAvatarProvider(unittest.TestCase):
     def setUp(self):
         self.account = unittest.mock.Mock(spec=jclib.identity.Account)
@@ -140,7 +469,7 @@ class XMPPAvatarProvider(unittest.TestCase):
 
         self.assertIsNone(result)
 
-    def test__get_image_uses_QImage(self):
+    def test__get_image_uses_decode_avatar_image(self):
         client = self._prep_client()
 
         self.ap.prepare_client(client)
@@ -170,9 +499,8 @@ class XMPPAvatarProvider(unittest.TestCase):
             base.avatar3,
         ]
 
-        with unittest.mock.patch("jabbercat.Qt.QImage") as QImage:
-            QImage.fromData.return_value.isNull.return_value = False
-
+        with unittest.mock.patch(
+                "jabbercat.avatar.decode_avatar_image") as decode_avatar_image:
             result = run_coroutine(
                 self.ap._get_image(unittest.mock.sentinel.address)
             )
@@ -185,11 +513,11 @@ class XMPPAvatarProvider(unittest.TestCase):
         base.avatar2.get_image_bytes.assert_not_called()
         base.avatar3.get_image_bytes.assert_not_called()
 
-        QImage.fromData.assert_called_once_with(
+        decode_avatar_image.assert_called_once_with(
             unittest.mock.sentinel.avatar1_bytes
         )
 
-        self.assertEqual(result, QImage.fromData())
+        self.assertEqual(result, decode_avatar_image())
 
     def test__get_image_tries_next_if_get_image_bytes_not_implemented(self):
         client = self._prep_client()
@@ -218,9 +546,8 @@ class XMPPAvatarProvider(unittest.TestCase):
             base.avatar1,
         ]
 
-        with unittest.mock.patch("jabbercat.Qt.QImage") as QImage:
-            QImage.fromData.return_value.isNull.return_value = False
-
+        with unittest.mock.patch(
+                "jabbercat.avatar.decode_avatar_image") as decode_avatar_image:
             result = run_coroutine(
                 self.ap._get_image(unittest.mock.sentinel.address)
             )
@@ -233,11 +560,11 @@ class XMPPAvatarProvider(unittest.TestCase):
         base.avatar2.get_image_bytes.assert_called_once_with()
         base.avatar3.get_image_bytes.assert_called_once_with()
 
-        QImage.fromData.assert_called_once_with(
+        decode_avatar_image.assert_called_once_with(
             unittest.mock.sentinel.image_bytes
         )
 
-        self.assertEqual(result, QImage.fromData())
+        self.assertEqual(result, decode_avatar_image())
 
     def test__get_image_tries_next_if_image_bytes_not_available(self):
         client = self._prep_client()
@@ -267,9 +594,8 @@ class XMPPAvatarProvider(unittest.TestCase):
             base.avatar1,
         ]
 
-        with unittest.mock.patch("jabbercat.Qt.QImage") as QImage:
-            QImage.fromData.return_value.isNull.return_value = False
-
+        with unittest.mock.patch(
+                "jabbercat.avatar.decode_avatar_image") as decode_avatar_image:
             result = run_coroutine(
                 self.ap._get_image(unittest.mock.sentinel.address)
             )
@@ -282,11 +608,11 @@ class XMPPAvatarProvider(unittest.TestCase):
         base.avatar2.get_image_bytes.assert_called_once_with()
         base.avatar3.get_image_bytes.assert_called_once_with()
 
-        QImage.fromData.assert_called_once_with(
+        decode_avatar_image.assert_called_once_with(
             unittest.mock.sentinel.image_bytes
         )
 
-        self.assertEqual(result, QImage.fromData())
+        self.assertEqual(result, decode_avatar_image())
 
     def test__get_image_tries_next_if_one_fails(self):
         client = self._prep_client()
@@ -316,9 +642,8 @@ class XMPPAvatarProvider(unittest.TestCase):
             base.avatar1,
         ]
 
-        with unittest.mock.patch("jabbercat.Qt.QImage") as QImage:
-            QImage.fromData.return_value.isNull.return_value = False
-
+        with unittest.mock.patch(
+                "jabbercat.avatar.decode_avatar_image") as decode_avatar_image:
             result = run_coroutine(
                 self.ap._get_image(unittest.mock.sentinel.address)
             )
@@ -331,11 +656,11 @@ class XMPPAvatarProvider(unittest.TestCase):
         base.avatar2.get_image_bytes.assert_called_once_with()
         base.avatar3.get_image_bytes.assert_called_once_with()
 
-        QImage.fromData.assert_called_once_with(
+        decode_avatar_image.assert_called_once_with(
             unittest.mock.sentinel.image_bytes
         )
 
-        self.assertEqual(result, QImage.fromData())
+        self.assertEqual(result, decode_avatar_image())
 
     def test__get_image_returns_none_if_all_fail(self):
         client = self._prep_client()
@@ -365,7 +690,8 @@ class XMPPAvatarProvider(unittest.TestCase):
             base.avatar3,
         ]
 
-        with unittest.mock.patch("jabbercat.Qt.QImage") as QImage:
+        with unittest.mock.patch(
+                "jabbercat.avatar.decode_avatar_image") as decode_avatar_image:
             result = run_coroutine(
                 self.ap._get_image(unittest.mock.sentinel.address)
             )
@@ -378,11 +704,11 @@ class XMPPAvatarProvider(unittest.TestCase):
         base.avatar2.get_image_bytes.assert_called_once_with()
         base.avatar3.get_image_bytes.assert_called_once_with()
 
-        QImage.fromData.assert_not_called()
+        decode_avatar_image.assert_not_called()
 
         self.assertIsNone(result)
 
-    def test__get_image_tries_next_if_QImage_fails_to_load(self):
+    def test__get_image_tries_next_if_image_fails_to_decode(self):
         client = self._prep_client()
 
         self.ap.prepare_client(client)
@@ -412,16 +738,13 @@ class XMPPAvatarProvider(unittest.TestCase):
             base.avatar3,
         ]
 
-        def images():
-            for i in itertools.count():
-                yield getattr(base, "image{}".format(i))
-
-        base.image0.isNull.return_value = True
-        base.image1.isNull.return_value = True
-        base.image2.isNull.return_value = False
-
-        with unittest.mock.patch("jabbercat.Qt.QImage") as QImage:
-            QImage.fromData.side_effect = images()
+        with unittest.mock.patch(
+                "jabbercat.avatar.decode_avatar_image") as decode_avatar_image:
+            decode_avatar_image.side_effect = [
+                None,
+                None,
+                base.image2,
+            ]
 
             result = run_coroutine(
                 self.ap._get_image(unittest.mock.sentinel.address)
@@ -436,7 +759,7 @@ class XMPPAvatarProvider(unittest.TestCase):
         base.avatar3.get_image_bytes.assert_called_once_with()
 
         self.assertSequenceEqual(
-            QImage.fromData.mock_calls,
+            decode_avatar_image.mock_calls,
             [
                 unittest.mock.call(unittest.mock.sentinel.avatar1_bytes),
                 unittest.mock.call(unittest.mock.sentinel.avatar2_bytes),
@@ -444,10 +767,6 @@ class XMPPAvatarProvider(unittest.TestCase):
             ]
         )
 
-        base.image0.isNull.assert_called_once_with()
-        base.image1.isNull.assert_called_once_with()
-        base.image2.isNull.assert_called_once_with()
-
         self.assertEqual(result, base.image2)
 
     def test_fetch_avatar_returns_None_if__get_image_returns_None(self):
@@ -495,6 +814,33 @@ class XMPPAvatarProvider(unittest.TestCase):
 
         self.assertEqual(result, render_avatar_image())
 
+    def test__get_image_decodes_on_executor(self):
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        ap = avatar.XMPPAvatarProvider(self.account, executor=executor)
+        ap.prepare_client(self._prep_client())
+
+        descriptor = unittest.mock.Mock(
+            spec=aioxmpp.avatar.service.AbstractAvatarDescriptor)
+        descriptor.get_image_bytes = CoroutineMock()
+        descriptor.get_image_bytes.return_value = \
+            unittest.mock.sentinel.image_bytes
+        self.avatar.get_avatar_metadata.return_value = [descriptor]
+
+        threads = []
+
+        def decode(data):
+            threads.append(threading.get_ident())
+            return unittest.mock.sentinel.image
+
+        with unittest.mock.patch("jabbercat.avatar.decode_avatar_image",
+                                 new=decode):
+            result = run_coroutine(ap._get_image(TEST_JID1))
+
+        self.assertEqual(result, unittest.mock.sentinel.image)
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+
     def test_get_avatar_raises_KeyError_when_cold(self):
         with self.assertRaises(KeyError):
             self.ap.get_avatar(unittest.mock.sentinel.address)
@@ -545,6 +891,258 @@ class XMPPAvatarProvider(unittest.TestCase):
         with self.assertRaises(KeyError):
             self.ap.get_avatar(unittest.mock.sentinel.address)
 
+    def _make_disk_cached_provider(self):
+        disk_cache = unittest.mock.Mock(spec=avatar.AvatarDiskCache)
+        ap = avatar.XMPPAvatarProvider(self.account, disk_cache)
+        listener = make_listener(ap)
+        return ap, disk_cache, listener
+
+    def test__on_metadata_changed_ignores_known_hash(self):
+        ap, disk_cache, listener = self._make_disk_cached_provider()
+        disk_cache.lookup_peer.return_value = "0123456789abcdef"
+
+        descriptor = unittest.mock.Mock(
+            spec=aioxmpp.avatar.service.AbstractAvatarDescriptor)
+        descriptor.normalized_id = "0123456789abcdef"
+
+        ap._on_metadata_changed(TEST_JID1, [descriptor])
+
+        disk_cache.lookup_peer.assert_called_once_with(TEST_JID1)
+        disk_cache.forget_peer.assert_not_called()
+        listener.on_avatar_changed.assert_not_called()
+
+    def test__on_metadata_changed_forgets_peer_on_new_hash(self):
+        ap, disk_cache, listener = self._make_disk_cached_provider()
+        disk_cache.lookup_peer.return_value = "0123456789abcdef"
+
+        descriptor = unittest.mock.Mock(
+            spec=aioxmpp.avatar.service.AbstractAvatarDescriptor)
+        descriptor.normalized_id = "fedcba9876543210"
+
+        ap._on_metadata_changed(TEST_JID1, [descriptor])
+
+        disk_cache.forget_peer.assert_called_once_with(TEST_JID1)
+        listener.on_avatar_changed.assert_called_once_with(TEST_JID1)
+
+    def test_fetch_avatar_uses_disk_cache_without_network(self):
+        ap, disk_cache, listener = self._make_disk_cached_provider()
+        disk_cache.lookup_peer.return_value = "0123456789abcdef"
+        disk_cache.load.return_value = unittest.mock.sentinel.data
+
+        with contextlib.ExitStack() as stack:
+            _get_image = stack.enter_context(unittest.mock.patch.object(
+                ap, "_get_image",
+                new=CoroutineMock()
+            ))
+
+            decode_avatar_image = stack.enter_context(unittest.mock.patch(
+                "jabbercat.avatar.decode_avatar_image"
+            ))
+
+            render_avatar_image = stack.enter_context(unittest.mock.patch(
+                "jabbercat.avatar.render_avatar_image"
+            ))
+
+            result = run_coroutine(ap.fetch_avatar(TEST_JID1))
+
+        _get_image.assert_not_called()
+        disk_cache.load.assert_called_once_with("0123456789abcdef")
+        decode_avatar_image.assert_called_once_with(unittest.mock.sentinel.data)
+        render_avatar_image.assert_called_once_with(decode_avatar_image(), 48)
+        self.assertEqual(result, render_avatar_image())
+
+    def test_fetch_avatar_returns_None_for_peer_known_without_avatar(self):
+        ap, disk_cache, listener = self._make_disk_cached_provider()
+        disk_cache.lookup_peer.return_value = None
+
+        with unittest.mock.patch.object(ap, "_get_image",
+                                        new=CoroutineMock()) as _get_image:
+            result = run_coroutine(ap.fetch_avatar(TEST_JID1))
+
+        _get_image.assert_not_called()
+        self.assertIsNone(result)
+
+    def test__get_image_stores_fetched_data_in_disk_cache(self):
+        ap, disk_cache, listener = self._make_disk_cached_provider()
+        disk_cache.load.return_value = None
+        ap.prepare_client(self._prep_client())
+
+        descriptor = unittest.mock.Mock(
+            spec=aioxmpp.avatar.service.AbstractAvatarDescriptor)
+        descriptor.normalized_id = "0123456789abcdef"
+        descriptor.get_image_bytes = CoroutineMock()
+        descriptor.get_image_bytes.return_value = \
+            unittest.mock.sentinel.image_bytes
+        self.avatar.get_avatar_metadata.return_value = [descriptor]
+
+        with unittest.mock.patch(
+                "jabbercat.avatar.decode_avatar_image") as decode_avatar_image:
+            result = run_coroutine(ap._get_image(TEST_JID1))
+
+        disk_cache.load.assert_called_once_with("0123456789abcdef")
+        disk_cache.store.assert_called_once_with(
+            TEST_JID1,
+            "0123456789abcdef",
+            unittest.mock.sentinel.image_bytes,
+        )
+        self.assertEqual(result, decode_avatar_image())
+
+    def _make_negatively_cached_provider(self):
+        negative_cache = avatar.NegativeAvatarCache()
+        ap = avatar.XMPPAvatarProvider(self.account, None, negative_cache)
+        ap.prepare_client(self._prep_client())
+        return ap, negative_cache
+
+    def test_fetch_avatar_records_failure_and_does_not_cache_it(self):
+        ap, negative_cache = self._make_negatively_cached_provider()
+        self.avatar.get_avatar_metadata.side_effect = \
+            aioxmpp.errors.XMPPError(("foo", "bar"))
+
+        result = run_coroutine(ap.fetch_avatar(TEST_JID1))
+
+        self.assertIsNone(result)
+        self.assertTrue(negative_cache.is_blocked((self.account, TEST_JID1)))
+        self.assertEqual(negative_cache.failures((self.account, TEST_JID1)),
+                         1)
+        with self.assertRaises(KeyError):
+            ap.get_avatar(TEST_JID1)
+
+    def test_fetch_avatar_records_failure_if_no_image_is_usable(self):
+        ap, negative_cache = self._make_negatively_cached_provider()
+
+        descriptor = unittest.mock.Mock(
+            spec=aioxmpp.avatar.service.AbstractAvatarDescriptor)
+        descriptor.get_image_bytes = CoroutineMock()
+        descriptor.get_image_bytes.side_effect = RuntimeError()
+        self.avatar.get_avatar_metadata.return_value = [descriptor]
+
+        result = run_coroutine(ap.fetch_avatar(TEST_JID1))
+
+        self.assertIsNone(result)
+        self.assertTrue(negative_cache.is_blocked((self.account, TEST_JID1)))
+
+    def test_fetch_avatar_resets_backoff_on_success(self):
+        ap, negative_cache = self._make_negatively_cached_provider()
+        negative_cache.record_failure((self.account, TEST_JID1), "foo")
+        self.avatar.get_avatar_metadata.return_value = []
+
+        result = run_coroutine(ap.fetch_avatar(TEST_JID1))
+
+        self.assertIsNone(result)
+        self.assertEqual(negative_cache.failures((self.account, TEST_JID1)),
+                         0)
+        self.assertIsNone(ap.get_avatar(TEST_JID1))
+
+    def test__on_metadata_changed_resets_backoff(self):
+        ap, negative_cache = self._make_negatively_cached_provider()
+        negative_cache.record_failure((self.account, TEST_JID1), "foo")
+
+        ap._on_metadata_changed(TEST_JID1, [])
+
+        self.assertFalse(negative_cache.is_blocked((self.account, TEST_JID1)))
+        self.assertIn((self.account, TEST_JID1), negative_cache)
+
+
+class TestNegativeAvatarCache(unittest.TestCase):
+    def setUp(self):
+        self.nc = avatar.NegativeAvatarCache(ttl=10, max_ttl=35)
+        self.key = unittest.mock.sentinel.account, TEST_JID1
+
+    def test_unknown_key_is_not_blocked(self):
+        self.assertFalse(self.nc.is_blocked(self.key))
+        self.assertEqual(self.nc.failures(self.key), 0)
+
+    def test_failure_blocks_until_ttl_expires(self):
+        with unittest.mock.patch("time.monotonic") as monotonic:
+            monotonic.return_value = 100
+            self.nc.record_failure(self.key, "timeout")
+
+            monotonic.return_value = 109.9
+            self.assertTrue(self.nc.is_blocked(self.key))
+
+            monotonic.return_value = 110
+            self.assertFalse(self.nc.is_blocked(self.key))
+
+    def test_backoff_doubles_up_to_max_ttl(self):
+        with unittest.mock.patch("time.monotonic") as monotonic:
+            monotonic.return_value = 0
+            expected = [10, 20, 35, 35]
+            for i, delay in enumerate(expected, 1):
+                self.nc.record_failure(self.key, "timeout")
+                entry, = self.nc.entries()
+                self.assertEqual(entry.failures, i)
+                self.assertEqual(entry.retry_in, delay)
+
+    def test_success_resets_backoff(self):
+        self.nc.record_failure(self.key, "timeout")
+        self.nc.record_failure(self.key, "timeout")
+        self.nc.record_success(self.key)
+
+        self.assertFalse(self.nc.is_blocked(self.key))
+        self.assertEqual(self.nc.failures(self.key), 0)
+
+    def test_entries(self):
+        with unittest.mock.patch("time.monotonic") as monotonic:
+            monotonic.return_value = 100
+            self.nc.record_failure(self.key, "timeout")
+            monotonic.return_value = 104
+            self.assertSequenceEqual(
+                self.nc.entries(),
+                [
+                    avatar.NegativeCacheEntry(
+                        unittest.mock.sentinel.account,
+                        TEST_JID1,
+                        1,
+                        6,
+                        "timeout",
+                    ),
+                ]
+            )
+
+    def test_reset_unblocks_but_keeps_key(self):
+        self.nc.record_failure(self.key, "timeout")
+        self.nc.record_failure(self.key, "timeout")
+
+        self.nc.reset(self.key)
+
+        self.assertFalse(self.nc.is_blocked(self.key))
+        self.assertEqual(self.nc.failures(self.key), 0)
+        self.assertIn(self.key, self.nc)
+
+        self.nc.record_failure(self.key, "timeout")
+        self.assertEqual(self.nc.failures(self.key), 1)
+
+    def test_reset_ignores_unknown_key(self):
+        self.nc.reset(self.key)
+
+        self.assertNotIn(self.key, self.nc)
+
+    def test_forget_removes_key(self):
+        self.nc.record_failure(self.key, "timeout")
+
+        self.nc.forget(self.key)
+
+        self.assertNotIn(self.key, self.nc)
+
+    def test_forget_account(self):
+        other_key = unittest.mock.sentinel.other_account, TEST_JID1
+        self.nc.record_failure(self.key, "timeout")
+        self.nc.record_failure(other_key, "timeout")
+
+        self.nc.forget_account(unittest.mock.sentinel.account)
+
+        self.assertFalse(self.nc.is_blocked(self.key))
+        self.assertTrue(self.nc.is_blocked(other_key))
+
+    def test_respects_maxsize(self):
+        nc = avatar.NegativeAvatarCache(maxsize=1)
+        other_key = unittest.mock.sentinel.account, TEST_JID2
+        nc.record_failure(self.key, "timeout")
+        nc.record_failure(other_key, "timeout")
+
+        self.assertFalse(nc.is_blocked(self.key))
+        self.assertTrue(nc.is_blocked(other_key))
+
 
 class Testfirst_grapheme(unittest.TestCase):
     def test_simple_cases(self):
@@ -706,12 +1304,8 @@ class Testrender_dummy_avatar(unittest.TestCase):
                 )
             )
 
-            text_to_qtcolor = stack.enter_context(unittest.mock.patch(
-                "jabbercat.utils.text_to_qtcolor"
-            ))
-
-            normalise_text_for_hash = stack.enter_context(unittest.mock.patch(
-                "jclib.utils.normalise_text_for_hash"
+            text_colours = stack.enter_context(unittest.mock.patch(
+                "jabbercat.utils.text_colours"
             ))
 
             result = avatar.render_dummy_avatar(
@@ -720,10 +1314,9 @@ class Testrender_dummy_avatar(unittest.TestCase):
                 unittest.mock.sentinel.size,
             )
 
-        normalise_text_for_hash.assert_called_once_with(
+        text_colours.qtcolor.assert_called_once_with(
             unittest.mock.sentinel.name
         )
-        text_to_qtcolor.assert_called_once_with(normalise_text_for_hash())
 
         first_grapheme.assert_called_once_with(unittest.mock.sentinel.name)
 
@@ -733,7 +1326,7 @@ class Testrender_dummy_avatar(unittest.TestCase):
 
         render_dummy_avatar_base.assert_called_once_with(
             QPainter(),
-            text_to_qtcolor(),
+            text_colours.qtcolor(),
             unittest.mock.sentinel.size,
         )
 
@@ -770,12 +1363,8 @@ class Testrender_dummy_avatar(unittest.TestCase):
                 )
             )
 
-            text_to_qtcolor = stack.enter_context(unittest.mock.patch(
-                "jabbercat.utils.text_to_qtcolor"
-            ))
-
-            normalise_text_for_hash = stack.enter_context(unittest.mock.patch(
-                "jclib.utils.normalise_text_for_hash"
+            text_colours = stack.enter_context(unittest.mock.patch(
+                "jabbercat.utils.text_colours"
             ))
 
             result = avatar.render_dummy_avatar(
@@ -785,10 +1374,9 @@ class Testrender_dummy_avatar(unittest.TestCase):
                 colour_text=unittest.mock.sentinel.colour_text
             )
 
-        normalise_text_for_hash.assert_called_once_with(
+        text_colours.qtcolor.assert_called_once_with(
             unittest.mock.sentinel.colour_text
         )
-        text_to_qtcolor.assert_called_once_with(normalise_text_for_hash())
 
         first_grapheme.assert_called_once_with(unittest.mock.sentinel.name)
 
@@ -797,7 +1385,7 @@ class Testrender_dummy_avatar(unittest.TestCase):
 
         render_dummy_avatar_base.assert_called_once_with(
             QPainter(),
-            text_to_qtcolor(),
+            text_colours.qtcolor(),
             unittest.mock.sentinel.size,
         )
 
@@ -811,11 +1399,179 @@ class Testrender_dummy_avatar(unittest.TestCase):
         self.assertEqual(result, QPicture())
 
 
+class TestAvatarFetchScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = avatar.AvatarFetchScheduler(
+            max_concurrent=2,
+            max_concurrent_per_account=1,
+        )
+        self.started = []
+        self.futures = {}
+
+    def tearDown(self):
+        self.scheduler.close()
+        run_coroutine(asyncio.sleep(0))
+
+    def _job(self, name):
+        future = asyncio.Future()
+        self.futures[name] = future
+
+        @asyncio.coroutine
+        def job():
+            self.started.append(name)
+            yield from future
+
+        return job
+
+    def _finish(self, name):
+        self.futures[name].set_result(None)
+        run_coroutine(asyncio.sleep(0.01))
+
+    def test_runs_scheduled_job(self):
+        self.scheduler.schedule(unittest.mock.sentinel.account, TEST_JID1,
+                                self._job("a"))
+        run_coroutine(asyncio.sleep(0))
+        self.assertEqual(self.started, ["a"])
+        self.assertIn((unittest.mock.sentinel.account, TEST_JID1),
+                      self.scheduler)
+
+        self._finish("a")
+        self.assertNotIn((unittest.mock.sentinel.account, TEST_JID1),
+                         self.scheduler)
+
+    def test_limits_concurrency_per_account(self):
+        account1 = unittest.mock.sentinel.account1
+        account2 = unittest.mock.sentinel.account2
+        self.scheduler.schedule(account1, TEST_JID1, self._job("a"))
+        self.scheduler.schedule(account1, TEST_JID2, self._job("b"))
+        self.scheduler.schedule(account2, TEST_JID1, self._job("c"))
+        run_coroutine(asyncio.sleep(0))
+        self.assertEqual(self.started, ["a", "c"])
+
+        self._finish("a")
+        self.assertEqual(self.started, ["a", "c", "b"])
+
+    def test_per_account_limit_defaults_to_global_limit(self):
+        scheduler = avatar.AvatarFetchScheduler(max_concurrent=3)
+        self.assertEqual(scheduler.max_concurrent_per_account, 3)
+
+        account = unittest.mock.sentinel.account
+        try:
+            for name in "abcd":
+                scheduler.schedule(
+                    account,
+                    TEST_JID1.replace(resource=name),
+                    self._job(name),
+                )
+            run_coroutine(asyncio.sleep(0))
+            self.assertEqual(self.started, ["a", "b", "c"])
+        finally:
+            scheduler.close()
+
+    def test_does_not_look_at_pending_fetches_of_saturated_account(self):
+        account1 = unittest.mock.sentinel.account1
+        account2 = unittest.mock.sentinel.account2
+        self.scheduler.schedule(account1, TEST_JID1, self._job("a"))
+        self.scheduler.schedule(account1, TEST_JID2, self._job("b"))
+        self.scheduler.schedule(account1, TEST_JID3, self._job("c"))
+
+        with unittest.mock.patch.object(
+                self.scheduler, "_peek",
+                wraps=self.scheduler._peek) as peek:
+            self.scheduler.schedule(account2, TEST_JID1, self._job("d"))
+
+        self.assertNotIn(unittest.mock.call(account1), peek.mock_calls)
+        run_coroutine(asyncio.sleep(0))
+        self.assertEqual(self.started, ["a", "d"])
+
+    def test_starts_higher_priority_first(self):
+        account = unittest.mock.sentinel.account
+        self.scheduler.schedule(account, TEST_JID1, self._job("a"))
+        self.scheduler.schedule(account, TEST_JID2, self._job("b"),
+                                avatar.FetchPriority.BACKGROUND)
+        self.scheduler.schedule(account, TEST_JID3, self._job("c"),
+                                avatar.FetchPriority.VISIBLE)
+        run_coroutine(asyncio.sleep(0))
+
+        self._finish("a")
+        self.assertEqual(self.started, ["a", "c"])
+
+    def test_reschedule_raises_priority(self):
+        account = unittest.mock.sentinel.account
+        self.scheduler.schedule(account, TEST_JID1, self._job("a"))
+        self.scheduler.schedule(account, TEST_JID2, self._job("b"),
+                                avatar.FetchPriority.RECENT)
+        self.scheduler.schedule(account, TEST_JID3, self._job("c"),
+                                avatar.FetchPriority.BACKGROUND)
+        self.scheduler.schedule(account, TEST_JID3, self._job("c2"),
+                                avatar.FetchPriority.VISIBLE)
+        run_coroutine(asyncio.sleep(0))
+
+        self._finish("a")
+        self.assertEqual(self.started, ["a", "c2"])
+
+    def test_reschedule_does_not_lower_priority(self):
+        account = unittest.mock.sentinel.account
+        self.scheduler.schedule(account, TEST_JID1, self._job("a"))
+        self.scheduler.schedule(account, TEST_JID2, self._job("b"),
+                                avatar.FetchPriority.RECENT)
+        self.scheduler.schedule(account, TEST_JID3, self._job("c"),
+                                avatar.FetchPriority.VISIBLE)
+        self.scheduler.schedule(account, TEST_JID3, self._job("c2"),
+                                avatar.FetchPriority.BACKGROUND)
+        run_coroutine(asyncio.sleep(0))
+
+        self._finish("a")
+        self.assertEqual(self.started, ["a", "c"])
+
+    def test_reprioritise(self):
+        account = unittest.mock.sentinel.account
+        self.scheduler.schedule(account, TEST_JID1, self._job("a"))
+        self.scheduler.schedule(account, TEST_JID2, self._job("b"),
+                                avatar.FetchPriority.RECENT)
+        self.scheduler.schedule(account, TEST_JID3, self._job("c"),
+                                avatar.FetchPriority.BACKGROUND)
+        self.scheduler.reprioritise(account, TEST_JID3,
+                                    avatar.FetchPriority.VISIBLE)
+        run_coroutine(asyncio.sleep(0))
+
+        self._finish("a")
+        self.assertEqual(self.started, ["a", "c"])
+
+    def test_cancel_account(self):
+        account1 = unittest.mock.sentinel.account1
+        account2 = unittest.mock.sentinel.account2
+        self.scheduler.schedule(account1, TEST_JID1, self._job("a"))
+        self.scheduler.schedule(account1, TEST_JID2, self._job("b"))
+        self.scheduler.schedule(account2, TEST_JID1, self._job("c"))
+        run_coroutine(asyncio.sleep(0))
+
+        self.scheduler.cancel_account(account1)
+        run_coroutine(asyncio.sleep(0.01))
+
+        self.assertNotIn((account1, TEST_JID1), self.scheduler)
+        self.assertNotIn((account1, TEST_JID2), self.scheduler)
+        self.assertIn((account2, TEST_JID1), self.scheduler)
+        self.assertEqual(self.started, ["a", "c"])
+
+    def test_failing_job_does_not_block_queue(self):
+        account = unittest.mock.sentinel.account
+        self.scheduler.schedule(account, TEST_JID1, self._job("a"))
+        self.scheduler.schedule(account, TEST_JID2, self._job("b"))
+        run_coroutine(asyncio.sleep(0))
+
+        self.futures["a"].set_exception(RuntimeError())
+        run_coroutine(asyncio.sleep(0.01))
+
+        self.assertEqual(self.started, ["a", "b"])
+
+
 class TestRosterNameAvatarProvider(unittest.TestCase):
     def setUp(self):
         self.roster = unittest.mock.Mock(spec=aioxmpp.RosterClient)
         self.roster.items = {}
         self.ag = avatar.RosterNameAvatarProvider()
+        self.font = unittest.mock.Mock(spec=Qt.QFont)
         self.listener = make_listener(self.ag)
 
     def _prep_client(self):
@@ -862,7 +1618,7 @@ class TestRosterNameAvatarProvider(unittest.TestCase):
         client = self._prep_client()
 
         item = unittest.mock.Mock(spec=aioxmpp.roster.service.Item)
-        item.name = unittest.mock.sentinel.name
+        item.name = "Romeo"
         self.roster.items[TEST_JID1] = item
 
         self.ag.prepare_client(client)
@@ -874,12 +1630,12 @@ class TestRosterNameAvatarProvider(unittest.TestCase):
 
             result = self.ag.get_avatar(
                 TEST_JID1,
-                unittest.mock.sentinel.font,
+                self.font,
             )
 
         render_dummy_avatar.assert_called_once_with(
-            unittest.mock.sentinel.font,
-            unittest.mock.sentinel.name,
+            self.font,
+            "Romeo",
             48,
             str(TEST_JID1),
         )
@@ -890,7 +1646,7 @@ class TestRosterNameAvatarProvider(unittest.TestCase):
         client = self._prep_client()
 
         item = unittest.mock.Mock(spec=aioxmpp.roster.service.Item)
-        item.name = unittest.mock.sentinel.name
+        item.name = "Romeo"
         self.roster.items[TEST_JID1] = item
 
         self.ag.prepare_client(client)
@@ -902,7 +1658,7 @@ class TestRosterNameAvatarProvider(unittest.TestCase):
 
             result = self.ag.get_avatar(
                 TEST_JID2,
-                unittest.mock.sentinel.font,
+                self.font,
             )
 
         render_dummy_avatar.assert_not_called()
@@ -925,7 +1681,7 @@ class TestRosterNameAvatarProvider(unittest.TestCase):
 
             result = self.ag.get_avatar(
                 TEST_JID1,
-                unittest.mock.sentinel.font,
+                self.font,
             )
 
         render_dummy_avatar.assert_not_called()
@@ -940,7 +1696,7 @@ class TestRosterNameAvatarProvider(unittest.TestCase):
 
             result = self.ag.get_avatar(
                 unittest.mock.sentinel.address,
-                unittest.mock.sentinel.font,
+                self.font,
             )
 
         render_dummy_avatar.assert_not_called()
@@ -953,16 +1709,189 @@ class TestRosterNameAvatarProvider(unittest.TestCase):
         self.ag._on_entry_updated(item)
         self.listener.on_avatar_changed.assert_called_once_with(item.jid)
 
+    def test_get_avatar_reuses_generated_avatar(self):
+        client = self._prep_client()
+
+        item = unittest.mock.Mock(spec=aioxmpp.roster.service.Item)
+        item.name = "Romeo"
+        self.roster.items[TEST_JID1] = item
+
+        self.ag.prepare_client(client)
+
+        with contextlib.ExitStack() as stack:
+            render_dummy_avatar = stack.enter_context(unittest.mock.patch(
+                "jabbercat.avatar.render_dummy_avatar"
+            ))
+
+            result1 = self.ag.get_avatar(TEST_JID1, self.font)
+            result2 = self.ag.get_avatar(TEST_JID1, self.font)
+
+        render_dummy_avatar.assert_called_once_with(
+            self.font,
+            "Romeo",
+            48,
+            str(TEST_JID1),
+        )
+        self.assertIs(result1, result2)
+
+    def test__on_entry_updated_invalidates_generated_avatar(self):
+        client = self._prep_client()
+
+        item = unittest.mock.Mock(spec=aioxmpp.roster.service.Item)
+        item.jid = TEST_JID1
+        item.name = "Romeo"
+        self.roster.items[TEST_JID1] = item
+
+        self.ag.prepare_client(client)
+
+        with contextlib.ExitStack() as stack:
+            render_dummy_avatar = stack.enter_context(unittest.mock.patch(
+                "jabbercat.avatar.render_dummy_avatar"
+            ))
+            render_dummy_avatar.side_effect = [
+                unittest.mock.sentinel.picture1,
+                unittest.mock.sentinel.picture2,
+            ]
+
+            self.ag.get_avatar(TEST_JID1, self.font)
+            self.ag._on_entry_updated(item)
+            result = self.ag.get_avatar(TEST_JID1, self.font)
+
+        self.assertEqual(result, unittest.mock.sentinel.picture2)
+
 
 class TestAvatarManager(unittest.TestCase):
     def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
         self.client = unittest.mock.Mock(spec=jclib.client.Client)
         self.writeman = unittest.mock.Mock(spec=jclib.storage.WriteManager)
-        self.am = avatar.AvatarManager(self.client, self.writeman)
+        with unittest.mock.patch.object(
+                avatar.AvatarManager, "get_disk_cache_path",
+                return_value=pathlib.Path(self.tmpdir.name)):
+            self.am = avatar.AvatarManager(self.client, self.writeman)
         self.listener = make_listener(self.am)
+        self.avatar_font = unittest.mock.Mock(spec=Qt.QFont)
 
     def tearDown(self):
         self.am.close()
+        self.tmpdir.cleanup()
+
+    def test_connects_to_writeback(self):
+        self.writeman.on_writeback.connect.assert_called_once_with(
+            self.am._writeback,
+        )
+
+    def test_requests_writeback_when_disk_cache_becomes_dirty(self):
+        self.am._disk_cache.set_peer_no_avatar(TEST_JID1)
+        self.writeman.request_writeback.assert_called_once_with()
+
+    def test__writeback_flushes_disk_cache(self):
+        with unittest.mock.patch.object(self.am._disk_cache,
+                                        "flush") as flush:
+            run_coroutine(self.am._writeback())
+
+        flush.assert_called_once_with()
+
+    def test_get_avatar_pixmap_renders_get_avatar_result(self):
+        with contextlib.ExitStack() as stack:
+            get_avatar = stack.enter_context(unittest.mock.patch.object(
+                self.am, "get_avatar",
+            ))
+
+            render_avatar_pixmap = stack.enter_context(unittest.mock.patch(
+                "jabbercat.avatar.render_avatar_pixmap"
+            ))
+
+            result = self.am.get_avatar_pixmap(
+                unittest.mock.sentinel.account,
+                TEST_JID1,
+                16,
+                2.0,
+                unittest.mock.sentinel.name_surrogate,
+            )
+
+        get_avatar.assert_called_once_with(
+            unittest.mock.sentinel.account,
+            TEST_JID1,
+            unittest.mock.sentinel.name_surrogate,
+            avatar.FetchPriority.VISIBLE,
+        )
+        render_avatar_pixmap.assert_called_once_with(
+            get_avatar(),
+            16,
+            2.0,
+        )
+        self.assertEqual(result, render_avatar_pixmap())
+
+    def test_get_avatar_pixmap_caches_per_size_and_ratio(self):
+        with contextlib.ExitStack() as stack:
+            get_avatar = stack.enter_context(unittest.mock.patch.object(
+                self.am, "get_avatar",
+            ))
+
+            render_avatar_pixmap = stack.enter_context(unittest.mock.patch(
+                "jabbercat.avatar.render_avatar_pixmap"
+            ))
+            render_avatar_pixmap.side_effect = [
+                unittest.mock.sentinel.pixmap1,
+                unittest.mock.sentinel.pixmap2,
+            ]
+
+            for i in range(2):
+                self.assertEqual(
+                    self.am.get_avatar_pixmap(
+                        unittest.mock.sentinel.account, TEST_JID1, 16, 1.0,
+                    ),
+                    unittest.mock.sentinel.pixmap1,
+                )
+                self.assertEqual(
+                    self.am.get_avatar_pixmap(
+                        unittest.mock.sentinel.account, TEST_JID1, 16, 2.0,
+                    ),
+                    unittest.mock.sentinel.pixmap2,
+                )
+
+        self.assertEqual(len(render_avatar_pixmap.mock_calls), 2)
+
+    def test_avatar_change_invalidates_pixmaps(self):
+        with contextlib.ExitStack() as stack:
+            get_avatar = stack.enter_context(unittest.mock.patch.object(
+                self.am, "get_avatar",
+            ))
+
+            render_avatar_pixmap = stack.enter_context(unittest.mock.patch(
+                "jabbercat.avatar.render_avatar_pixmap"
+            ))
+            render_avatar_pixmap.side_effect = [
+                unittest.mock.sentinel.pixmap1,
+                unittest.mock.sentinel.pixmap2,
+                unittest.mock.sentinel.pixmap3,
+            ]
+
+            self.am.get_avatar_pixmap(
+                unittest.mock.sentinel.account, TEST_JID1, 16, 1.0,
+            )
+            self.am.get_avatar_pixmap(
+                unittest.mock.sentinel.account, TEST_JID2, 16, 1.0,
+            )
+
+            self.am._on_backend_avatar_changed(
+                unittest.mock.sentinel.account,
+                TEST_JID1,
+            )
+
+            self.assertEqual(
+                self.am.get_avatar_pixmap(
+                    unittest.mock.sentinel.account, TEST_JID1, 16, 1.0,
+                ),
+                unittest.mock.sentinel.pixmap3,
+            )
+            self.assertEqual(
+                self.am.get_avatar_pixmap(
+                    unittest.mock.sentinel.account, TEST_JID2, 16, 1.0,
+                ),
+                unittest.mock.sentinel.pixmap2,
+            )
 
     def test_get_avatar_font_uses_general_font(self):
         with contextlib.ExitStack() as stack:
@@ -1007,7 +1936,9 @@ class TestAvatarManager(unittest.TestCase):
                 client,
             )
 
-        RosterNameAvatarProvider.assert_called_once_with()
+        RosterNameAvatarProvider.assert_called_once_with(
+            self.am._dummy_cache,
+        )
         RosterNameAvatarProvider().prepare_client.assert_called_once_with(
             client
         )
@@ -1044,7 +1975,9 @@ class TestAvatarManager(unittest.TestCase):
                 client,
             )
 
-        XMPPAvatarProvider.assert_called_once_with(account)
+        XMPPAvatarProvider.assert_called_once_with(account,
+                                                   self.am._disk_cache,
+                                                   self.am.negative_cache)
         XMPPAvatarProvider().prepare_client.assert_called_once_with(client)
         XMPPAvatarProvider().on_avatar_changed.connect\
             .assert_called_once_with(
@@ -1092,6 +2025,102 @@ class TestAvatarManager(unittest.TestCase):
             .assert_called_once_with(
                 RosterNameAvatarProvider().on_avatar_changed.connect())
 
+    def test__shutdown_client_cancels_fetches_of_account(self):
+        client = unittest.mock.Mock()
+        account = unittest.mock.Mock()
+
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(unittest.mock.patch(
+                "jabbercat.avatar.RosterNameAvatarProvider",
+            ))
+            stack.enter_context(unittest.mock.patch(
+                "jabbercat.avatar.XMPPAvatarProvider",
+            ))
+
+            self.am._prepare_client(account, client)
+
+            cancel_account = stack.enter_context(unittest.mock.patch.object(
+                self.am._scheduler, "cancel_account",
+            ))
+
+            self.am._shutdown_client(account, client)
+
+        cancel_account.assert_called_once_with(account)
+
+    def test_get_avatar_pixmap_reprioritises_pending_fetch_on_hit(self):
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(unittest.mock.patch.object(
+                self.am, "get_avatar",
+            ))
+            stack.enter_context(unittest.mock.patch(
+                "jabbercat.avatar.render_avatar_pixmap"
+            ))
+            reprioritise = stack.enter_context(unittest.mock.patch.object(
+                self.am._scheduler, "reprioritise",
+            ))
+
+            self.am.get_avatar_pixmap(
+                unittest.mock.sentinel.account, TEST_JID1, 16, 1.0,
+            )
+            reprioritise.assert_not_called()
+
+            self.am.get_avatar_pixmap(
+                unittest.mock.sentinel.account, TEST_JID1, 16, 1.0,
+            )
+
+        reprioritise.assert_called_once_with(
+            unittest.mock.sentinel.account,
+            TEST_JID1,
+            avatar.FetchPriority.VISIBLE,
+        )
+
+    def test_get_avatar_pixmap_does_not_cache_pixmaps_of_failed_peers(self):
+        self.am.negative_cache.record_failure(
+            (unittest.mock.sentinel.account, TEST_JID1),
+            "timeout",
+        )
+
+        with contextlib.ExitStack() as stack:
+            get_avatar = stack.enter_context(unittest.mock.patch.object(
+                self.am, "get_avatar",
+            ))
+            stack.enter_context(unittest.mock.patch(
+                "jabbercat.avatar.render_avatar_pixmap"
+            ))
+
+            for i in range(2):
+                self.am.get_avatar_pixmap(
+                    unittest.mock.sentinel.account, TEST_JID1, 16, 1.0,
+                )
+
+        self.assertEqual(len(get_avatar.mock_calls), 2)
+
+    def test_get_avatar_retries_failed_peer_with_cached_avatar(self):
+        with unittest.mock.patch(
+                "jabbercat.avatar.XMPPAvatarProvider") as XMPPAvatarProvider:
+            XMPPAvatarProvider().get_avatar.return_value = \
+                unittest.mock.sentinel.xmpp_image
+            self.am._prepare_client(unittest.mock.sentinel.account,
+                                    unittest.mock.Mock())
+
+        self.am.negative_cache.record_failure(
+            (unittest.mock.sentinel.account, TEST_JID1),
+            "timeout",
+        )
+
+        with unittest.mock.patch.object(
+                self.am, "_fetch_in_background") as _fetch_in_background:
+            result = self.am.get_avatar(unittest.mock.sentinel.account,
+                                        TEST_JID1)
+
+        _fetch_in_background.assert_called_once_with(
+            unittest.mock.sentinel.account,
+            XMPPAvatarProvider(),
+            TEST_JID1,
+            avatar.FetchPriority.RECENT,
+        )
+        self.assertEqual(result, unittest.mock.sentinel.xmpp_image)
+
     def test__shutdown_client_unlinks_XMPPAvatarProvider(self):
         client = unittest.mock.Mock()
         account = unittest.mock.Mock()
@@ -1145,7 +2174,7 @@ class TestAvatarManager(unittest.TestCase):
                 self.am,
                 "get_avatar_font",
             ))
-            get_avatar_font.return_value = unittest.mock.sentinel.avatar_font
+            get_avatar_font.return_value = self.avatar_font
 
             result = self.am.get_avatar(
                 unittest.mock.sentinel.account,
@@ -1153,7 +2182,7 @@ class TestAvatarManager(unittest.TestCase):
             )
 
         render_dummy_avatar.assert_called_once_with(
-            unittest.mock.sentinel.avatar_font,
+            self.avatar_font,
             str(TEST_JID1),
             48,
         )
@@ -1193,7 +2222,7 @@ class TestAvatarManager(unittest.TestCase):
                 self.am,
                 "get_avatar_font",
             ))
-            get_avatar_font.return_value = unittest.mock.sentinel.avatar_font
+            get_avatar_font.return_value = self.avatar_font
 
             result = self.am.get_avatar(
                 unittest.mock.sentinel.account,
@@ -1207,11 +2236,11 @@ class TestAvatarManager(unittest.TestCase):
 
         RosterNameAvatarProvider().get_avatar.assert_called_once_with(
             TEST_JID1,
-            unittest.mock.sentinel.avatar_font,
+            self.avatar_font,
         )
 
         render_dummy_avatar.assert_called_once_with(
-            unittest.mock.sentinel.avatar_font,
+            self.avatar_font,
             str(TEST_JID1),
             48,
         )
@@ -1254,7 +2283,7 @@ class TestAvatarManager(unittest.TestCase):
                 self.am,
                 "get_avatar_font",
             ))
-            get_avatar_font.return_value = unittest.mock.sentinel.avatar_font
+            get_avatar_font.return_value = self.avatar_font
 
             result = self.am.get_avatar(
                 unittest.mock.sentinel.account,
@@ -1269,11 +2298,12 @@ class TestAvatarManager(unittest.TestCase):
             unittest.mock.sentinel.account,
             XMPPAvatarProvider(),
             TEST_JID1,
+            avatar.FetchPriority.RECENT,
         )
 
         RosterNameAvatarProvider().get_avatar.assert_called_once_with(
             TEST_JID1,
-            unittest.mock.sentinel.avatar_font,
+            self.avatar_font,
         )
 
         self.assertEqual(result, RosterNameAvatarProvider().get_avatar())
@@ -1315,7 +2345,7 @@ class TestAvatarManager(unittest.TestCase):
                 self.am,
                 "get_avatar_font",
             ))
-            get_avatar_font.return_value = unittest.mock.sentinel.avatar_font
+            get_avatar_font.return_value = self.avatar_font
 
             result = self.am.get_avatar(
                 unittest.mock.sentinel.account,
@@ -1361,12 +2391,12 @@ class TestAvatarManager(unittest.TestCase):
                 self.am,
                 "get_avatar_font",
             ))
-            get_avatar_font.return_value = unittest.mock.sentinel.avatar_font
+            get_avatar_font.return_value = self.avatar_font
 
             result = self.am.get_avatar(
                 unittest.mock.sentinel.account,
                 TEST_JID1,
-                unittest.mock.sentinel.name_surrogate,
+                "Romeo",
             )
 
         XMPPAvatarProvider().get_avatar.assert_called_once_with(
@@ -1375,12 +2405,12 @@ class TestAvatarManager(unittest.TestCase):
 
         RosterNameAvatarProvider().get_avatar.assert_called_once_with(
             TEST_JID1,
-            unittest.mock.sentinel.avatar_font,
+            self.avatar_font,
         )
 
         render_dummy_avatar.assert_called_once_with(
-            unittest.mock.sentinel.avatar_font,
-            unittest.mock.sentinel.name_surrogate,
+            self.avatar_font,
+            "Romeo",
             48,
         )
 
@@ -1408,6 +2438,114 @@ class TestAvatarManager(unittest.TestCase):
             unittest.mock.sentinel.address,
         )
 
+    def test__fetch_in_background_keeps_slots_for_other_accounts(self):
+        account1 = unittest.mock.sentinel.account1
+        account2 = unittest.mock.sentinel.account2
+        started = []
+        future = asyncio.Future()
+
+        @asyncio.coroutine
+        def fetch_avatar(address):
+            started.append(address)
+            yield from future
+
+        provider = unittest.mock.Mock(spec=avatar.XMPPAvatarProvider)
+        provider.fetch_avatar = fetch_avatar
+
+        addresses1 = [
+            TEST_JID1.replace(resource=str(i))
+            for i in range(self.am._scheduler.max_concurrent)
+        ]
+        for address in addresses1:
+            self.am._fetch_in_background(account1, provider, address)
+        self.am._fetch_in_background(account2, provider, TEST_JID2)
+
+        run_coroutine(asyncio.sleep(0.01))
+
+        self.assertLess(self.am._scheduler.max_concurrent_per_account,
+                        self.am._scheduler.max_concurrent)
+        self.assertSequenceEqual(
+            started,
+            addresses1[:self.am._scheduler.max_concurrent_per_account] +
+            [TEST_JID2],
+        )
+
+    def test__fetch_in_background_skips_backed_off_peers(self):
+        provider = unittest.mock.Mock(spec=avatar.XMPPAvatarProvider)
+        provider.fetch_avatar = CoroutineMock()
+
+        self.am.negative_cache.record_failure(
+            (unittest.mock.sentinel.account, unittest.mock.sentinel.address),
+            "timeout",
+        )
+
+        self.am._fetch_in_background(unittest.mock.sentinel.account,
+                                     provider,
+                                     unittest.mock.sentinel.address)
+
+        run_coroutine(asyncio.sleep(0.01))
+
+        provider.fetch_avatar.assert_not_called()
+        self.listener.on_avatar_changed.assert_not_called()
+
+    def test__fetch_avatar_and_emit_signal_records_timeout(self):
+        fetch_func = CoroutineMock()
+
+        with unittest.mock.patch("asyncio.wait_for",
+                                 new=CoroutineMock()) as wait_for:
+            wait_for.side_effect = asyncio.TimeoutError()
+            run_coroutine(self.am._fetch_avatar_and_emit_signal(
+                fetch_func,
+                unittest.mock.sentinel.account,
+                unittest.mock.sentinel.address,
+            ))
+
+        self.assertTrue(self.am.negative_cache.is_blocked(
+            (unittest.mock.sentinel.account, unittest.mock.sentinel.address)
+        ))
+        self.listener.on_avatar_changed.assert_not_called()
+
+    def test__fetch_avatar_and_emit_signal_does_not_emit_on_failure(self):
+        key = unittest.mock.sentinel.account, unittest.mock.sentinel.address
+
+        @asyncio.coroutine
+        def fetch_func(address):
+            self.am.negative_cache.record_failure(key, "foo")
+
+        with unittest.mock.patch.object(self.am._pixmap_cache,
+                                        "invalidate") as invalidate:
+            run_coroutine(self.am._fetch_avatar_and_emit_signal(
+                fetch_func,
+                unittest.mock.sentinel.account,
+                unittest.mock.sentinel.address,
+            ))
+
+        invalidate.assert_called_once_with(
+            unittest.mock.sentinel.account,
+            unittest.mock.sentinel.address,
+        )
+        self.listener.on_avatar_changed.assert_not_called()
+
+    def test__fetch_avatar_and_emit_signal_emits_after_retry(self):
+        key = unittest.mock.sentinel.account, unittest.mock.sentinel.address
+        self.am.negative_cache.record_failure(key, "foo")
+        self.am.negative_cache.reset(key)
+
+        @asyncio.coroutine
+        def fetch_func(address):
+            self.am.negative_cache.record_success(key)
+
+        run_coroutine(self.am._fetch_avatar_and_emit_signal(
+            fetch_func,
+            unittest.mock.sentinel.account,
+            unittest.mock.sentinel.address,
+        ))
+
+        self.listener.on_avatar_changed.assert_called_once_with(
+            unittest.mock.sentinel.account,
+            unittest.mock.sentinel.address,
+        )
+
     def test__on_xmpp_avatar_changed_causes_lookup(self):
         provider = unittest.mock.Mock(spec=avatar.XMPPAvatarProvider)
         provider.get_avatar.return_value = unittest.mock.sentinel.value
@@ -1465,3 +2603,25 @@ class TestAvatarManager(unittest.TestCase):
         self.listener.on_avatar_changed.assert_not_called()
         provider.fetch_avatar.assert_not_called()
         _fetch_in_background.assert_not_called()
+
+    def test__on_xmpp_avatar_changed_causes_lookup_after_failure(self):
+        provider = unittest.mock.Mock(spec=avatar.XMPPAvatarProvider)
+        provider.get_avatar.side_effect = KeyError
+
+        key = unittest.mock.sentinel.account, unittest.mock.sentinel.address
+        self.am.negative_cache.record_failure(key, "timeout")
+        self.am.negative_cache.reset(key)
+
+        with unittest.mock.patch.object(
+                self.am, "_fetch_in_background") as _fetch_in_background:
+            self.am._on_xmpp_avatar_changed(
+                unittest.mock.sentinel.account,
+                provider,
+                unittest.mock.sentinel.address
+            )
+
+        _fetch_in_background.assert_called_once_with(
+            unittest.mock.sentinel.account,
+            provider,
+            unittest.mock.sentinel.address
+        )
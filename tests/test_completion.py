@@ -0,0 +1,219 @@
+import unittest
+import unittest.mock
+
+import aioxmpp.callbacks
+
+import jabbercat.Qt as Qt
+import jabbercat.completion as completion
+import jabbercat.models as models
+
+
+class TestPrefixTrie(unittest.TestCase):
+    def setUp(self):
+        self.trie = completion.PrefixTrie()
+
+    def test_iter_prefix_on_empty_trie(self):
+        self.assertSequenceEqual(list(self.trie.iter_prefix("")), [])
+        self.assertSequenceEqual(list(self.trie.iter_prefix("foo")), [])
+
+    def test_iter_prefix_is_case_insensitive(self):
+        self.trie.add("Romeo", 1)
+        self.trie.add("romulus", 2)
+        self.trie.add("Juliet", 3)
+
+        self.assertCountEqual(self.trie.iter_prefix("ROM"), [1, 2])
+        self.assertCountEqual(self.trie.iter_prefix("rome"), [1])
+        self.assertCountEqual(self.trie.iter_prefix(""), [1, 2, 3])
+        self.assertCountEqual(self.trie.iter_prefix("x"), [])
+
+    def test_values_are_reference_counted(self):
+        self.trie.add("Romeo", 1)
+        self.trie.add("Romeo", 1)
+
+        self.assertSequenceEqual(list(self.trie.iter_prefix("r")), [1])
+
+        self.trie.remove("Romeo", 1)
+        self.assertSequenceEqual(list(self.trie.iter_prefix("r")), [1])
+
+        self.trie.remove("Romeo", 1)
+        self.assertSequenceEqual(list(self.trie.iter_prefix("r")), [])
+
+    def test_remove_raises_KeyError_for_missing_value(self):
+        self.trie.add("Romeo", 1)
+
+        with self.assertRaises(KeyError):
+            self.trie.remove("Romeo", 2)
+
+        with self.assertRaises(KeyError):
+            self.trie.remove("Juliet", 1)
+
+        with self.assertRaises(KeyError):
+            self.trie.remove("Rom", 1)
+
+    def test_remove_keeps_values_of_prefixes(self):
+        self.trie.add("Rom", 1)
+        self.trie.add("Romeo", 2)
+
+        self.trie.remove("Romeo", 2)
+
+        self.assertSequenceEqual(list(self.trie.iter_prefix("r")), [1])
+
+    def test_clear(self):
+        self.trie.add("Romeo", 1)
+        self.trie.clear()
+        self.assertSequenceEqual(list(self.trie.iter_prefix("")), [])
+
+
+class TestNickCompletionIndex(unittest.TestCase):
+    def setUp(self):
+        self.members = unittest.mock.Mock(["labelled_members"])
+        self.members.labelled_members.return_value = iter([
+            (unittest.mock.sentinel.romeo, "Romeo"),
+            (unittest.mock.sentinel.romulus, "romulus"),
+            (unittest.mock.sentinel.ro, "Ro"),
+        ])
+        self.members.on_member_added = aioxmpp.callbacks.AdHocSignal()
+        self.members.on_member_removed = aioxmpp.callbacks.AdHocSignal()
+        self.members.on_member_renamed = aioxmpp.callbacks.AdHocSignal()
+        self.members.on_reset = aioxmpp.callbacks.AdHocSignal()
+
+        self.index = completion.NickCompletionIndex(self.members)
+
+    def _complete(self, prefix, limit):
+        return [label for label, _ in self.index.complete(prefix, limit)]
+
+    def test_completions_carry_members(self):
+        self.assertSequenceEqual(
+            self.index.complete("rom", 10),
+            [
+                ("Romeo", unittest.mock.sentinel.romeo),
+                ("romulus", unittest.mock.sentinel.romulus),
+            ],
+        )
+
+    def test_completes_alphabetically_case_insensitively(self):
+        self.assertSequenceEqual(
+            self._complete("rO", 10),
+            ["Ro", "Romeo", "romulus"],
+        )
+
+    def test_limits_number_of_completions(self):
+        self.assertSequenceEqual(
+            self._complete("ro", 2),
+            ["Ro", "Romeo"],
+        )
+
+    def test_ranks_recent_speakers_first(self):
+        self.index.note_speaker("Romeo")
+        self.index.note_speaker("romulus")
+
+        self.assertSequenceEqual(
+            self._complete("ro", 10),
+            ["romulus", "Romeo", "Ro"],
+        )
+
+    def test_note_speaker_ignores_non_members(self):
+        self.index.note_speaker("Tybalt")
+        self.members.on_member_added(unittest.mock.sentinel.member, "Tybalt")
+
+        self.assertSequenceEqual(
+            self._complete("", 10),
+            ["Ro", "Romeo", "romulus", "Tybalt"],
+        )
+
+    def test_follows_added_members(self):
+        self.members.on_member_added(unittest.mock.sentinel.member, "Rosaline")
+
+        self.assertSequenceEqual(
+            self._complete("ros", 10),
+            ["Rosaline"],
+        )
+
+    def test_follows_removed_members(self):
+        self.index.note_speaker("Romeo")
+        self.members.on_member_removed(unittest.mock.sentinel.romeo, "Romeo")
+
+        self.assertSequenceEqual(
+            self._complete("ro", 10),
+            ["Ro", "romulus"],
+        )
+
+        self.members.on_member_added(unittest.mock.sentinel.romeo, "Romeo")
+        self.assertSequenceEqual(
+            self._complete("ro", 10),
+            ["Ro", "Romeo", "romulus"],
+        )
+
+    def test_rename_keeps_rank(self):
+        self.index.note_speaker("romulus")
+        self.members.on_member_renamed(unittest.mock.sentinel.romulus,
+                                       "romulus", "Remus")
+
+        self.assertSequenceEqual(
+            self._complete("r", 10),
+            ["Remus", "Ro", "Romeo"],
+        )
+
+    def test_reset_rebuilds_from_member_list(self):
+        self.index.note_speaker("Romeo")
+        self.members.labelled_members.return_value = iter([
+            (unittest.mock.sentinel.juliet, "Juliet"),
+            (unittest.mock.sentinel.romeo, "Romeo"),
+        ])
+        self.members.on_reset()
+
+        self.assertSequenceEqual(
+            self._complete("", 10),
+            ["Romeo", "Juliet"],
+        )
+
+
+class TestNickCompletionModel(unittest.TestCase):
+    def setUp(self):
+        self.model = completion.NickCompletionModel()
+
+    def test_is_model(self):
+        self.assertIsInstance(self.model, Qt.QAbstractListModel)
+
+    def test_set_completions(self):
+        self.model.set_completions([
+            ("Romeo", unittest.mock.sentinel.romeo),
+            ("Juliet", unittest.mock.sentinel.juliet),
+        ])
+
+        self.assertEqual(self.model.rowCount(Qt.QModelIndex()), 2)
+        self.assertEqual(
+            self.model.data(self.model.index(1), Qt.Qt.DisplayRole),
+            "Juliet",
+        )
+
+    def test_data_returns_member_as_object(self):
+        self.model.set_completions([
+            ("Romeo", unittest.mock.sentinel.romeo),
+            ("Juliet", unittest.mock.sentinel.juliet),
+        ])
+
+        self.assertEqual(
+            self.model.data(self.model.index(1), models.ROLE_OBJECT),
+            unittest.mock.sentinel.juliet,
+        )
+
+    def test_set_completions_resets_model_only_on_change(self):
+        self.model.set_completions([
+            ("Romeo", unittest.mock.sentinel.romeo),
+            ("Juliet", unittest.mock.sentinel.juliet),
+        ])
+
+        reset = unittest.mock.Mock()
+        self.model.modelReset.connect(reset)
+
+        self.model.set_completions([
+            ("Romeo", unittest.mock.sentinel.romeo),
+            ("Juliet", unittest.mock.sentinel.juliet),
+        ])
+        reset.assert_not_called()
+
+        self.model.set_completions([
+            ("Romeo", unittest.mock.sentinel.romeo),
+        ])
+        reset.assert_called_once_with()
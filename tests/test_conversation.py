@@ -1,18 +1,26 @@
 import asyncio
+import contextlib
 import functools
+import json
 import logging
 import os
+import re
 import sys
 import time
 import unittest
 import unittest.mock
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import lxml.html.html5parser
 import lxml.etree as etree
 
 import aioxmpp
+import aioxmpp.callbacks
+
+import jclib.conversation
+import jclib.metadata
+import jclib.roster
 
 from aioxmpp.testutils import (
     run_coroutine,
@@ -23,6 +31,7 @@ from aioxmpp.xmltestutils import (
 
 import jabbercat.Qt as Qt
 
+import jabbercat.avatar
 import jabbercat.conversation as conversation
 
 
@@ -74,6 +83,16 @@ class TestMessageViewPage(XMLTestCase):
         html_str = yield from self.page.channel.request_html()
         return lxml.html.html5parser.fromstring(html_str)
 
+    def _run_js(self, code, page=None):
+        page = page or self.page
+        fut = asyncio.Future()
+        page.runJavaScript(
+            code,
+            Qt.QWebEngineScript.ApplicationWorld,
+            fut.set_result,
+        )
+        return run_coroutine(fut, timeout=20)
+
     @halt_for_debugging
     def test_basic_html(self):
         self.assertSubtreeEqual(
@@ -245,8 +264,19 @@ class TestMessageViewPage(XMLTestCase):
         )
 
     @halt_for_debugging
-    def test_marker_append(self):
-        self.page.channel.on_message.emit(
+    def test_add_messages_batch(self):
+        self.page.channel.on_messages.emit([
+            {
+                "timestamp": datetime(2018, 3, 8, 11, 16, 15).isoformat() + "Z",
+                "from_self": False,
+                "from_jid": "romeo@montague.litX",
+                "display_name": "Romeo Montague",
+                "color_full": "#123456",
+                "color_weak": "#123",
+                "attachments": [],
+                "body": "<em>bar</em>",
+                "message_uid": "message-2"
+            },
             {
                 "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
                 "from_self": False,
@@ -257,19 +287,19 @@ class TestMessageViewPage(XMLTestCase):
                 "attachments": [],
                 "body": "<em>foo</em>",
                 "message_uid": "message-1"
-            }
-        )
-        self.page.channel.on_marker.emit(
+            },
             {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 15).isoformat() + "Z",
+                "timestamp": datetime(2018, 3, 8, 11, 16, 20).isoformat() + "Z",
                 "from_self": False,
-                "from_jid": "juliet@capulet.lit",
-                "display_name": "Juliet Capulet",
+                "from_jid": "romeo@montague.litX",
+                "display_name": "Romeo Montague",
                 "color_full": "#123456",
                 "color_weak": "#123",
-                "marked_message_uid": "message-1"
-            }
-        )
+                "attachments": [],
+                "body": "<em>baz</em>",
+                "message_uid": "message-3"
+            },
+        ])
         self.assertSubtreeEqual(
             etree.fromstring(
                 '<div xmlns="http://www.w3.org/1999/xhtml" id="messages">'
@@ -278,7 +308,7 @@ class TestMessageViewPage(XMLTestCase):
                 '<div class="from">Romeo Montague</div>'
                 '<div class="message-block-messages">'
                 '<div class="message">'
-                '<div class="timestamp">3/8/2018, 11:16:10 AM</div>'
+                '<div class="timestamp">3/8/2018, 11:16:10 AM</div>'
                 '<div class="content"><div class="payload">'
                 '<div class="body"><em>foo</em></div>'
                 '<div/></div></div>'
@@ -286,9 +316,28 @@ class TestMessageViewPage(XMLTestCase):
                 '</div>'
                 '<div class="clearfix"></div>'
                 '</div>'
-                '<div class="marker">'
-                '<img/>'
-                '<span>Juliet Capulet has read up to here.</span>'
+                '<div class="message-block">'
+                '<div class="avatar"><img/></div>'
+                '<div class="from">Romeo Montague</div>'
+                '<div class="message-block-messages">'
+                '<div class="message">'
+                '<div class="timestamp">'
+                '<span class="visual-hidden"></span><span>11:16:15</span>'
+                '</div>'
+                '<div class="content"><div class="payload">'
+                '<div class="body"><em>bar</em></div>'
+                '<div/></div></div>'
+                '</div>'
+                '<div class="message">'
+                '<div class="timestamp">'
+                '<span class="visual-hidden">11:16</span><span>:20</span>'
+                '</div>'
+                '<div class="content"><div class="payload">'
+                '<div class="body"><em>baz</em></div>'
+                '<div/></div></div>'
+                '</div>'
+                '</div>'
+                '<div class="clearfix"></div>'
                 '</div>'
                 '</div>'
             ),
@@ -297,7 +346,7 @@ class TestMessageViewPage(XMLTestCase):
         )
 
     @halt_for_debugging
-    def test_marker_insert_between(self):
+    def test_insert_with_equal_timestamp_uses_arrival_order(self):
         self.page.channel.on_message.emit(
             {
                 "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
@@ -313,9 +362,9 @@ class TestMessageViewPage(XMLTestCase):
         )
         self.page.channel.on_message.emit(
             {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 15).isoformat() + "Z",
+                "timestamp": datetime(2018, 3, 8, 11, 16, 20).isoformat() + "Z",
                 "from_self": False,
-                "from_jid": "romeo@montague.lit",
+                "from_jid": "romeo@montague.litX",
                 "display_name": "Romeo Montague",
                 "color_full": "#123456",
                 "color_weak": "#123",
@@ -324,18 +373,19 @@ class TestMessageViewPage(XMLTestCase):
                 "message_uid": "message-2"
             }
         )
-        self.page.channel.on_marker.emit(
+        self.page.channel.on_message.emit(
             {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 13).isoformat() + "Z",
+                "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
                 "from_self": False,
-                "from_jid": "juliet@capulet.lit",
-                "display_name": "Juliet Capulet",
+                "from_jid": "romeo@montague.lit",
+                "display_name": "Romeo Montague",
                 "color_full": "#123456",
                 "color_weak": "#123",
-                "marked_message_uid": "message-1"
+                "attachments": [],
+                "body": "<em>baz</em>",
+                "message_uid": "message-3"
             }
         )
-        html = run_coroutine(self._obtain_html())
         self.assertSubtreeEqual(
             etree.fromstring(
                 '<div xmlns="http://www.w3.org/1999/xhtml" id="messages">'
@@ -344,17 +394,21 @@ class TestMessageViewPage(XMLTestCase):
                 '<div class="from">Romeo Montague</div>'
                 '<div class="message-block-messages">'
                 '<div class="message">'
-                '<div class="timestamp">3/8/2018, 11:16:10 AM</div>'
+                '<div class="timestamp">3/8/2018, 11:16:10 AM</div>'
                 '<div class="content"><div class="payload">'
                 '<div class="body"><em>foo</em></div>'
                 '<div/></div></div>'
                 '</div>'
+                '<div class="message">'
+                '<div class="timestamp">'
+                '<span class="visual-hidden">11:16</span><span>:10</span>'
                 '</div>'
-                '<div class="clearfix"></div>'
+                '<div class="content"><div class="payload">'
+                '<div class="body"><em>baz</em></div>'
+                '<div/></div></div>'
                 '</div>'
-                '<div class="marker">'
-                '<img/>'
-                '<span>Juliet Capulet has read up to here.</span>'
+                '</div>'
+                '<div class="clearfix"></div>'
                 '</div>'
                 '<div class="message-block">'
                 '<div class="avatar"><img/></div>'
@@ -362,7 +416,7 @@ class TestMessageViewPage(XMLTestCase):
                 '<div class="message-block-messages">'
                 '<div class="message">'
                 '<div class="timestamp">'
-                '<span class="visual-hidden"></span><span>11:16:15</span>'
+                '<span class="visual-hidden"></span><span>11:16:20</span>'
                 '</div>'
                 '<div class="content"><div class="payload">'
                 '<div class="body"><em>bar</em></div>'
@@ -373,61 +427,54 @@ class TestMessageViewPage(XMLTestCase):
                 '</div>'
                 '</div>'
             ),
-            html,
+            run_coroutine(self._obtain_html(), timeout=20),
             ignore_surplus_attr=True,
         )
 
     @halt_for_debugging
-    def test_marker_rejoin_split_blocks(self):
+    def test_older_messages_are_prepended(self):
         self.page.channel.on_message.emit(
             {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
-                "from_self": False,
-                "from_jid": "romeo@montague.lit",
-                "display_name": "Romeo Montague",
-                "color_full": "#123456",
-                "color_weak": "#123",
-                "attachments": [],
-                "body": "<em>foo</em>",
-                "message_uid": "message-1"
-            }
-        )
-        self.page.channel.on_message.emit(
-            {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 15).isoformat() + "Z",
+                "timestamp": datetime(2018, 3, 8, 11, 16, 20).isoformat() + "Z",
                 "from_self": False,
                 "from_jid": "romeo@montague.lit",
                 "display_name": "Romeo Montague",
                 "color_full": "#123456",
                 "color_weak": "#123",
                 "attachments": [],
-                "body": "<em>bar</em>",
-                "message_uid": "message-2"
+                "body": "<em>baz</em>",
+                "message_uid": "message-3"
             }
         )
-        self.page.channel.on_marker.emit(
-            {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 13).isoformat() + "Z",
-                "from_self": False,
-                "from_jid": "juliet@capulet.lit",
-                "display_name": "Juliet Capulet",
-                "color_full": "#123456",
-                "color_weak": "#123",
-                "marked_message_uid": "message-1"
-            }
-        )
-        self.page.channel.on_marker.emit(
+        self.page.channel.on_older_messages.emit(
             {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 13).isoformat() + "Z",
-                "from_self": False,
-                "from_jid": "juliet@capulet.lit",
-                "display_name": "Juliet Capulet",
-                "color_full": "#123456",
-                "color_weak": "#123",
-                "marked_message_uid": "message-2"
+                "messages": [
+                    {
+                        "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
+                        "from_self": False,
+                        "from_jid": "romeo@montague.litX",
+                        "display_name": "Romeo Montague",
+                        "color_full": "#123456",
+                        "color_weak": "#123",
+                        "attachments": [],
+                        "body": "<em>foo</em>",
+                        "message_uid": "message-1"
+                    },
+                    {
+                        "timestamp": datetime(2018, 3, 8, 11, 16, 15).isoformat() + "Z",
+                        "from_self": False,
+                        "from_jid": "romeo@montague.lit",
+                        "display_name": "Romeo Montague",
+                        "color_full": "#123456",
+                        "color_weak": "#123",
+                        "attachments": [],
+                        "body": "<em>bar</em>",
+                        "message_uid": "message-2"
+                    },
+                ],
+                "exhausted": True,
             }
         )
-        html = run_coroutine(self._obtain_html())
         self.assertSubtreeEqual(
             etree.fromstring(
                 '<div xmlns="http://www.w3.org/1999/xhtml" id="messages">'
@@ -436,72 +483,325 @@ class TestMessageViewPage(XMLTestCase):
                 '<div class="from">Romeo Montague</div>'
                 '<div class="message-block-messages">'
                 '<div class="message">'
-                '<div class="timestamp">3/8/2018, 11:16:10 AM</div>'
+                '<div class="timestamp">3/8/2018, 11:16:10 AM</div>'
                 '<div class="content"><div class="payload">'
                 '<div class="body"><em>foo</em></div>'
                 '<div/></div></div>'
                 '</div>'
+                '</div>'
+                '<div class="clearfix"></div>'
+                '</div>'
+                '<div class="message-block">'
+                '<div class="avatar"><img/></div>'
+                '<div class="from">Romeo Montague</div>'
+                '<div class="message-block-messages">'
                 '<div class="message">'
                 '<div class="timestamp">'
-                '<span class="visual-hidden">11:16</span><span>:15</span>'
+                '<span class="visual-hidden"></span><span>11:16:15</span>'
                 '</div>'
                 '<div class="content"><div class="payload">'
                 '<div class="body"><em>bar</em></div>'
                 '<div/></div></div>'
                 '</div>'
+                '<div class="message">'
+                '<div class="timestamp">'
+                '<span class="visual-hidden">11:16</span><span>:20</span>'
+                '</div>'
+                '<div class="content"><div class="payload">'
+                '<div class="body"><em>baz</em></div>'
+                '<div/></div></div>'
+                '</div>'
                 '</div>'
                 '<div class="clearfix"></div>'
                 '</div>'
-                '<div class="marker">'
-                '<img/>'
-                '<span>Juliet Capulet has read up to here.</span>'
-                '</div>'
                 '</div>'
             ),
-            html,
+            run_coroutine(self._obtain_html(), timeout=20),
             ignore_surplus_attr=True,
         )
 
     @halt_for_debugging
-    def test_join_appends(self):
-        self.page.channel.on_join.emit(
-            {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
-                "from_self": False,
-                "from_jid": "romeo@montague.lit",
-                "display_name": "Romeo Montague",
-                "color_full": "#123456",
-                "color_weak": "#123"
-            }
+    def test_request_html_can_be_repeated(self):
+        run_coroutine(self.page.channel.request_html())
+        run_coroutine(self.page.channel.request_html())
+
+    @halt_for_debugging
+    def test_request_html_after_recycle(self):
+        run_coroutine(self.page.channel.request_html())
+        self.page.recycle()
+        run_coroutine(self.page.ready_event.wait())
+
+    @halt_for_debugging
+    def test_deferred_tasks_run_in_order_in_one_frame(self):
+        self.assertEqual(
+            self._run_js(
+                "(function() {"
+                "  var log = [];"
+                "  defer_to_frame(function() { log.push('a'); });"
+                "  defer_to_frame(function() { log.push('b'); });"
+                "  var queued = frame_tasks.length;"
+                "  run_frame();"
+                "  return [queued, log, frame_requested];"
+                "})()"
+            ),
+            [2, ["a", "b"], False],
         )
-        self.assertSubtreeEqual(
-            etree.fromstring(
-                '<div xmlns="http://www.w3.org/1999/xhtml" id="messages">'
-                '<div class="presence-block">'
-                '<div class="presence join">'
-                '<img/><span>Romeo Montague has joined.</span>'
-                '</div>'
-                '</div>'
-                '</div>'
+
+    @halt_for_debugging
+    def test_scroll_to_bottom_is_coalesced_after_tasks(self):
+        self.assertEqual(
+            self._run_js(
+                "(function() {"
+                "  var log = [];"
+                "  window.scrollTo = function() { log.push('scroll'); };"
+                "  stuck_to_bottom = true;"
+                "  defer_to_frame(function() {"
+                "    log.push('task 1'); scroll_to_bottom();"
+                "  });"
+                "  defer_to_frame(function() {"
+                "    log.push('task 2'); scroll_to_bottom();"
+                "  });"
+                "  run_frame();"
+                "  return log;"
+                "})()"
             ),
-            run_coroutine(self._obtain_html(), timeout=20),
-            ignore_surplus_attr=True,
+            ["task 1", "task 2", "scroll"],
         )
 
     @halt_for_debugging
-    def test_message_after_join(self):
-        # timestamp doesn’t matter for joins currently, so we aggressively set
-        # this to a later time than the message which follows afterwards
-        self.page.channel.on_join.emit(
-            {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 13).isoformat() + "Z",
-                "from_self": False,
-                "from_jid": "romeo@montague.lit",
-                "display_name": "Romeo Montague",
-                "color_full": "#123456",
-                "color_weak": "#123"
-            }
+    def test_does_not_scroll_to_bottom_unless_stuck(self):
+        self.assertEqual(
+            self._run_js(
+                "(function() {"
+                "  var log = [];"
+                "  window.scrollTo = function() { log.push('scroll'); };"
+                "  stuck_to_bottom = false;"
+                "  defer_to_frame(function() {"
+                "    log.push('task'); scroll_to_bottom();"
+                "  });"
+                "  run_frame();"
+                "  return log;"
+                "})()"
+            ),
+            ["task"],
+        )
+
+    @halt_for_debugging
+    def test_scrolling_updates_stuck_to_bottom(self):
+        self.assertEqual(
+            self._run_js(
+                "(function() {"
+                "  messages_parent.style.height = '100000px';"
+                "  window.scrollTo(0, 0);"
+                "  handle_scroll();"
+                "  var at_top = stuck_to_bottom;"
+                "  window.scrollTo(0, document.body.scrollHeight);"
+                "  handle_scroll();"
+                "  return [at_top, stuck_to_bottom];"
+                "})()"
+            ),
+            [False, True],
+        )
+
+    @halt_for_debugging
+    def test_runs_frame_from_timer_while_hidden(self):
+        self._run_js(
+            "window.requestAnimationFrame = function() {};"
+            "run_frame();"
+            "Object.defineProperty(document, 'hidden',"
+            "                      {value: true, configurable: true});"
+            "window.flushed = false;"
+            "defer_to_frame(function() { window.flushed = true; });"
+        )
+        run_coroutine(asyncio.sleep(0.5))
+        self.assertIs(self._run_js("window.flushed"), True)
+
+    @halt_for_debugging
+    def test_runs_requested_frame_when_page_gets_hidden(self):
+        self._run_js(
+            "window.requestAnimationFrame = function() {};"
+            "run_frame();"
+            "Object.defineProperty(document, 'hidden',"
+            "                      {value: false, configurable: true});"
+            "window.flushed = false;"
+            "defer_to_frame(function() { window.flushed = true; });"
+            "Object.defineProperty(document, 'hidden',"
+            "                      {value: true, configurable: true});"
+            "document.dispatchEvent(new Event('visibilitychange'));"
+        )
+        run_coroutine(asyncio.sleep(0.5))
+        self.assertIs(self._run_js("window.flushed"), True)
+        run_coroutine(self.page.channel.request_html())
+
+    # helpers for the avatar index tests: make_info builds a message for
+    # add_messages, avatar_srcs returns the src of each avatar image and
+    # avatar_index_matches_dom checks that exactly the avatar images in the
+    # document are indexed
+    AVATAR_JS_HELPERS = (
+        "var make_info = function(uid, from_jid, second) {"
+        "  return {"
+        "    timestamp: '2018-03-08T11:16:' + second + 'Z',"
+        "    from_self: false,"
+        "    from_jid: from_jid,"
+        "    display_name: from_jid,"
+        "    color_full: '#123456',"
+        "    color_weak: '#123',"
+        "    attachments: [],"
+        "    body: 'foo',"
+        "    message_uid: uid,"
+        "  };"
+        "};"
+        "var avatar_imgs = function() {"
+        "  return Array.prototype.slice.call("
+        "    messages_parent.querySelectorAll('img[data-avatar_address]')"
+        "  );"
+        "};"
+        "var avatar_srcs = function(imgs) {"
+        "  return imgs.map(function(img) {"
+        "    return img.getAttribute('src');"
+        "  });"
+        "};"
+        "var avatar_index_matches_dom = function() {"
+        "  var imgs = avatar_imgs();"
+        "  var nindexed = 0;"
+        "  for (var address in avatar_img_index) {"
+        "    nindexed += avatar_img_index[address].size;"
+        "  }"
+        "  return nindexed === imgs.length && imgs.every(function(img) {"
+        "    var indexed = avatar_img_index[img.dataset.avatar_address];"
+        "    return indexed !== undefined && indexed.has(img);"
+        "  });"
+        "};"
+    )
+
+    @halt_for_debugging
+    def test_avatar_change_updates_only_indexed_imgs(self):
+        self.assertEqual(
+            self._run_js(
+                self.AVATAR_JS_HELPERS +
+                "(function() {"
+                "  add_messages(["
+                "    make_info('m1', 'romeo@montague.lit', '10'),"
+                "    make_info('m2', 'mercutio@montague.lit', '11'),"
+                "    make_info('m3', 'romeo@montague.lit', '12'),"
+                "  ]);"
+                "  var imgs = avatar_imgs();"
+                "  var before = avatar_srcs(imgs);"
+                "  var consistent = avatar_index_matches_dom();"
+                "  var unloaded = messages_parent.lastChild;"
+                "  var unloaded_img = unloaded.querySelector('img');"
+                "  var unloaded_src = unloaded_img.getAttribute('src');"
+                "  unload_toplevel(unloaded);"
+                "  avatar_changed({address: 'romeo@montague.lit'});"
+                "  var after = avatar_srcs(imgs);"
+                "  return ["
+                "    consistent,"
+                "    imgs.length,"
+                "    before[0] !== after[0],"
+                "    before[1] === after[1],"
+                "    unloaded_img.getAttribute('src') === unloaded_src,"
+                "    avatar_index_matches_dom(),"
+                "  ];"
+                "})()"
+            ),
+            [True, 3, True, True, True, True],
+        )
+
+    @halt_for_debugging
+    def test_avatar_index_follows_unloaded_history(self):
+        self.assertEqual(
+            self._run_js(
+                self.AVATAR_JS_HELPERS +
+                "(function() {"
+                "  add_messages(["
+                "    make_info('m1', 'romeo@montague.lit', '10'),"
+                "    make_info('m2', 'mercutio@montague.lit', '11'),"
+                "  ]);"
+                "  unload_toplevel(messages_parent.firstChild);"
+                "  messages.splice(0, 1);"
+                "  return ["
+                "    avatar_img_index['romeo@montague.lit'] === undefined,"
+                "    avatar_img_index['mercutio@montague.lit'].size,"
+                "    avatar_index_matches_dom(),"
+                "  ];"
+                "})()"
+            ),
+            [True, 1, True],
+        )
+
+    @halt_for_debugging
+    def test_avatar_index_follows_prepended_history(self):
+        self.assertEqual(
+            self._run_js(
+                self.AVATAR_JS_HELPERS +
+                "(function() {"
+                "  add_messages([make_info('m3', 'romeo@montague.lit', '20')]);"
+                "  older_messages({"
+                "    messages: ["
+                "      make_info('m1', 'mercutio@montague.lit', '10'),"
+                "      make_info('m2', 'romeo@montague.lit', '15'),"
+                "    ],"
+                "    exhausted: true,"
+                "  });"
+                "  var imgs = avatar_imgs();"
+                "  var before = avatar_srcs(imgs);"
+                "  avatar_changed({address: 'mercutio@montague.lit'});"
+                "  var after = avatar_srcs(imgs);"
+                "  return ["
+                "    imgs.length,"
+                "    avatar_index_matches_dom(),"
+                "    before[0] !== after[0],"
+                "    before[1] === after[1],"
+                "  ];"
+                "})()"
+            ),
+            [2, True, True, True],
+        )
+
+    @halt_for_debugging
+    def test_avatar_index_is_rebuilt_from_snapshot(self):
+        self._run_js(
+            self.AVATAR_JS_HELPERS +
+            "add_messages(["
+            "  make_info('m1', 'romeo@montague.lit', '10'),"
+            "  make_info('m2', 'mercutio@montague.lit', '11'),"
+            "]);"
+        )
+        snapshot = run_coroutine(self.page.channel.request_html())
+
+        restored = conversation.MessageViewPage(
+            self.profile,
+            logging.getLogger(
+                ".".join([__name__, type(self).__qualname__])
+            ),
+            self.account_jid,
+            self.conversation_jid,
+        )
+        run_coroutine(restored.ready_event.wait())
+
+        self.assertEqual(
+            self._run_js(
+                self.AVATAR_JS_HELPERS +
+                "(function() {"
+                "  restore_snapshot(" + json.dumps(snapshot) + ");"
+                "  var imgs = avatar_imgs();"
+                "  var before = avatar_srcs(imgs);"
+                "  avatar_changed({address: 'romeo@montague.lit'});"
+                "  var after = avatar_srcs(imgs);"
+                "  return ["
+                "    imgs.length,"
+                "    avatar_index_matches_dom(),"
+                "    before[0] !== after[0],"
+                "    before[1] === after[1],"
+                "  ];"
+                "})()",
+                page=restored,
+            ),
+            [2, True, True, True],
         )
+
+    @halt_for_debugging
+    def test_restore_from_snapshot(self):
         self.page.channel.on_message.emit(
             {
                 "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
@@ -511,39 +811,55 @@ class TestMessageViewPage(XMLTestCase):
                 "color_full": "#123456",
                 "color_weak": "#123",
                 "attachments": [],
-                "body": "<em>test</em>",
+                "body": "<em>foo</em>",
                 "message_uid": "message-1"
             }
         )
+        snapshot = run_coroutine(self.page.channel.request_html())
+
+        restored = conversation.MessageViewPage(
+            self.profile,
+            logging.getLogger(
+                ".".join([__name__, type(self).__qualname__])
+            ),
+            self.account_jid,
+            self.conversation_jid,
+        )
+        run_coroutine(restored.ready_event.wait())
+        restored.channel.on_restore.emit(snapshot)
+        restored.channel.on_flag.emit(
+            {
+                "flagged_message_uid": "message-1",
+                "flag": "DELIVERED_TO_SERVER",
+                "message": None,
+            }
+        )
+
+        html_str = run_coroutine(restored.channel.request_html())
         self.assertSubtreeEqual(
             etree.fromstring(
                 '<div xmlns="http://www.w3.org/1999/xhtml" id="messages">'
-                '<div class="presence-block">'
-                '<div class="presence join">'
-                '<img/><span>Romeo Montague has joined.</span>'
-                '</div>'
-                '</div>'
                 '<div class="message-block">'
                 '<div class="avatar"><img/></div>'
                 '<div class="from">Romeo Montague</div>'
                 '<div class="message-block-messages">'
                 '<div class="message">'
-                '<div class="timestamp">3/8/2018, 11:16:10 AM</div>'
+                '<div class="timestamp">3/8/2018, 11:16:10 AM</div>'
                 '<div class="content"><div class="payload">'
-                '<div class="body"><em>test</em></div>'
-                '<div/></div></div>'
+                '<div class="body"><em>foo</em></div>'
+                '<div class="flag"><img/></div></div></div>'
                 '</div>'
                 '</div>'
                 '<div class="clearfix"></div>'
                 '</div>'
                 '</div>'
             ),
-            run_coroutine(self._obtain_html(), timeout=20),
+            lxml.html.html5parser.fromstring(html_str),
             ignore_surplus_attr=True,
         )
 
     @halt_for_debugging
-    def test_message_join_marker(self):
+    def test_marker_append(self):
         self.page.channel.on_message.emit(
             {
                 "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
@@ -553,23 +869,13 @@ class TestMessageViewPage(XMLTestCase):
                 "color_full": "#123456",
                 "color_weak": "#123",
                 "attachments": [],
-                "body": "<em>test</em>",
+                "body": "<em>foo</em>",
                 "message_uid": "message-1"
             }
         )
-        self.page.channel.on_join.emit(
-            {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 13).isoformat() + "Z",
-                "from_self": False,
-                "from_jid": "romeo@montague.lit",
-                "display_name": "Romeo Montague",
-                "color_full": "#123456",
-                "color_weak": "#123"
-            }
-        )
         self.page.channel.on_marker.emit(
             {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 13).isoformat() + "Z",
+                "timestamp": datetime(2018, 3, 8, 11, 16, 15).isoformat() + "Z",
                 "from_self": False,
                 "from_jid": "juliet@capulet.lit",
                 "display_name": "Juliet Capulet",
@@ -588,7 +894,7 @@ class TestMessageViewPage(XMLTestCase):
                 '<div class="message">'
                 '<div class="timestamp">3/8/2018, 11:16:10 AM</div>'
                 '<div class="content"><div class="payload">'
-                '<div class="body"><em>test</em></div>'
+                '<div class="body"><em>foo</em></div>'
                 '<div/></div></div>'
                 '</div>'
                 '</div>'
@@ -598,19 +904,95 @@ class TestMessageViewPage(XMLTestCase):
                 '<img/>'
                 '<span>Juliet Capulet has read up to here.</span>'
                 '</div>'
-                '<div class="presence-block">'
-                '<div class="presence join">'
-                '<img/><span>Romeo Montague has joined.</span>'
                 '</div>'
+            ),
+            run_coroutine(self._obtain_html(), timeout=20),
+            ignore_surplus_attr=True,
+        )
+
+    @halt_for_debugging
+    def test_marker_insert_between(self):
+        self.page.channel.on_message.emit(
+            {
+                "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
+                "from_self": False,
+                "from_jid": "romeo@montague.lit",
+                "display_name": "Romeo Montague",
+                "color_full": "#123456",
+                "color_weak": "#123",
+                "attachments": [],
+                "body": "<em>foo</em>",
+                "message_uid": "message-1"
+            }
+        )
+        self.page.channel.on_message.emit(
+            {
+                "timestamp": datetime(2018, 3, 8, 11, 16, 15).isoformat() + "Z",
+                "from_self": False,
+                "from_jid": "romeo@montague.lit",
+                "display_name": "Romeo Montague",
+                "color_full": "#123456",
+                "color_weak": "#123",
+                "attachments": [],
+                "body": "<em>bar</em>",
+                "message_uid": "message-2"
+            }
+        )
+        self.page.channel.on_marker.emit(
+            {
+                "timestamp": datetime(2018, 3, 8, 11, 16, 13).isoformat() + "Z",
+                "from_self": False,
+                "from_jid": "juliet@capulet.lit",
+                "display_name": "Juliet Capulet",
+                "color_full": "#123456",
+                "color_weak": "#123",
+                "marked_message_uid": "message-1"
+            }
+        )
+        html = run_coroutine(self._obtain_html())
+        self.assertSubtreeEqual(
+            etree.fromstring(
+                '<div xmlns="http://www.w3.org/1999/xhtml" id="messages">'
+                '<div class="message-block">'
+                '<div class="avatar"><img/></div>'
+                '<div class="from">Romeo Montague</div>'
+                '<div class="message-block-messages">'
+                '<div class="message">'
+                '<div class="timestamp">3/8/2018, 11:16:10 AM</div>'
+                '<div class="content"><div class="payload">'
+                '<div class="body"><em>foo</em></div>'
+                '<div/></div></div>'
+                '</div>'
+                '</div>'
+                '<div class="clearfix"></div>'
+                '</div>'
+                '<div class="marker">'
+                '<img/>'
+                '<span>Juliet Capulet has read up to here.</span>'
+                '</div>'
+                '<div class="message-block">'
+                '<div class="avatar"><img/></div>'
+                '<div class="from">Romeo Montague</div>'
+                '<div class="message-block-messages">'
+                '<div class="message">'
+                '<div class="timestamp">'
+                '<span class="visual-hidden"></span><span>11:16:15</span>'
+                '</div>'
+                '<div class="content"><div class="payload">'
+                '<div class="body"><em>bar</em></div>'
+                '<div/></div></div>'
+                '</div>'
+                '</div>'
+                '<div class="clearfix"></div>'
                 '</div>'
                 '</div>'
             ),
-            run_coroutine(self._obtain_html(), timeout=20),
+            html,
             ignore_surplus_attr=True,
         )
 
     @halt_for_debugging
-    def test_message_marker_join(self):
+    def test_marker_rejoin_split_blocks(self):
         self.page.channel.on_message.emit(
             {
                 "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
@@ -620,10 +1002,23 @@ class TestMessageViewPage(XMLTestCase):
                 "color_full": "#123456",
                 "color_weak": "#123",
                 "attachments": [],
-                "body": "<em>test</em>",
+                "body": "<em>foo</em>",
                 "message_uid": "message-1"
             }
         )
+        self.page.channel.on_message.emit(
+            {
+                "timestamp": datetime(2018, 3, 8, 11, 16, 15).isoformat() + "Z",
+                "from_self": False,
+                "from_jid": "romeo@montague.lit",
+                "display_name": "Romeo Montague",
+                "color_full": "#123456",
+                "color_weak": "#123",
+                "attachments": [],
+                "body": "<em>bar</em>",
+                "message_uid": "message-2"
+            }
+        )
         self.page.channel.on_marker.emit(
             {
                 "timestamp": datetime(2018, 3, 8, 11, 16, 13).isoformat() + "Z",
@@ -635,14 +1030,181 @@ class TestMessageViewPage(XMLTestCase):
                 "marked_message_uid": "message-1"
             }
         )
-        self.page.channel.on_join.emit(
+        self.page.channel.on_marker.emit(
             {
                 "timestamp": datetime(2018, 3, 8, 11, 16, 13).isoformat() + "Z",
                 "from_self": False,
+                "from_jid": "juliet@capulet.lit",
+                "display_name": "Juliet Capulet",
+                "color_full": "#123456",
+                "color_weak": "#123",
+                "marked_message_uid": "message-2"
+            }
+        )
+        html = run_coroutine(self._obtain_html())
+        self.assertSubtreeEqual(
+            etree.fromstring(
+                '<div xmlns="http://www.w3.org/1999/xhtml" id="messages">'
+                '<div class="message-block">'
+                '<div class="avatar"><img/></div>'
+                '<div class="from">Romeo Montague</div>'
+                '<div class="message-block-messages">'
+                '<div class="message">'
+                '<div class="timestamp">3/8/2018, 11:16:10 AM</div>'
+                '<div class="content"><div class="payload">'
+                '<div class="body"><em>foo</em></div>'
+                '<div/></div></div>'
+                '</div>'
+                '<div class="message">'
+                '<div class="timestamp">'
+                '<span class="visual-hidden">11:16</span><span>:15</span>'
+                '</div>'
+                '<div class="content"><div class="payload">'
+                '<div class="body"><em>bar</em></div>'
+                '<div/></div></div>'
+                '</div>'
+                '</div>'
+                '<div class="clearfix"></div>'
+                '</div>'
+                '<div class="marker">'
+                '<img/>'
+                '<span>Juliet Capulet has read up to here.</span>'
+                '</div>'
+                '</div>'
+            ),
+            html,
+            ignore_surplus_attr=True,
+        )
+
+    @halt_for_debugging
+    def test_join_appends(self):
+        self.page.channel.on_presence.emit(
+            {
+                "events": [
+                    {
+                        "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
+                        "from_self": False,
+                        "from_jid": "romeo@montague.lit",
+                        "display_name": "Romeo Montague",
+                        "color_full": "#123456",
+                        "color_weak": "#123",
+                        "is_join": True
+                    }
+                ]
+            }
+        )
+        self.assertSubtreeEqual(
+            etree.fromstring(
+                '<div xmlns="http://www.w3.org/1999/xhtml" id="messages">'
+                '<div class="presence-block">'
+                '<div class="presence join">'
+                '<img/><span>Romeo Montague has joined.</span>'
+                '</div>'
+                '</div>'
+                '</div>'
+            ),
+            run_coroutine(self._obtain_html(), timeout=20),
+            ignore_surplus_attr=True,
+        )
+
+    @halt_for_debugging
+    def test_message_after_join(self):
+        # timestamp doesn’t matter for joins currently, so we aggressively set
+        # this to a later time than the message which follows afterwards
+        self.page.channel.on_presence.emit(
+            {
+                "events": [
+                    {
+                        "timestamp": datetime(2018, 3, 8, 11, 16, 13).isoformat() + "Z",
+                        "from_self": False,
+                        "from_jid": "romeo@montague.lit",
+                        "display_name": "Romeo Montague",
+                        "color_full": "#123456",
+                        "color_weak": "#123",
+                        "is_join": True
+                    }
+                ]
+            }
+        )
+        self.page.channel.on_message.emit(
+            {
+                "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
+                "from_self": False,
                 "from_jid": "romeo@montague.lit",
                 "display_name": "Romeo Montague",
                 "color_full": "#123456",
-                "color_weak": "#123"
+                "color_weak": "#123",
+                "attachments": [],
+                "body": "<em>test</em>",
+                "message_uid": "message-1"
+            }
+        )
+        self.assertSubtreeEqual(
+            etree.fromstring(
+                '<div xmlns="http://www.w3.org/1999/xhtml" id="messages">'
+                '<div class="presence-block">'
+                '<div class="presence join">'
+                '<img/><span>Romeo Montague has joined.</span>'
+                '</div>'
+                '</div>'
+                '<div class="message-block">'
+                '<div class="avatar"><img/></div>'
+                '<div class="from">Romeo Montague</div>'
+                '<div class="message-block-messages">'
+                '<div class="message">'
+                '<div class="timestamp">3/8/2018, 11:16:10 AM</div>'
+                '<div class="content"><div class="payload">'
+                '<div class="body"><em>test</em></div>'
+                '<div/></div></div>'
+                '</div>'
+                '</div>'
+                '<div class="clearfix"></div>'
+                '</div>'
+                '</div>'
+            ),
+            run_coroutine(self._obtain_html(), timeout=20),
+            ignore_surplus_attr=True,
+        )
+
+    @halt_for_debugging
+    def test_message_join_marker(self):
+        self.page.channel.on_message.emit(
+            {
+                "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
+                "from_self": False,
+                "from_jid": "romeo@montague.lit",
+                "display_name": "Romeo Montague",
+                "color_full": "#123456",
+                "color_weak": "#123",
+                "attachments": [],
+                "body": "<em>test</em>",
+                "message_uid": "message-1"
+            }
+        )
+        self.page.channel.on_presence.emit(
+            {
+                "events": [
+                    {
+                        "timestamp": datetime(2018, 3, 8, 11, 16, 13).isoformat() + "Z",
+                        "from_self": False,
+                        "from_jid": "romeo@montague.lit",
+                        "display_name": "Romeo Montague",
+                        "color_full": "#123456",
+                        "color_weak": "#123",
+                        "is_join": True
+                    }
+                ]
+            }
+        )
+        self.page.channel.on_marker.emit(
+            {
+                "timestamp": datetime(2018, 3, 8, 11, 16, 13).isoformat() + "Z",
+                "from_self": False,
+                "from_jid": "juliet@capulet.lit",
+                "display_name": "Juliet Capulet",
+                "color_full": "#123456",
+                "color_weak": "#123",
+                "marked_message_uid": "message-1"
             }
         )
         self.assertSubtreeEqual(
@@ -677,25 +1239,107 @@ class TestMessageViewPage(XMLTestCase):
         )
 
     @halt_for_debugging
-    def test_multiple_joins_aggregate(self):
-        self.page.channel.on_join.emit(
+    def test_message_marker_join(self):
+        self.page.channel.on_message.emit(
             {
                 "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
                 "from_self": False,
                 "from_jid": "romeo@montague.lit",
                 "display_name": "Romeo Montague",
                 "color_full": "#123456",
-                "color_weak": "#123"
+                "color_weak": "#123",
+                "attachments": [],
+                "body": "<em>test</em>",
+                "message_uid": "message-1"
             }
         )
-        self.page.channel.on_join.emit(
+        self.page.channel.on_marker.emit(
             {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
+                "timestamp": datetime(2018, 3, 8, 11, 16, 13).isoformat() + "Z",
                 "from_self": False,
                 "from_jid": "juliet@capulet.lit",
                 "display_name": "Juliet Capulet",
                 "color_full": "#123456",
-                "color_weak": "#123"
+                "color_weak": "#123",
+                "marked_message_uid": "message-1"
+            }
+        )
+        self.page.channel.on_presence.emit(
+            {
+                "events": [
+                    {
+                        "timestamp": datetime(2018, 3, 8, 11, 16, 13).isoformat() + "Z",
+                        "from_self": False,
+                        "from_jid": "romeo@montague.lit",
+                        "display_name": "Romeo Montague",
+                        "color_full": "#123456",
+                        "color_weak": "#123",
+                        "is_join": True
+                    }
+                ]
+            }
+        )
+        self.assertSubtreeEqual(
+            etree.fromstring(
+                '<div xmlns="http://www.w3.org/1999/xhtml" id="messages">'
+                '<div class="message-block">'
+                '<div class="avatar"><img/></div>'
+                '<div class="from">Romeo Montague</div>'
+                '<div class="message-block-messages">'
+                '<div class="message">'
+                '<div class="timestamp">3/8/2018, 11:16:10 AM</div>'
+                '<div class="content"><div class="payload">'
+                '<div class="body"><em>test</em></div>'
+                '<div/></div></div>'
+                '</div>'
+                '</div>'
+                '<div class="clearfix"></div>'
+                '</div>'
+                '<div class="marker">'
+                '<img/>'
+                '<span>Juliet Capulet has read up to here.</span>'
+                '</div>'
+                '<div class="presence-block">'
+                '<div class="presence join">'
+                '<img/><span>Romeo Montague has joined.</span>'
+                '</div>'
+                '</div>'
+                '</div>'
+            ),
+            run_coroutine(self._obtain_html(), timeout=20),
+            ignore_surplus_attr=True,
+        )
+
+    @halt_for_debugging
+    def test_multiple_joins_aggregate(self):
+        self.page.channel.on_presence.emit(
+            {
+                "events": [
+                    {
+                        "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
+                        "from_self": False,
+                        "from_jid": "romeo@montague.lit",
+                        "display_name": "Romeo Montague",
+                        "color_full": "#123456",
+                        "color_weak": "#123",
+                        "is_join": True
+                    }
+                ]
+            }
+        )
+        self.page.channel.on_presence.emit(
+            {
+                "events": [
+                    {
+                        "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
+                        "from_self": False,
+                        "from_jid": "juliet@capulet.lit",
+                        "display_name": "Juliet Capulet",
+                        "color_full": "#123456",
+                        "color_weak": "#123",
+                        "is_join": True
+                    }
+                ]
             }
         )
         self.assertSubtreeEqual(
@@ -717,14 +1361,19 @@ class TestMessageViewPage(XMLTestCase):
 
     @halt_for_debugging
     def test_part_appends(self):
-        self.page.channel.on_part.emit(
+        self.page.channel.on_presence.emit(
             {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
-                "from_self": False,
-                "from_jid": "romeo@montague.lit",
-                "display_name": "Romeo Montague",
-                "color_full": "#123456",
-                "color_weak": "#123"
+                "events": [
+                    {
+                        "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
+                        "from_self": False,
+                        "from_jid": "romeo@montague.lit",
+                        "display_name": "Romeo Montague",
+                        "color_full": "#123456",
+                        "color_weak": "#123",
+                        "is_join": False
+                    }
+                ]
             }
         )
         self.assertSubtreeEqual(
@@ -743,24 +1392,34 @@ class TestMessageViewPage(XMLTestCase):
 
     @halt_for_debugging
     def test_part_annihilates_with_join(self):
-        self.page.channel.on_part.emit(
+        self.page.channel.on_presence.emit(
             {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
-                "from_self": False,
-                "from_jid": "romeo@montague.lit",
-                "display_name": "Romeo Montague",
-                "color_full": "#123456",
-                "color_weak": "#123"
+                "events": [
+                    {
+                        "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
+                        "from_self": False,
+                        "from_jid": "romeo@montague.lit",
+                        "display_name": "Romeo Montague",
+                        "color_full": "#123456",
+                        "color_weak": "#123",
+                        "is_join": False
+                    }
+                ]
             }
         )
-        self.page.channel.on_join.emit(
+        self.page.channel.on_presence.emit(
             {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
-                "from_self": False,
-                "from_jid": "romeo@montague.lit",
-                "display_name": "Romeo Montague",
-                "color_full": "#123456",
-                "color_weak": "#123"
+                "events": [
+                    {
+                        "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
+                        "from_self": False,
+                        "from_jid": "romeo@montague.lit",
+                        "display_name": "Romeo Montague",
+                        "color_full": "#123456",
+                        "color_weak": "#123",
+                        "is_join": True
+                    }
+                ]
             }
         )
         self.assertSubtreeEqual(
@@ -774,24 +1433,34 @@ class TestMessageViewPage(XMLTestCase):
 
     @halt_for_debugging
     def test_part_does_not_annihilate_with_join_of_other_entity(self):
-        self.page.channel.on_part.emit(
+        self.page.channel.on_presence.emit(
             {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
-                "from_self": False,
-                "from_jid": "juliet@capulet.lit",
-                "display_name": "Juliet Capulet",
-                "color_full": "#123456",
-                "color_weak": "#123"
+                "events": [
+                    {
+                        "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
+                        "from_self": False,
+                        "from_jid": "juliet@capulet.lit",
+                        "display_name": "Juliet Capulet",
+                        "color_full": "#123456",
+                        "color_weak": "#123",
+                        "is_join": False
+                    }
+                ]
             }
         )
-        self.page.channel.on_join.emit(
+        self.page.channel.on_presence.emit(
             {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
-                "from_self": False,
-                "from_jid": "romeo@montague.lit",
-                "display_name": "Romeo Montague",
-                "color_full": "#123456",
-                "color_weak": "#123"
+                "events": [
+                    {
+                        "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
+                        "from_self": False,
+                        "from_jid": "romeo@montague.lit",
+                        "display_name": "Romeo Montague",
+                        "color_full": "#123456",
+                        "color_weak": "#123",
+                        "is_join": True
+                    }
+                ]
             }
         )
         self.assertSubtreeEqual(
@@ -813,34 +1482,49 @@ class TestMessageViewPage(XMLTestCase):
 
     @halt_for_debugging
     def test_part_annihilates_across_other_joins(self):
-        self.page.channel.on_part.emit(
+        self.page.channel.on_presence.emit(
             {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
-                "from_self": False,
-                "from_jid": "romeo@montague.lit",
-                "display_name": "Romeo Montague",
-                "color_full": "#123456",
-                "color_weak": "#123"
+                "events": [
+                    {
+                        "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
+                        "from_self": False,
+                        "from_jid": "romeo@montague.lit",
+                        "display_name": "Romeo Montague",
+                        "color_full": "#123456",
+                        "color_weak": "#123",
+                        "is_join": False
+                    }
+                ]
             }
         )
-        self.page.channel.on_join.emit(
+        self.page.channel.on_presence.emit(
             {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
-                "from_self": False,
-                "from_jid": "juliet@capulet.lit",
-                "display_name": "Juliet Capulet",
-                "color_full": "#123456",
-                "color_weak": "#123"
+                "events": [
+                    {
+                        "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
+                        "from_self": False,
+                        "from_jid": "juliet@capulet.lit",
+                        "display_name": "Juliet Capulet",
+                        "color_full": "#123456",
+                        "color_weak": "#123",
+                        "is_join": True
+                    }
+                ]
             }
         )
-        self.page.channel.on_join.emit(
+        self.page.channel.on_presence.emit(
             {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
-                "from_self": False,
-                "from_jid": "romeo@montague.lit",
-                "display_name": "Romeo Montague",
-                "color_full": "#123456",
-                "color_weak": "#123"
+                "events": [
+                    {
+                        "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
+                        "from_self": False,
+                        "from_jid": "romeo@montague.lit",
+                        "display_name": "Romeo Montague",
+                        "color_full": "#123456",
+                        "color_weak": "#123",
+                        "is_join": True
+                    }
+                ]
             }
         )
         self.assertSubtreeEqual(
@@ -859,24 +1543,34 @@ class TestMessageViewPage(XMLTestCase):
 
     @halt_for_debugging
     def test_join_does_not_annihilate_with_part(self):
-        self.page.channel.on_join.emit(
+        self.page.channel.on_presence.emit(
             {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
-                "from_self": False,
-                "from_jid": "romeo@montague.lit",
-                "display_name": "Romeo Montague",
-                "color_full": "#123456",
-                "color_weak": "#123"
+                "events": [
+                    {
+                        "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
+                        "from_self": False,
+                        "from_jid": "romeo@montague.lit",
+                        "display_name": "Romeo Montague",
+                        "color_full": "#123456",
+                        "color_weak": "#123",
+                        "is_join": True
+                    }
+                ]
             }
         )
-        self.page.channel.on_part.emit(
+        self.page.channel.on_presence.emit(
             {
-                "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
-                "from_self": False,
-                "from_jid": "romeo@montague.lit",
-                "display_name": "Romeo Montague",
-                "color_full": "#123456",
-                "color_weak": "#123"
+                "events": [
+                    {
+                        "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
+                        "from_self": False,
+                        "from_jid": "romeo@montague.lit",
+                        "display_name": "Romeo Montague",
+                        "color_full": "#123456",
+                        "color_weak": "#123",
+                        "is_join": False
+                    }
+                ]
             }
         )
         self.assertSubtreeEqual(
@@ -892,8 +1586,80 @@ class TestMessageViewPage(XMLTestCase):
                 '</div>'
                 '</div>'
             ),
-            run_coroutine(self._obtain_html(), timeout=20),
-            ignore_surplus_attr=True,
+            run_coroutine(self._obtain_html(), timeout=20),
+            ignore_surplus_attr=True,
+        )
+
+    @halt_for_debugging
+    def test_large_presence_batch_is_summarised(self):
+        events = [
+            {
+                "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
+                "from_self": False,
+                "from_jid": "user{}@capulet.lit".format(i),
+                "display_name": "User {}".format(i),
+                "color_full": "#123456",
+                "color_weak": "#123",
+                "is_join": i % 4 != 0,
+            }
+            for i in range(16)
+        ]
+        self.page.channel.on_presence.emit({"events": events})
+        self.assertSubtreeEqual(
+            etree.fromstring(
+                '<div xmlns="http://www.w3.org/1999/xhtml" id="messages">'
+                '<div class="presence-block summarised">'
+                '<div class="presence-summary">12 joined, 4 left</div>'
+                '</div>'
+                '</div>'
+            ),
+            run_coroutine(self._obtain_html(), timeout=20),
+            ignore_surplus_attr=True,
+        )
+
+    @halt_for_debugging
+    def test_presence_events_are_serialised_only_for_snapshots(self):
+        def make_event(i, is_join):
+            return {
+                "timestamp": datetime(2018, 3, 8, 11, 16, 10).isoformat() + "Z",
+                "from_self": False,
+                "from_jid": "user{}@capulet.lit".format(i),
+                "display_name": "User {}".format(i),
+                "color_full": "#123456",
+                "color_weak": "#123",
+                "is_join": is_join,
+            }
+
+        events = [make_event(i, i % 4 != 0) for i in range(16)]
+        self.assertIs(
+            self._run_js(
+                "presence({events: " + json.dumps(events) + "});"
+                "messages_parent.lastChild.dataset.events === undefined"
+            ),
+            True,
+        )
+        snapshot = run_coroutine(self.page.channel.request_html())
+
+        restored = conversation.MessageViewPage(
+            self.profile,
+            logging.getLogger(
+                ".".join([__name__, type(self).__qualname__])
+            ),
+            self.account_jid,
+            self.conversation_jid,
+        )
+        run_coroutine(restored.ready_event.wait())
+
+        # the join of user0 cancels out its part from before the snapshot
+        self.assertEqual(
+            self._run_js(
+                "restore_snapshot(" + json.dumps(snapshot) + ");"
+                "presence({events: " + json.dumps([make_event(0, True)]) +
+                "});"
+                "messages_parent.lastChild.textContent",
+                page=restored,
+            ),
+            "12 joined, 3 left",
         )
 
     @halt_for_debugging
@@ -1099,3 +1865,983 @@ class TestMessageViewPage(XMLTestCase):
             run_coroutine(self._obtain_html(), timeout=20),
             ignore_surplus_attr=True,
         )
+
+
+class Testhtmlify_body(unittest.TestCase):
+    def setUp(self):
+        self.database = unittest.mock.Mock()
+        self.database.emoji_or_space_multi_re = re.compile(
+            r"(\U0001f408)(\U0001f408|\s)*"
+        )
+        self.patch = unittest.mock.patch(
+            "jabbercat.emoji.DATABASE",
+            new=self.database,
+        )
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def test_escapes_text_and_joins_lines(self):
+        self.assertEqual(
+            conversation.htmlify_body("a<b\nc&d", "Romeo"),
+            ("a&lt;b<br/>c&amp;d", ([],)),
+        )
+
+    def test_me_at_line_start(self):
+        self.assertEqual(
+            conversation.htmlify_body("foo\n/me waves", "<Romeo>"),
+            (
+                "foo<br/><span class='action'>* &lt;Romeo&gt;</span>  waves",
+                ([],),
+            ),
+        )
+
+    def test_urls_across_lines(self):
+        html, (urls,) = conversation.htmlify_body(
+            "see (https://a.example/x)\n'xmpp:romeo@montague.lit' ok",
+            "Romeo",
+        )
+        self.assertEqual(
+            html,
+            "see <a href='https://a.example/x'>(https://a.example/x)</a><br/>"
+            "&#x27;<a href='xmpp:romeo@montague.lit'>"
+            "xmpp:romeo@montague.lit</a>&#x27; ok",
+        )
+        self.assertSequenceEqual(
+            urls,
+            ["https://a.example/x", "xmpp:romeo@montague.lit"],
+        )
+
+    def test_hugifies_emoji_only_last_line(self):
+        self.assertEqual(
+            conversation.htmlify_body("hi\n\U0001f408 \U0001f408", "Romeo"),
+            (
+                "hi<br/><span class='emoji-hugify'>\U0001f408 \U0001f408"
+                "</span>",
+                ([],),
+            ),
+        )
+
+    def test_does_not_hugify_mixed_last_line(self):
+        self.assertEqual(
+            conversation.htmlify_body("\U0001f408 x", "Romeo"),
+            ("\U0001f408 x", ([],)),
+        )
+
+
+class Testcoalesce_presence_events(unittest.TestCase):
+    def _event(self, from_jid, is_join):
+        return {"from_jid": from_jid, "is_join": is_join}
+
+    def test_keeps_events_in_order(self):
+        events = [
+            self._event("romeo@montague.lit", True),
+            self._event("juliet@capulet.lit", False),
+            self._event("mercutio@montague.lit", True),
+        ]
+        self.assertSequenceEqual(
+            conversation.coalesce_presence_events(events),
+            events,
+        )
+
+    def test_join_cancels_preceding_part(self):
+        events = [
+            self._event("romeo@montague.lit", False),
+            self._event("juliet@capulet.lit", True),
+            self._event("romeo@montague.lit", True),
+        ]
+        self.assertSequenceEqual(
+            conversation.coalesce_presence_events(events),
+            [events[1]],
+        )
+
+    def test_part_does_not_cancel_preceding_join(self):
+        events = [
+            self._event("romeo@montague.lit", True),
+            self._event("romeo@montague.lit", False),
+        ]
+        self.assertSequenceEqual(
+            conversation.coalesce_presence_events(events),
+            events,
+        )
+
+    def test_cancels_repeated_reconnects(self):
+        events = [
+            self._event("romeo@montague.lit", False),
+            self._event("romeo@montague.lit", False),
+            self._event("romeo@montague.lit", True),
+            self._event("romeo@montague.lit", True),
+        ]
+        self.assertSequenceEqual(
+            conversation.coalesce_presence_events(events),
+            [],
+        )
+
+
+def make_member(nick):
+    member = unittest.mock.Mock(["nick", "conversation_jid"])
+    member.nick = nick
+    return member
+
+
+class TestMemberList(unittest.TestCase):
+    def setUp(self):
+        self.conv = unittest.mock.Mock([
+            "members",
+            "me",
+        ])
+        self.conv.on_enter = aioxmpp.callbacks.AdHocSignal()
+        self.conv.on_join = aioxmpp.callbacks.AdHocSignal()
+        self.conv.on_leave = aioxmpp.callbacks.AdHocSignal()
+        self.conv.on_nick_changed = aioxmpp.callbacks.AdHocSignal()
+        self.members = [
+            make_member(nick)
+            for nick in ["romeo", "Juliet", "mercutio", "Benvolio"]
+        ]
+        self.conv.members = list(self.members)
+        self.conv.me = self.members[0]
+
+        self.list_ = conversation.MemberList()
+        self.listener = unittest.mock.Mock()
+        for name in ["begin_insert_rows", "end_insert_rows",
+                     "begin_remove_rows", "end_remove_rows",
+                     "begin_move_rows", "end_move_rows"]:
+            # listeners returning a true value are disconnected
+            getattr(self.listener, name).return_value = None
+            getattr(self.list_, name).connect(getattr(self.listener, name))
+
+    def _nicks(self):
+        return [member.nick for member in self.list_]
+
+    def test_sorts_members_case_insensitively(self):
+        self.list_.conversation = self.conv
+        self.assertSequenceEqual(
+            self._nicks(),
+            ["Benvolio", "Juliet", "mercutio", "romeo"],
+        )
+
+    def test_populates_with_single_insertion(self):
+        self.list_.conversation = self.conv
+        self.listener.begin_insert_rows.assert_called_once_with(None, 0, 3)
+
+    def test_populates_on_enter(self):
+        self.conv.me = None
+        self.conv.members = []
+        self.list_.conversation = self.conv
+        self.assertSequenceEqual(self._nicks(), [])
+
+        self.conv.members = list(self.members)
+        self.conv.on_enter()
+        self.assertSequenceEqual(
+            self._nicks(),
+            ["Benvolio", "Juliet", "mercutio", "romeo"],
+        )
+
+        self.conv.on_join(make_member("Tybalt"))
+        self.assertSequenceEqual(
+            self._nicks(),
+            ["Benvolio", "Juliet", "mercutio", "romeo", "Tybalt"],
+        )
+
+    def test_join_inserts_in_order(self):
+        self.list_.conversation = self.conv
+        self.listener.reset_mock()
+
+        self.conv.on_join(make_member("lady capulet"))
+
+        self.assertSequenceEqual(
+            self._nicks(),
+            ["Benvolio", "Juliet", "lady capulet", "mercutio", "romeo"],
+        )
+        self.listener.begin_insert_rows.assert_called_once_with(None, 2, 2)
+
+    def test_leave_removes_member(self):
+        self.list_.conversation = self.conv
+        self.listener.reset_mock()
+
+        self.conv.on_leave(self.members[2])
+
+        self.assertSequenceEqual(self._nicks(), ["Benvolio", "Juliet", "romeo"])
+        self.listener.begin_remove_rows.assert_called_once_with(None, 2, 2)
+
+    def test_leave_removes_the_right_member_among_equal_nicks(self):
+        self.list_.conversation = self.conv
+        other = make_member("mercutio")
+        self.conv.on_join(other)
+
+        self.conv.on_leave(self.members[2])
+
+        self.assertIn(other, list(self.list_))
+        self.assertNotIn(self.members[2], list(self.list_))
+
+    def test_leave_of_unknown_member_is_ignored(self):
+        self.list_.conversation = self.conv
+        self.listener.reset_mock()
+
+        self.conv.on_leave(make_member("Tybalt"))
+
+        self.assertEqual(len(self.list_), 4)
+        self.listener.begin_remove_rows.assert_not_called()
+
+    def test_nick_change_moves_member(self):
+        self.list_.conversation = self.conv
+        self.listener.reset_mock()
+
+        member = self.members[0]
+        member.nick = "Abram"
+        self.conv.on_nick_changed(member, "romeo", "Abram")
+
+        self.assertSequenceEqual(
+            self._nicks(),
+            ["Abram", "Benvolio", "Juliet", "mercutio"],
+        )
+        self.listener.begin_move_rows.assert_called_once_with(
+            None, 3, 3, None, 0,
+        )
+        self.listener.begin_insert_rows.assert_not_called()
+        self.listener.begin_remove_rows.assert_not_called()
+
+    def test_nick_change_moves_member_down(self):
+        self.list_.conversation = self.conv
+        self.listener.reset_mock()
+
+        member = self.members[3]
+        member.nick = "Nurse"
+        self.conv.on_nick_changed(member, "Benvolio", "Nurse")
+
+        self.assertSequenceEqual(
+            self._nicks(),
+            ["Juliet", "mercutio", "Nurse", "romeo"],
+        )
+        self.assertSequenceEqual(
+            list(self.list_.labels()),
+            self._nicks(),
+        )
+        # the destination is counted before the removal, as in Qt
+        self.listener.begin_move_rows.assert_called_once_with(
+            None, 0, 0, None, 3,
+        )
+
+    def test_nick_change_without_reordering_does_not_move(self):
+        self.list_.conversation = self.conv
+        self.listener.reset_mock()
+
+        member = self.members[0]
+        member.nick = "Romeo"
+        self.conv.on_nick_changed(member, "romeo", "Romeo")
+
+        self.assertSequenceEqual(
+            self._nicks(),
+            ["Benvolio", "Juliet", "mercutio", "Romeo"],
+        )
+        self.listener.begin_move_rows.assert_not_called()
+
+    def test_emits_member_signals(self):
+        listener = unittest.mock.Mock()
+        for name in ["added", "removed", "renamed", "reset"]:
+            getattr(listener, name).return_value = None
+        self.list_.on_member_added.connect(listener.added)
+        self.list_.on_member_removed.connect(listener.removed)
+        self.list_.on_member_renamed.connect(listener.renamed)
+        self.list_.on_reset.connect(listener.reset)
+
+        self.list_.conversation = self.conv
+        listener.reset.assert_called_once_with()
+        self.assertSequenceEqual(
+            list(self.list_.labels()),
+            ["Benvolio", "Juliet", "mercutio", "romeo"],
+        )
+        self.assertSequenceEqual(
+            list(self.list_.labelled_members()),
+            list(zip(self.list_, ["Benvolio", "Juliet", "mercutio", "romeo"])),
+        )
+
+        tybalt = make_member("Tybalt")
+        self.conv.on_join(tybalt)
+        listener.added.assert_called_once_with(tybalt, "Tybalt")
+
+        romeo = self.members[0]
+        romeo.nick = "Abram"
+        self.conv.on_nick_changed(romeo, "romeo", "Abram")
+        listener.renamed.assert_called_once_with(romeo, "romeo", "Abram")
+
+        self.conv.on_leave(tybalt)
+        listener.removed.assert_called_once_with(tybalt, "Tybalt")
+
+    def test_disconnects_and_clears_on_conversation_change(self):
+        self.list_.conversation = self.conv
+        self.list_.conversation = None
+
+        self.assertEqual(len(self.list_), 0)
+        self.conv.on_join(make_member("Tybalt"))
+        self.assertEqual(len(self.list_), 0)
+
+
+class TestMemberModel(unittest.TestCase):
+    def setUp(self):
+        self.account = unittest.mock.sentinel.account
+        self.members = [
+            unittest.mock.Mock(["direct_jid", "conversation_jid"])
+            for i in range(2)
+        ]
+        for i, member in enumerate(self.members):
+            member.direct_jid = None
+            member.conversation_jid = aioxmpp.JID.fromstr(
+                "coven@chat.shakespeare.lit/member{}".format(i)
+            )
+        self.conv = unittest.mock.Mock(["members", "me"])
+        self.conv.members = list(self.members)
+        for name in ["on_enter", "on_join", "on_leave", "on_nick_changed"]:
+            setattr(self.conv, name, aioxmpp.callbacks.AdHocSignal())
+        self.list_ = conversation.MemberList()
+        self.list_.conversation = self.conv
+
+        self.name_changed = aioxmpp.callbacks.AdHocSignal()
+        self.metadata = unittest.mock.Mock(
+            spec=jclib.metadata.MetadataFrontend
+        )
+        self.metadata.changed_signal.return_value = self.name_changed
+        self.avatars = unittest.mock.Mock(spec=jabbercat.avatar.AvatarManager)
+
+        self.model = conversation.MemberModel(
+            self.list_,
+            self.account,
+            self.metadata,
+            self.avatars,
+        )
+
+    def _tooltips(self):
+        for row in range(self.model.rowCount(Qt.QModelIndex())):
+            self.model.data(self.model.index(row, 0), Qt.Qt.ToolTipRole)
+
+    def test_name_change_rerenders_only_tooltip_of_peer(self):
+        with unittest.mock.patch.object(self.model,
+                                        "_render_tooltip") as render:
+            render.return_value = "tooltip"
+            self._tooltips()
+            render.reset_mock()
+
+            self.name_changed(jclib.roster.RosterMetadata.NAME,
+                              self.account,
+                              self.members[0].conversation_jid,
+                              "New Name")
+            self._tooltips()
+
+        render.assert_called_once_with(self.members[0])
+
+    def test_name_change_of_other_account_is_ignored(self):
+        with unittest.mock.patch.object(self.model,
+                                        "_render_tooltip") as render:
+            render.return_value = "tooltip"
+            self._tooltips()
+            render.reset_mock()
+
+            self.name_changed(jclib.roster.RosterMetadata.NAME,
+                              unittest.mock.sentinel.other_account,
+                              self.members[0].conversation_jid,
+                              "New Name")
+            self._tooltips()
+
+        render.assert_not_called()
+
+    def test_avatar_change_rerenders_only_tooltip_of_peer(self):
+        with unittest.mock.patch.object(self.model,
+                                        "_render_tooltip") as render:
+            render.return_value = "tooltip"
+            self._tooltips()
+            render.reset_mock()
+
+            self.model._on_avatar_changed(self.account,
+                                          self.members[0].conversation_jid)
+            self._tooltips()
+
+        render.assert_called_once_with(self.members[0])
+
+    def test_avatar_change_of_other_account_is_ignored(self):
+        with unittest.mock.patch.object(self.model,
+                                        "_render_tooltip") as render:
+            render.return_value = "tooltip"
+            self._tooltips()
+            render.reset_mock()
+
+            self.model._on_avatar_changed(unittest.mock.sentinel.other_account,
+                                          self.members[0].conversation_jid)
+            self._tooltips()
+
+        render.assert_not_called()
+
+
+class TestMessageViewPagePool(unittest.TestCase):
+    def setUp(self):
+        self.profile = unittest.mock.sentinel.profile
+        self.pool = conversation.MessageViewPagePool(
+            self.profile,
+            max_live=2,
+            max_idle=1,
+        )
+        self.patch = unittest.mock.patch(
+            "jabbercat.conversation.MessageViewPage",
+        )
+        self.MessageViewPage = self.patch.start()
+        self.MessageViewPage.side_effect = \
+            lambda *args, **kwargs: unittest.mock.Mock()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def _make_view(self, visible=False):
+        view = unittest.mock.Mock()
+        view.isVisible.return_value = visible
+        return view
+
+    def test_acquire_creates_page(self):
+        view = self._make_view()
+        page = self.pool.acquire(
+            view,
+            unittest.mock.sentinel.account_jid,
+            unittest.mock.sentinel.conversation_jid,
+        )
+
+        self.MessageViewPage.assert_called_once_with(
+            self.profile,
+            unittest.mock.ANY,
+            unittest.mock.sentinel.account_jid,
+            unittest.mock.sentinel.conversation_jid,
+        )
+        self.assertIsNotNone(page)
+        view.hibernate.assert_not_called()
+
+    def test_acquire_hibernates_least_recently_used_hidden_views(self):
+        view1 = self._make_view(visible=True)
+        view2 = self._make_view()
+        view3 = self._make_view()
+        view4 = self._make_view()
+
+        self.pool.acquire(view1, "a", "b")
+        self.pool.acquire(view2, "a", "c")
+        self.pool.acquire(view3, "a", "d")
+
+        view1.hibernate.assert_not_called()
+        view2.hibernate.assert_called_once_with()
+        view3.hibernate.assert_not_called()
+
+        # view2 is still hibernating and must not be counted twice
+        self.pool.acquire(view4, "a", "e")
+        view2.hibernate.assert_called_once_with()
+        view3.hibernate.assert_called_once_with()
+        view4.hibernate.assert_not_called()
+
+    def test_touch_protects_view_from_hibernation(self):
+        view1 = self._make_view()
+        view2 = self._make_view()
+        view3 = self._make_view()
+
+        self.pool.acquire(view1, "a", "b")
+        self.pool.acquire(view2, "a", "c")
+        self.pool.touch(view1)
+        self.pool.acquire(view3, "a", "d")
+
+        view1.hibernate.assert_not_called()
+        view2.hibernate.assert_called_once_with()
+
+    def test_release_recycles_page_for_reuse(self):
+        view1 = self._make_view()
+        view2 = self._make_view()
+
+        page = self.pool.acquire(view1, "a", "b")
+        self.pool.release(view1)
+        page.recycle.assert_called_once_with()
+
+        self.MessageViewPage.reset_mock()
+        reused = self.pool.acquire(view2, "a", "c")
+        self.assertIs(reused, page)
+        self.MessageViewPage.assert_not_called()
+        page.assign.assert_called_once_with("a", "c")
+
+    def test_release_deletes_page_beyond_max_idle(self):
+        view1 = self._make_view()
+        view2 = self._make_view()
+
+        page1 = self.pool.acquire(view1, "a", "b")
+        page2 = self.pool.acquire(view2, "a", "c")
+        self.pool.release(view1)
+        self.pool.release(view2)
+
+        page1.recycle.assert_called_once_with()
+        page1.deleteLater.assert_not_called()
+        page2.recycle.assert_not_called()
+        page2.deleteLater.assert_called_once_with()
+
+    def test_release_of_unknown_view_is_noop(self):
+        self.pool.release(self._make_view())
+
+
+class TestHistoryWindow(unittest.TestCase):
+    def setUp(self):
+        self.archive = [
+            (datetime(2018, 3, 8, 11, 0, 0) + timedelta(seconds=i),
+             "uid-{}".format(i))
+            for i in range(1000)
+        ]
+        self.node = unittest.mock.Mock(["get_last_messages"])
+        self.node.get_last_messages.side_effect = self._get_last_messages
+        self.window = conversation.HistoryWindow(self.node)
+
+    def _get_last_messages(self, max_count, max_age=None):
+        history = [
+            argv for argv in self.archive
+            if max_age is None or argv[0] >= max_age
+        ]
+        return list(reversed(history[-max_count:]))
+
+    def _anchor(self, argv):
+        return argv[0], str(argv[1])
+
+    def test_page_before_returns_messages_older_than_anchor(self):
+        page, exhausted = self.window.page_before(
+            *self._anchor(self.archive[500]), 10
+        )
+        self.assertSequenceEqual(page, self.archive[490:500])
+        self.assertFalse(exhausted)
+
+    def test_page_before_reports_start_of_archive(self):
+        page, exhausted = self.window.page_before(
+            *self._anchor(self.archive[5]), 10
+        )
+        self.assertSequenceEqual(page, self.archive[:5])
+        self.assertTrue(exhausted)
+
+    def test_page_before_without_timestamp_searches_uid(self):
+        page, _ = self.window.page_before(None, "uid-990", 10)
+        self.assertSequenceEqual(page, self.archive[980:990])
+
+    def test_page_before_unknown_anchor_uses_timestamp(self):
+        page, _ = self.window.page_before(
+            self.archive[990][0], "uid-unknown", 10
+        )
+        self.assertSequenceEqual(page, self.archive[980:990])
+
+    def test_paging_to_the_start_reads_archive_a_bounded_number_of_times(self):
+        anchor = self.archive[-1]
+        pages = []
+        while True:
+            page, exhausted = self.window.page_before(
+                *self._anchor(anchor), 10
+            )
+            pages[:0] = page
+            if exhausted:
+                break
+            anchor = page[0]
+
+        self.assertSequenceEqual(pages, self.archive[:-1])
+        # the window grows geometrically instead of being read for each page
+        self.assertLess(len(self.node.get_last_messages.mock_calls), 10)
+        self.assertLess(
+            sum(call[2]["max_count"]
+                for call in self.node.get_last_messages.mock_calls),
+            4 * len(self.archive),
+        )
+
+    def test_page_after_returns_messages_newer_than_anchor(self):
+        self.window.page_before(*self._anchor(self.archive[500]), 10)
+
+        page, exhausted = self.window.page_after(
+            *self._anchor(self.archive[489]), 10
+        )
+        self.assertSequenceEqual(page, self.archive[490:500])
+        self.assertFalse(exhausted)
+
+    def test_page_after_includes_messages_which_arrived_since(self):
+        page, _ = self.window.page_before(
+            *self._anchor(self.archive[-1]), 10
+        )
+        self.archive.extend(
+            (self.archive[-1][0] + timedelta(seconds=i),
+             "new-uid-{}".format(i))
+            for i in range(3)
+        )
+
+        page, exhausted = self.window.page_after(
+            *self._anchor(self.archive[995]), 10
+        )
+        self.assertSequenceEqual(page, self.archive[996:])
+        self.assertTrue(exhausted)
+
+    def test_page_after_with_anchor_before_window(self):
+        page, exhausted = self.window.page_after(
+            *self._anchor(self.archive[100]), 10
+        )
+        self.assertSequenceEqual(page, self.archive[101:111])
+        self.assertFalse(exhausted)
+
+
+class TestConversationView(unittest.TestCase):
+    def setUp(self):
+        self.profile = Qt.QWebEngineProfile()
+        self.pool = conversation.MessageViewPagePool(self.profile)
+
+        self.node = unittest.mock.Mock(
+            spec=jclib.conversation.P2PConversationNode
+        )
+        self.node.label = "Romeo"
+        self.node.conversation = None
+        self.node.account.jid = aioxmpp.JID.fromstr("juliet@capulet.lit")
+        self.node.conversation_address = \
+            aioxmpp.JID.fromstr("romeo@montague.lit")
+        self.node.get_last_messages.return_value = []
+        self.avatars = unittest.mock.Mock(spec=jabbercat.avatar.AvatarManager)
+        self.metadata = unittest.mock.Mock(
+            spec=jclib.metadata.MetadataFrontend
+        )
+        self.metadata.get.return_value = None
+
+        self.view = conversation.ConversationView(
+            self.node,
+            self.avatars,
+            self.metadata,
+            self.pool,
+        )
+
+    def tearDown(self):
+        self.view.discard_view()
+        del self.view
+        del self.pool
+        del self.profile
+
+    def _hibernate(self):
+        # bypass asyncify to wait for the snapshot
+        run_coroutine(
+            conversation.ConversationView.hibernate.__wrapped__(self.view),
+            timeout=20,
+        )
+
+    @halt_for_debugging
+    def test_hibernate_releases_page(self):
+        page = self.view.history
+        run_coroutine(page.ready_event.wait(), timeout=20)
+
+        self._hibernate()
+
+        self.assertIsNone(self.view.history)
+
+    @halt_for_debugging
+    def test_hibernate_again_after_restore_on_pooled_page(self):
+        page = self.view.history
+        run_coroutine(page.ready_event.wait(), timeout=20)
+        self._hibernate()
+
+        self.view.restore()
+        self.assertIs(self.view.history, page)
+        run_coroutine(page.ready_event.wait(), timeout=20)
+
+        self._hibernate()
+        self.assertIsNone(self.view.history)
+
+    @halt_for_debugging
+    def test_teardown_disconnects_and_drops_queued_events(self):
+        page = self.view.history
+        run_coroutine(page.ready_event.wait(), timeout=20)
+        with unittest.mock.patch.object(self.view, "_member_to_event",
+                                        return_value={}):
+            self.view._queue_presence(unittest.mock.sentinel.member, True)
+
+        with unittest.mock.patch.object(
+                self.view, "_flush_pending_presence") as flush:
+            self.view.teardown()
+            run_coroutine(asyncio.sleep(
+                self.view.PRESENCE_BATCH_INTERVAL + 0.1
+            ))
+
+        flush.assert_not_called()
+        for signal in [self.node.on_ready, self.node.on_stale,
+                       self.node.on_message, self.node.on_marker,
+                       self.avatars.on_avatar_changed]:
+            signal.disconnect.assert_called_once_with(signal.connect())
+        self.assertIsNone(self.view.history)
+        self.assertFalse(self.view._page_ready)
+
+    def _make_argv(self, uid):
+        message = aioxmpp.Message(aioxmpp.MessageType.CHAT)
+        message.body[None] = "foo"
+        return (
+            datetime(2018, 3, 8, 11, 16, 10),
+            uid,
+            False,
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+            "Romeo",
+            None,
+            message,
+        )
+
+    @halt_for_debugging
+    def test_replays_buffered_messages_not_in_backlog(self):
+        self.view.discard_view()
+        del self.view
+        self.node.get_last_messages.return_value = [self._make_argv("uid-1")]
+        self.view = conversation.ConversationView(
+            self.node,
+            self.avatars,
+            self.metadata,
+            self.pool,
+        )
+
+        with unittest.mock.patch.object(self.view,
+                                        "_queue_live_message") as queue:
+            self.view.replay_live_events([
+                ("message", (self._make_argv("uid-1"), {"tracker": None})),
+                ("message", (self._make_argv("uid-2"), {"tracker": None})),
+            ])
+            queue.assert_not_called()
+
+            run_coroutine(self.view.history.ready_event.wait(), timeout=20)
+
+        # uid-1 is sent once, as part of the backlog
+        self.assertSequenceEqual(
+            [call[1][1] for call in queue.mock_calls],
+            ["uid-1", "uid-2"],
+        )
+
+
+class TestLazyConversationView(unittest.TestCase):
+    def setUp(self):
+        self.node = unittest.mock.Mock()
+        self.avatars = unittest.mock.sentinel.avatars
+        self.metadata = unittest.mock.sentinel.metadata
+        self.page_pool = unittest.mock.sentinel.page_pool
+
+        self.views = []
+
+        def make_view(*args, **kwargs):
+            view = Qt.QWidget()
+            view.replay_live_events = unittest.mock.Mock()
+            view.set_focus_to_message_input = unittest.mock.Mock()
+            view.discard_view = unittest.mock.Mock()
+            view.teardown = unittest.mock.Mock()
+            self.views.append(view)
+            return view
+
+        self.patch = unittest.mock.patch(
+            "jabbercat.conversation.ConversationView",
+        )
+        self.ConversationView = self.patch.start()
+        self.ConversationView.side_effect = make_view
+
+        self.lazy = conversation.LazyConversationView(
+            self.node,
+            self.avatars,
+            self.metadata,
+            self.page_pool,
+        )
+
+    def tearDown(self):
+        self.patch.stop()
+        del self.lazy
+
+    def test_init_does_not_build_view(self):
+        self.ConversationView.assert_not_called()
+        self.assertIsNone(self.lazy.view)
+        self.node.on_message.connect.assert_called_once_with(
+            self.lazy._buffer_message,
+        )
+        self.node.on_marker.connect.assert_called_once_with(
+            self.lazy._buffer_marker,
+        )
+
+    def test_materialise_builds_view_once(self):
+        view = self.lazy.materialise()
+
+        self.ConversationView.assert_called_once_with(
+            self.node,
+            self.avatars,
+            self.metadata,
+            self.page_pool,
+            parent=self.lazy,
+        )
+        self.assertIs(view, self.views[0])
+        self.assertIs(self.lazy.view, view)
+
+        self.assertIs(self.lazy.materialise(), view)
+        self.ConversationView.assert_called_once_with(
+            unittest.mock.ANY,
+            unittest.mock.ANY,
+            unittest.mock.ANY,
+            unittest.mock.ANY,
+            parent=unittest.mock.ANY,
+        )
+
+    def test_materialise_disconnects_from_node(self):
+        self.lazy.materialise()
+
+        self.node.on_message.disconnect.assert_called_once_with(
+            self.node.on_message.connect(),
+        )
+        self.node.on_marker.disconnect.assert_called_once_with(
+            self.node.on_marker.connect(),
+        )
+
+    def test_buffers_and_replays_live_events_in_order(self):
+        with unittest.mock.patch.object(Qt.QApplication, "alert") as alert:
+            self.lazy._buffer_message(
+                unittest.mock.sentinel.ts1,
+                unittest.mock.sentinel.uid1,
+                False,
+                unittest.mock.sentinel.from_jid,
+                "Romeo",
+                None,
+                unittest.mock.sentinel.message,
+                tracker=None,
+            )
+            self.lazy._buffer_marker(
+                unittest.mock.sentinel.ts2,
+                False,
+                unittest.mock.sentinel.from_jid,
+                "Romeo",
+                None,
+                unittest.mock.sentinel.uid1,
+            )
+            self.lazy._buffer_message(
+                unittest.mock.sentinel.ts3,
+                unittest.mock.sentinel.uid3,
+                True,
+                unittest.mock.sentinel.own_jid,
+                "Juliet",
+                None,
+                unittest.mock.sentinel.message,
+            )
+
+        # only messages from others alert the user
+        self.assertEqual(len(alert.mock_calls), 1)
+
+        view = self.lazy.materialise()
+        view.replay_live_events.assert_called_once_with([
+            ("message", ((unittest.mock.sentinel.ts1,
+                          unittest.mock.sentinel.uid1,
+                          False,
+                          unittest.mock.sentinel.from_jid,
+                          "Romeo",
+                          None,
+                          unittest.mock.sentinel.message),
+                         {"tracker": None})),
+            ("marker", (unittest.mock.sentinel.ts2,
+                        False,
+                        unittest.mock.sentinel.from_jid,
+                        "Romeo",
+                        None,
+                        unittest.mock.sentinel.uid1)),
+            ("message", ((unittest.mock.sentinel.ts3,
+                          unittest.mock.sentinel.uid3,
+                          True,
+                          unittest.mock.sentinel.own_jid,
+                          "Juliet",
+                          None,
+                          unittest.mock.sentinel.message),
+                         {})),
+        ])
+
+    def test_logs_when_buffer_overflows(self):
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(
+                unittest.mock.patch.object(Qt.QApplication, "alert")
+            )
+            warning = stack.enter_context(
+                unittest.mock.patch.object(self.lazy.logger, "warning")
+            )
+
+            for i in range(self.lazy.MAX_BUFFERED_EVENTS):
+                self.lazy._buffer_marker(i)
+            warning.assert_not_called()
+
+            self.lazy._buffer_marker(unittest.mock.sentinel.last)
+            warning.assert_called_once_with(
+                unittest.mock.ANY,
+                self.lazy.MAX_BUFFERED_EVENTS,
+                self.node.conversation_address,
+            )
+
+        view = self.lazy.materialise()
+        events, = view.replay_live_events.mock_calls[0][1]
+        self.assertEqual(len(events), self.lazy.MAX_BUFFERED_EVENTS)
+        self.assertEqual(events[-1], ("marker", (unittest.mock.sentinel.last,)))
+
+    def test_set_focus_to_message_input_builds_view(self):
+        self.lazy.set_focus_to_message_input()
+        self.views[0].set_focus_to_message_input.assert_called_once_with()
+
+    def test_discard_view_without_view(self):
+        self.lazy.discard_view()
+        self.ConversationView.assert_not_called()
+        self.node.on_message.disconnect.assert_not_called()
+
+    def test_discard_view_forwards_to_view(self):
+        view = self.lazy.materialise()
+        self.lazy.discard_view()
+        view.discard_view.assert_called_once_with()
+        view.teardown.assert_not_called()
+
+    def test_teardown_without_view(self):
+        self.lazy._buffer_marker(unittest.mock.sentinel.ts)
+
+        self.lazy.teardown()
+
+        self.ConversationView.assert_not_called()
+        self.node.on_message.disconnect.assert_called_once_with(
+            self.node.on_message.connect(),
+        )
+        self.node.on_marker.disconnect.assert_called_once_with(
+            self.node.on_marker.connect(),
+        )
+
+        # buffered events are dropped
+        view = self.lazy.materialise()
+        view.replay_live_events.assert_called_once_with([])
+
+    def test_teardown_forwards_to_view(self):
+        view = self.lazy.materialise()
+        self.lazy.teardown()
+        view.teardown.assert_called_once_with()
+        view.discard_view.assert_not_called()
+
+
+class Testinstall_page_scripts(unittest.TestCase):
+    def setUp(self):
+        self.profile = Qt.QWebEngineProfile()
+
+    def tearDown(self):
+        del self.profile
+
+    def test_registers_script_at_document_creation(self):
+        conversation.install_page_scripts(self.profile)
+
+        script = self.profile.scripts().findScript(
+            conversation.PAGE_SCRIPT_NAME,
+        )
+        self.assertFalse(script.isNull())
+        self.assertEqual(script.injectionPoint(),
+                         Qt.QWebEngineScript.DocumentCreation)
+        self.assertEqual(script.worldId(),
+                         Qt.QWebEngineScript.ApplicationWorld)
+        self.assertFalse(script.runsOnSubFrames())
+        self.assertIn("QWebChannel", script.sourceCode())
+        self.assertIn("add_messages", script.sourceCode())
+
+    def test_is_idempotent(self):
+        conversation.install_page_scripts(self.profile)
+        conversation.install_page_scripts(self.profile)
+
+        self.assertEqual(
+            len(self.profile.scripts().findScripts(
+                conversation.PAGE_SCRIPT_NAME,
+            )),
+            1,
+        )
+
+    def test_reads_resources_once(self):
+        other_profile = Qt.QWebEngineProfile()
+        conversation.install_page_scripts(self.profile)
+        with unittest.mock.patch("jabbercat.Qt.QFile") as QFile:
+            conversation.install_page_scripts(other_profile)
+        QFile.assert_not_called()
+        self.assertFalse(other_profile.scripts().findScript(
+            conversation.PAGE_SCRIPT_NAME,
+        ).isNull())
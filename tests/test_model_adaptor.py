@@ -1,6 +1,8 @@
 import unittest
 import unittest.mock
 
+import jclib.instrumentable_list
+
 import jabbercat.model_adaptor as model_adaptor
 
 from jabbercat import Qt
@@ -217,3 +219,64 @@ class TestModelListAdaptor(unittest.TestCase):
 #     def tearDown(self):
 #         del self.model
 #         del self.base
+
+
+class TestModelListIndex(unittest.TestCase):
+    def setUp(self):
+        self.mlist = jclib.instrumentable_list.ModelList(["a1", "b1", "a2"])
+        self.index = model_adaptor.ModelListIndex(
+            self.mlist,
+            lambda item: item[0],
+        )
+
+    def test_lookup(self):
+        self.assertSequenceEqual(self.index.lookup("a"), [0, 2])
+        self.assertSequenceEqual(self.index.lookup("b"), [1])
+        self.assertSequenceEqual(self.index.lookup("c"), [])
+
+    def test_lookup_is_built_lazily(self):
+        self.mlist[1] = "c1"
+        self.assertSequenceEqual(self.index.lookup("c"), [1])
+
+    def test_follows_append(self):
+        self.index.lookup("a")
+        self.mlist.append("b2")
+        self.assertSequenceEqual(self.index.lookup("b"), [1, 3])
+
+    def test_follows_insert(self):
+        self.index.lookup("a")
+        self.mlist.insert(0, "b0")
+        self.assertSequenceEqual(self.index.lookup("a"), [1, 3])
+        self.assertSequenceEqual(self.index.lookup("b"), [0, 2])
+
+    def test_follows_removal_at_end(self):
+        self.index.lookup("a")
+        del self.mlist[2]
+        self.assertSequenceEqual(self.index.lookup("a"), [0])
+
+    def test_follows_removal(self):
+        self.index.lookup("a")
+        del self.mlist[0]
+        self.assertSequenceEqual(self.index.lookup("a"), [1])
+        self.assertSequenceEqual(self.index.lookup("b"), [0])
+
+    def test_follows_move(self):
+        self.index.lookup("a")
+        self.mlist.move(0, 2)
+        for key in "ab":
+            self.assertSequenceEqual(
+                self.index.lookup(key),
+                [i for i, item in enumerate(self.mlist) if item[0] == key],
+            )
+
+
+class Testcontiguous_ranges(unittest.TestCase):
+    def test_empty(self):
+        self.assertSequenceEqual(list(model_adaptor.contiguous_ranges([])),
+                                 [])
+
+    def test_groups_sorted_unique_rows(self):
+        self.assertSequenceEqual(
+            list(model_adaptor.contiguous_ranges([5, 1, 2, 2, 7, 6, 9])),
+            [(1, 2), (5, 7), (9, 9)],
+        )
@@ -1,3 +1,4 @@
+import asyncio
 import collections.abc
 import contextlib
 import unittest
@@ -20,6 +21,7 @@ import jabbercat.models as models
 
 from aioxmpp.testutils import (
     make_listener,
+    run_coroutine,
 )
 
 
@@ -515,6 +517,7 @@ class TestConversationsModel(unittest.TestCase):
             unittest.mock.sentinel.account1,
             TEST_JID2,
         )
+        run_coroutine(asyncio.sleep(0))
 
         cb.assert_called_once_with(
             self.m.index(2, 0),
@@ -537,6 +540,7 @@ class TestConversationsModel(unittest.TestCase):
             unittest.mock.sentinel.account2,
             TEST_JID2,
         )
+        run_coroutine(asyncio.sleep(0))
 
         cb.assert_not_called()
 
@@ -892,6 +896,142 @@ class TestFlattenModelToSeparators(unittest.TestCase):
         self._check_mapping_to_source_dynamic()
 
 
+class TestTooltipCache(unittest.TestCase):
+    def setUp(self):
+        self.c = models.TooltipCache()
+        self.render = unittest.mock.Mock()
+        self.render.return_value = "tooltip"
+
+    def _get(self, key=unittest.mock.sentinel.key):
+        return self.c.get(key,
+                          unittest.mock.sentinel.account,
+                          TEST_JID1,
+                          self.render)
+
+    def test_get_renders_once(self):
+        self.assertEqual(self._get(), "tooltip")
+        self.assertEqual(self._get(), "tooltip")
+        self.render.assert_called_once_with()
+
+    def test_get_renders_per_key(self):
+        self._get(unittest.mock.sentinel.key1)
+        self._get(unittest.mock.sentinel.key2)
+        self.assertEqual(len(self.render.mock_calls), 2)
+
+    def test_invalidate(self):
+        self._get()
+        self.c.invalidate(unittest.mock.sentinel.key,
+                          unittest.mock.sentinel.account,
+                          TEST_JID1)
+        self._get()
+        self.assertEqual(len(self.render.mock_calls), 2)
+
+    def test_invalidate_unknown_key(self):
+        self.c.invalidate(unittest.mock.sentinel.key,
+                          unittest.mock.sentinel.account,
+                          TEST_JID1)
+
+    def test_avatar_change_invalidates_tooltips_of_address(self):
+        self._get()
+        self.c.avatar_changed(unittest.mock.sentinel.account, TEST_JID2)
+        self._get()
+        self.render.assert_called_once_with()
+
+        self.c.avatar_changed(unittest.mock.sentinel.account, TEST_JID1)
+        self._get()
+        self.assertEqual(len(self.render.mock_calls), 2)
+
+    def test_peer_change_invalidates_tooltips_of_address(self):
+        self._get()
+        self.c.peer_changed(unittest.mock.sentinel.account, TEST_JID2)
+        self._get()
+        self.render.assert_called_once_with()
+
+        self.c.peer_changed(unittest.mock.sentinel.account, TEST_JID1)
+        self._get()
+        self.assertEqual(len(self.render.mock_calls), 2)
+
+    def test_peer_change_keeps_avatar_data_uri(self):
+        get_picture = unittest.mock.Mock()
+
+        with unittest.mock.patch(
+                "jabbercat.utils.qtpicture_to_data_uri") as to_data_uri:
+            to_data_uri.return_value = "data:"
+
+            self.c.avatar_data_uri(unittest.mock.sentinel.account,
+                                   TEST_JID1, None,
+                                   get_picture)
+            self.c.peer_changed(unittest.mock.sentinel.account, TEST_JID1)
+            self.c.avatar_data_uri(unittest.mock.sentinel.account,
+                                   TEST_JID1, None,
+                                   get_picture)
+
+        to_data_uri.assert_called_once_with(get_picture.return_value)
+
+    def test_clear(self):
+        self._get()
+        self.c.clear()
+        self._get()
+        self.assertEqual(len(self.render.mock_calls), 2)
+
+    def test_avatar_data_uri_renders_once_per_epoch(self):
+        get_picture = unittest.mock.Mock()
+
+        with unittest.mock.patch(
+                "jabbercat.utils.qtpicture_to_data_uri") as to_data_uri:
+            to_data_uri.return_value = "data:"
+
+            for i in range(2):
+                self.assertEqual(
+                    self.c.avatar_data_uri(unittest.mock.sentinel.account,
+                                           TEST_JID1, None,
+                                           get_picture),
+                    "data:",
+                )
+
+            get_picture.assert_called_once_with()
+            to_data_uri.assert_called_once_with(get_picture.return_value)
+
+            self.c.avatar_changed(unittest.mock.sentinel.account, TEST_JID1)
+            self.c.avatar_data_uri(unittest.mock.sentinel.account,
+                                   TEST_JID1, None,
+                                   get_picture)
+
+        self.assertEqual(len(to_data_uri.mock_calls), 2)
+
+    def test_changes_do_not_grow_the_cache(self):
+        get_picture = unittest.mock.Mock()
+
+        with unittest.mock.patch(
+                "jabbercat.utils.qtpicture_to_data_uri") as to_data_uri:
+            to_data_uri.return_value = "data:"
+            for i in range(10):
+                address = aioxmpp.JID.fromstr(
+                    "peer{}@montague.lit".format(i)
+                )
+                self.c.get(unittest.mock.sentinel.key,
+                           unittest.mock.sentinel.account,
+                           address,
+                           self.render)
+                self.c.avatar_data_uri(unittest.mock.sentinel.account,
+                                       address, None,
+                                       get_picture)
+                self.c.avatar_changed(unittest.mock.sentinel.account,
+                                      address)
+
+        self.assertEqual(len(self.c._tooltips), 0)
+        self.assertEqual(self.c._tooltips.groups(), [])
+        self.assertEqual(len(self.c._avatar_uris), 0)
+        self.assertEqual(self.c._avatar_uris.groups(), [])
+
+    def test_evicts_least_recently_used(self):
+        c = models.TooltipCache(maxsize=1)
+        c.get(unittest.mock.sentinel.key1, None, None, self.render)
+        c.get(unittest.mock.sentinel.key2, None, None, self.render)
+        c.get(unittest.mock.sentinel.key1, None, None, self.render)
+        self.assertEqual(len(self.render.mock_calls), 3)
+
+
 class TestRosterModel(unittest.TestCase):
     def setUp(self):
         self.roster = jclib.instrumentable_list.ModelList()
@@ -905,12 +1045,15 @@ class TestRosterModel(unittest.TestCase):
         self.listener = make_listener(self.m)
 
     def test_uses_model_list_adaptor(self):
-        items = unittest.mock.Mock([])
+        items = unittest.mock.Mock(["data_changed", "begin_remove_rows"])
 
         with contextlib.ExitStack() as stack:
             ModelListAdaptor = stack.enter_context(
                 unittest.mock.patch("jabbercat.model_adaptor.ModelListAdaptor")
             )
+            stack.enter_context(
+                unittest.mock.patch("jabbercat.model_adaptor.ModelListIndex")
+            )
 
             result = models.RosterModel(items, self.avatar, self.metadata)
 
@@ -1078,6 +1221,7 @@ class TestRosterModel(unittest.TestCase):
             unittest.mock.sentinel.account1,
             TEST_JID2,
         )
+        run_coroutine(asyncio.sleep(0))
 
         cb.assert_called_once_with(
             self.m.index(2, 0),
@@ -1100,9 +1244,117 @@ class TestRosterModel(unittest.TestCase):
             unittest.mock.sentinel.account2,
             TEST_JID2,
         )
+        run_coroutine(asyncio.sleep(0))
 
         cb.assert_not_called()
 
+    def test_coalesces_avatar_changes_within_one_tick(self):
+        self.roster[0].account = unittest.mock.sentinel.account1
+        self.roster[0].address = TEST_JID1
+        self.roster[1].account = unittest.mock.sentinel.account1
+        self.roster[1].address = TEST_JID2
+        self.roster[2].account = unittest.mock.sentinel.account1
+        self.roster[2].address = TEST_JID3
+
+        cb = unittest.mock.Mock()
+        self.m.dataChanged.connect(cb)
+
+        self.m._on_avatar_changed(unittest.mock.sentinel.account1, TEST_JID2)
+        self.m._on_avatar_changed(unittest.mock.sentinel.account1, TEST_JID1)
+        self.m._on_avatar_changed(unittest.mock.sentinel.account1, TEST_JID2)
+
+        cb.assert_not_called()
+
+        run_coroutine(asyncio.sleep(0))
+
+        cb.assert_called_once_with(
+            self.m.index(0, 0),
+            self.m.index(1, 0),
+            [Qt.Qt.DecorationRole],
+        )
+
+    def test_avatar_change_follows_list_changes(self):
+        for i, address in enumerate([TEST_JID1, TEST_JID2, TEST_JID3]):
+            self.roster[i].account = unittest.mock.sentinel.account1
+            self.roster[i].address = address
+
+        self.m._on_avatar_changed(unittest.mock.sentinel.account1, TEST_JID1)
+        run_coroutine(asyncio.sleep(0))
+
+        new_item = unittest.mock.Mock(spec=jclib.roster.AbstractRosterItem)
+        new_item.account = unittest.mock.sentinel.account1
+        new_item.address = TEST_JID1
+        del self.roster[0]
+        self.roster.append(new_item)
+
+        cb = unittest.mock.Mock()
+        self.m.dataChanged.connect(cb)
+
+        self.m._on_avatar_changed(unittest.mock.sentinel.account1, TEST_JID1)
+        run_coroutine(asyncio.sleep(0))
+
+        cb.assert_called_once_with(
+            self.m.index(2, 0),
+            self.m.index(2, 0),
+            [Qt.Qt.DecorationRole],
+        )
+    def test_tooltip_is_cached(self):
+        self.roster[0].account = unittest.mock.sentinel.account1
+        self.roster[0].address = TEST_JID1
+
+        with unittest.mock.patch.object(self.m, "_render_tooltip") as render:
+            render.return_value = "tooltip"
+            index = self.m.index(0, 0)
+            self.assertEqual(self.m.data(index, Qt.Qt.ToolTipRole),
+                             "tooltip")
+            self.assertEqual(self.m.data(index, Qt.Qt.ToolTipRole),
+                             "tooltip")
+
+        render.assert_called_once_with(self.roster[0])
+
+    def test_tooltip_is_rerendered_after_data_change(self):
+        for i, address in enumerate([TEST_JID1, TEST_JID2, TEST_JID3]):
+            self.roster[i].account = unittest.mock.sentinel.account1
+            self.roster[i].address = address
+
+        with unittest.mock.patch.object(self.m, "_render_tooltip") as render:
+            render.return_value = "tooltip"
+            self.m.data(self.m.index(1, 0), Qt.Qt.ToolTipRole)
+            self.roster.refresh_data(slice(1, 2))
+            self.m.data(self.m.index(1, 0), Qt.Qt.ToolTipRole)
+
+        self.assertEqual(len(render.mock_calls), 2)
+
+    def test_tooltip_is_rerendered_after_avatar_change(self):
+        self.roster[0].account = unittest.mock.sentinel.account1
+        self.roster[0].address = TEST_JID1
+
+        with unittest.mock.patch.object(self.m, "_render_tooltip") as render:
+            render.return_value = "tooltip"
+            self.m.data(self.m.index(0, 0), Qt.Qt.ToolTipRole)
+            self.m._on_avatar_changed(unittest.mock.sentinel.account1,
+                                      TEST_JID1)
+            self.m.data(self.m.index(0, 0), Qt.Qt.ToolTipRole)
+
+        self.assertEqual(len(render.mock_calls), 2)
+
+    def test_tooltip_is_rerendered_after_presence_change(self):
+        self.roster[0].account = unittest.mock.sentinel.account1
+        self.roster[0].address = TEST_JID1
+
+        with unittest.mock.patch.object(self.m, "_render_tooltip") as render:
+            render.return_value = "tooltip"
+            self.m.data(self.m.index(0, 0), Qt.Qt.ToolTipRole)
+            self.m._on_presence_changed(
+                unittest.mock.sentinel.key,
+                unittest.mock.sentinel.account1,
+                TEST_JID1.replace(resource="balcony"),
+                unittest.mock.sentinel.value,
+            )
+            self.m.data(self.m.index(0, 0), Qt.Qt.ToolTipRole)
+
+        self.assertEqual(len(render.mock_calls), 2)
+
 
 class TestRosterFilterModel(unittest.TestCase):
     def setUp(self):
@@ -1207,6 +1459,161 @@ class TestRosterFilterModel(unittest.TestCase):
         self.assertFalse(self.rfm.filterAcceptsRow(1, Qt.QModelIndex()))
         self.assertTrue(self.rfm.filterAcceptsRow(2, Qt.QModelIndex()))
 
+    def _set_addresses_and_labels(self):
+        self.roster[0].address = TEST_JID1
+        self.roster[0].label = "Romeo Montague"
+        self.roster[1].address = TEST_JID2
+        self.roster[1].label = "Juliet Capulet"
+        self.roster[2].address = TEST_JID3
+        self.roster[2].label = "Meaningful Label"
+
+    def test_filter_by_text_normalises_each_item_once(self):
+        self._set_addresses_and_labels()
+
+        with unittest.mock.patch.object(
+                models.RosterFilterModel,
+                "_normalize_for_find",
+                wraps=models.RosterFilterModel._normalize_for_find,
+        ) as normalize:
+            self.rfm.filter_by_text = "mont"
+            self.assertEqual(
+                [self.rfm.filterAcceptsRow(i, Qt.QModelIndex())
+                 for i in range(3)],
+                [True, False, False],
+            )
+            ncalls = len(normalize.mock_calls)
+
+            self.rfm.filter_by_text = "capu"
+            self.assertEqual(
+                [self.rfm.filterAcceptsRow(i, Qt.QModelIndex())
+                 for i in range(3)],
+                [False, True, False],
+            )
+
+        # one call for the filter text, none for the items
+        self.assertEqual(len(normalize.mock_calls), ncalls + 1)
+
+    def test_filter_by_text_follows_data_changes(self):
+        self._set_addresses_and_labels()
+        self.rfm.filter_by_text = "capulet"
+
+        self.roster[0].label = "Romeo Capulet"
+        self.roster.refresh_data(slice(0, 1))
+
+        self.assertTrue(self.rfm.filterAcceptsRow(0, Qt.QModelIndex()))
+        self.assertEqual(self.rfm.rowCount(Qt.QModelIndex()), 2)
+
+    def test_search_keys_of_removed_items_are_dropped(self):
+        self._set_addresses_and_labels()
+        self.rfm.filter_by_text = "e"
+        self.assertEqual(self.rfm.rowCount(Qt.QModelIndex()), 3)
+
+        item = self.roster[0]
+        self.assertIn(item, self.rfm._search_keys)
+        del self.roster[0]
+        self.assertNotIn(item, self.rfm._search_keys)
+
+    def _accepted_rows(self):
+        return [
+            i for i in range(len(self.roster))
+            if self.rfm.filterAcceptsRow(i, Qt.QModelIndex())
+        ]
+
+    def test_refined_filter_text_only_checks_matching_items(self):
+        self._set_addresses_and_labels()
+        self.rfm.filter_by_text = "m"
+        self.assertEqual(self._accepted_rows(), [0, 2])
+
+        with unittest.mock.patch.object(
+                self.rfm,
+                "_item_matches_text",
+                wraps=self.rfm._item_matches_text) as matches_text:
+            self.rfm.filter_by_text = "mo"
+            self.assertEqual(self._accepted_rows(), [0])
+
+        self.assertCountEqual(
+            [call[1][0] for call in matches_text.mock_calls],
+            [self.roster[0], self.roster[2]],
+        )
+
+    def test_going_back_to_previous_filter_text_uses_cache(self):
+        self._set_addresses_and_labels()
+        self.rfm.filter_by_text = "m"
+        self._accepted_rows()
+        self.rfm.filter_by_text = "mo"
+        self._accepted_rows()
+
+        with unittest.mock.patch.object(
+                self.rfm,
+                "_item_matches_text") as matches_text:
+            self.rfm.filter_by_text = "m"
+            self.assertEqual(self._accepted_rows(), [0, 2])
+
+        matches_text.assert_not_called()
+
+    def test_cached_matches_follow_inserted_items(self):
+        self._set_addresses_and_labels()
+        self.rfm.filter_by_text = "m"
+        self._accepted_rows()
+        self.rfm.filter_by_text = "mo"
+        self._accepted_rows()
+
+        new_item = unittest.mock.Mock(spec=jclib.roster.AbstractRosterItem)
+        new_item.address = aioxmpp.JID.fromstr("mercutio@verona.lit")
+        new_item.label = "Mercutio"
+        new_item.tags = []
+        self.roster.append(new_item)
+
+        self.assertEqual(self._accepted_rows(), [0])
+        self.rfm.filter_by_text = "m"
+        self.assertEqual(self._accepted_rows(), [0, 2, 3])
+
+    def test_cached_matches_follow_data_changes(self):
+        self._set_addresses_and_labels()
+        self.rfm.filter_by_text = "m"
+        self._accepted_rows()
+        self.rfm.filter_by_text = "mo"
+        self._accepted_rows()
+
+        self.roster[1].label = "Juliet Montague"
+        self.roster.refresh_data(slice(1, 2))
+
+        self.assertEqual(self._accepted_rows(), [0, 1])
+        self.rfm.filter_by_text = "m"
+        self.assertEqual(self._accepted_rows(), [0, 1, 2])
+
+    def test_filter_text_cache_is_bounded(self):
+        self._set_addresses_and_labels()
+        for i in range(models.RosterFilterModel.TEXT_MATCH_CACHE_SIZE + 1):
+            self.rfm.filter_by_text = str(i)
+            self._accepted_rows()
+
+        self.assertEqual(len(self.rfm._text_matches),
+                         models.RosterFilterModel.TEXT_MATCH_CACHE_SIZE)
+        self.assertNotIn("0", self.rfm._text_matches)
+
+    def test_invalidation_is_deferred_and_coalesced(self):
+        with unittest.mock.patch.object(self.rfm,
+                                        "invalidateFilter") as invalidate:
+            self.rfm.filter_by_text = "m"
+            self.rfm.filter_by_text = "mo"
+            self.rfm.filter_by_text = "mon"
+
+            invalidate.assert_not_called()
+
+            run_coroutine(asyncio.sleep(0))
+
+        invalidate.assert_called_once_with()
+
+    def test_filter_by_text_applies_after_event_loop_iteration(self):
+        self._set_addresses_and_labels()
+        self.assertEqual(self.rfm.rowCount(Qt.QModelIndex()), 3)
+
+        self.rfm.filter_by_text = "capulet"
+        run_coroutine(asyncio.sleep(0))
+
+        self.assertEqual(self.rfm.rowCount(Qt.QModelIndex()), 1)
+
 
 class TestTagsModel(unittest.TestCase):
     def setUp(self):
@@ -0,0 +1,391 @@
+import asyncio
+import contextlib
+import pathlib
+import sqlite3
+import tempfile
+import unittest
+import unittest.mock
+
+from datetime import datetime, timedelta
+
+import aioxmpp
+import aioxmpp.callbacks
+
+import jabbercat.search as search
+
+from aioxmpp.testutils import (
+    make_listener,
+    run_coroutine,
+)
+
+
+TEST_ACCOUNT = "romeo@montague.lit"
+TEST_CONV1 = "juliet@capulet.lit"
+TEST_CONV2 = "coven@chat.shakespeare.lit"
+
+TEST_TIMESTAMP = datetime(2018, 1, 1, 12, 0, 0)
+
+
+def make_message(body):
+    message = aioxmpp.Message(aioxmpp.MessageType.CHAT)
+    message.body[None] = body
+    return message
+
+
+class Testmake_fts_query(unittest.TestCase):
+    def test_quotes_words_and_makes_last_word_a_prefix(self):
+        self.assertEqual(
+            search.make_fts_query("hello world"),
+            '"hello" "world"*',
+        )
+
+    def test_strips_operators(self):
+        self.assertEqual(
+            search.make_fts_query('foo OR "bar" -baz*'),
+            '"foo" "OR" "bar" "baz"*',
+        )
+
+    def test_returns_None_without_words(self):
+        self.assertIsNone(search.make_fts_query(""))
+        self.assertIsNone(search.make_fts_query("  *\"- "))
+
+
+class Testsnippet_to_html(unittest.TestCase):
+    def test_escapes_and_marks_matches(self):
+        self.assertEqual(
+            search.snippet_to_html(
+                "a <b> " + search.MATCH_START + "match" + search.MATCH_END
+            ),
+            "a &lt;b&gt; <b>match</b>",
+        )
+
+
+class TestMessageSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = search.MessageSearchIndex()
+
+    def tearDown(self):
+        self.index.close()
+
+    def _add(self, uid, body, *,
+             conversation=TEST_CONV1,
+             account=TEST_ACCOUNT,
+             display_name="Romeo"):
+        self.index.add_message(
+            account,
+            conversation,
+            uid,
+            TEST_TIMESTAMP + timedelta(minutes=int(uid)),
+            display_name,
+            body,
+        )
+
+    def test_search_finds_messages(self):
+        self._add("1", "wherefore art thou")
+        self._add("2", "something else")
+
+        page = self.index.search("wherefore")
+
+        self.assertIsNone(page.next_cursor)
+        self.assertEqual(len(page.results), 1)
+        result, = page.results
+        self.assertEqual(result.account, TEST_ACCOUNT)
+        self.assertEqual(result.conversation, TEST_CONV1)
+        self.assertEqual(result.message_uid, "1")
+        self.assertEqual(result.timestamp,
+                         TEST_TIMESTAMP + timedelta(minutes=1))
+        self.assertEqual(result.display_name, "Romeo")
+        self.assertIn(
+            search.MATCH_START + "wherefore" + search.MATCH_END,
+            result.snippet,
+        )
+
+    def test_search_matches_prefix_of_last_word(self):
+        self._add("1", "wherefore art thou")
+
+        self.assertEqual(len(self.index.search("art tho").results), 1)
+        self.assertEqual(len(self.index.search("ar thou").results), 0)
+
+    def test_search_ignores_diacritics(self):
+        self._add("1", "café")
+
+        self.assertEqual(len(self.index.search("cafe").results), 1)
+
+    def test_adding_message_twice_has_no_effect(self):
+        self._add("1", "wherefore art thou")
+        self.index.flush()
+        self._add("1", "wherefore art thou")
+
+        self.assertEqual(len(self.index.search("wherefore").results), 1)
+
+    def test_ignores_empty_bodies(self):
+        listener = make_listener(self.index)
+        self._add("1", "")
+        listener.on_dirty.assert_not_called()
+
+    def test_on_dirty_emitted_once_per_flush(self):
+        listener = make_listener(self.index)
+
+        self._add("1", "foo")
+        self._add("2", "foo")
+        listener.on_dirty.assert_called_once_with()
+
+        self.index.flush()
+        self._add("3", "foo")
+        self.assertEqual(len(listener.on_dirty.mock_calls), 2)
+
+    def test_search_flushes(self):
+        self._add("1", "foo")
+        self.index.search("foo")
+
+        listener = make_listener(self.index)
+        self._add("2", "foo")
+        listener.on_dirty.assert_called_once_with()
+
+    def test_search_pages_newest_first(self):
+        for i in range(5):
+            self._add(str(i), "foo {}".format(i))
+
+        page = self.index.search("foo", limit=2)
+        self.assertEqual([r.message_uid for r in page.results], ["4", "3"])
+        self.assertIsNotNone(page.next_cursor)
+
+        page = self.index.search("foo", limit=2, cursor=page.next_cursor)
+        self.assertEqual([r.message_uid for r in page.results], ["2", "1"])
+        self.assertIsNotNone(page.next_cursor)
+
+        page = self.index.search("foo", limit=2, cursor=page.next_cursor)
+        self.assertEqual([r.message_uid for r in page.results], ["0"])
+        self.assertIsNone(page.next_cursor)
+
+    def test_search_filters_by_conversation_and_account(self):
+        self._add("1", "foo")
+        self._add("2", "foo", conversation=TEST_CONV2)
+        self._add("3", "foo", account="juliet@capulet.lit")
+
+        self.assertEqual(
+            [r.message_uid
+             for r in self.index.search("foo",
+                                        conversation=TEST_CONV2).results],
+            ["2"],
+        )
+        self.assertEqual(
+            [r.message_uid
+             for r in self.index.search("foo",
+                                        account=TEST_ACCOUNT).results],
+            ["2", "1"],
+        )
+
+    def test_search_without_words_returns_empty_page(self):
+        self._add("1", "foo")
+        page = self.index.search(" ")
+        self.assertSequenceEqual(page.results, [])
+        self.assertIsNone(page.next_cursor)
+
+    def test_persists_to_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "sub" / "index.sqlite"
+            index = search.MessageSearchIndex(path)
+            index.add_message(TEST_ACCOUNT, TEST_CONV1, "1", TEST_TIMESTAMP,
+                              "Romeo", "foo")
+            index.close()
+
+            index = search.MessageSearchIndex(path)
+            try:
+                self.assertEqual(len(index.search("foo").results), 1)
+            finally:
+                index.close()
+
+    def test_is_available(self):
+        self.assertTrue(self.index.available)
+
+    def test_disables_itself_without_fts5(self):
+        with unittest.mock.patch.object(
+                search.MessageSearchIndex,
+                "_init_schema",
+                side_effect=sqlite3.OperationalError("no such module: fts5")):
+            index = search.MessageSearchIndex()
+
+        try:
+            self.assertFalse(index.available)
+
+            listener = make_listener(index)
+            index.add_message(TEST_ACCOUNT, TEST_CONV1, "1", TEST_TIMESTAMP,
+                              "Romeo", "foo")
+            listener.on_dirty.assert_not_called()
+
+            page = index.search("foo")
+            self.assertSequenceEqual(page.results, [])
+            self.assertIsNone(page.next_cursor)
+        finally:
+            index.close()
+
+
+def make_node(conversation=TEST_CONV1, history=()):
+    node = unittest.mock.Mock(["account", "conversation_address",
+                               "get_last_messages"])
+    node.account.jid = aioxmpp.JID.fromstr(TEST_ACCOUNT)
+    node.conversation_address = aioxmpp.JID.fromstr(conversation)
+    node.on_message = aioxmpp.callbacks.AdHocSignal()
+    node.get_last_messages.return_value = list(history)
+    return node
+
+
+def make_history_entry(uid, body, display_name="Juliet"):
+    return (
+        TEST_TIMESTAMP,
+        uid,
+        False,
+        aioxmpp.JID.fromstr(TEST_CONV1),
+        display_name,
+        b"color",
+        make_message(body),
+        None,
+    )
+
+
+class Testindex_messages(unittest.TestCase):
+    def test_adds_messages(self):
+        index = unittest.mock.Mock(spec=search.MessageSearchIndex)
+        node = make_node()
+
+        search.index_messages(index, node, [
+            make_history_entry("uid-1", "foo"),
+            make_history_entry("uid-2", "bar")[:7],
+        ])
+
+        self.assertSequenceEqual(
+            index.add_message.mock_calls,
+            [
+                unittest.mock.call(TEST_ACCOUNT, TEST_CONV1, "uid-1",
+                                   TEST_TIMESTAMP, "Juliet", "foo"),
+                unittest.mock.call(TEST_ACCOUNT, TEST_CONV1, "uid-2",
+                                   TEST_TIMESTAMP, "Juliet", "bar"),
+            ]
+        )
+
+
+class TestHistoryIndexer(unittest.TestCase):
+    def setUp(self):
+        self.conversations = unittest.mock.MagicMock()
+        self.conversations.__iter__.return_value = iter([])
+        self.writeman = unittest.mock.Mock()
+        self.writeman.on_writeback = aioxmpp.callbacks.AdHocSignal()
+
+        self.indexer = search.HistoryIndexer(
+            self.conversations,
+            self.writeman,
+        )
+
+    def tearDown(self):
+        self.indexer.close()
+
+    def _search(self, text):
+        return [r.message_uid for r in self.indexer.index.search(text).results]
+
+    def test_connects_to_conversations(self):
+        self.conversations.on_conversation_added.connect.assert_called_once_with(  # NOQA
+            self.indexer._conversation_added,
+        )
+        self.conversations.on_conversation_removed.connect.assert_called_once_with(  # NOQA
+            self.indexer._conversation_removed,
+        )
+
+    def test_backfills_existing_conversations(self):
+        node = make_node(history=[make_history_entry("uid-1", "foo")])
+        self.conversations.__iter__.return_value = iter([node])
+
+        indexer = search.HistoryIndexer(self.conversations, self.writeman)
+        try:
+            node.get_last_messages.assert_not_called()
+
+            run_coroutine(asyncio.sleep(0))
+
+            node.get_last_messages.assert_called_once_with(
+                max_count=search.HistoryIndexer.BACKFILL_COUNT,
+            )
+            self.assertEqual(
+                [r.message_uid for r in indexer.index.search("foo").results],
+                ["uid-1"],
+            )
+        finally:
+            indexer.close()
+
+    def test_backfills_one_conversation_per_iteration(self):
+        node1 = make_node()
+        node2 = make_node()
+        self.indexer._conversation_added(node1)
+        self.indexer._conversation_added(node2)
+
+        run_coroutine(asyncio.sleep(0))
+        node1.get_last_messages.assert_called_once_with(
+            max_count=search.HistoryIndexer.BACKFILL_COUNT,
+        )
+        node2.get_last_messages.assert_not_called()
+
+        run_coroutine(asyncio.sleep(0))
+        node2.get_last_messages.assert_called_once_with(
+            max_count=search.HistoryIndexer.BACKFILL_COUNT,
+        )
+
+    def test_does_not_backfill_removed_conversation(self):
+        node = make_node()
+        self.indexer._conversation_added(node)
+        self.indexer._conversation_removed(node)
+
+        run_coroutine(asyncio.sleep(0.01))
+
+        node.get_last_messages.assert_not_called()
+
+    def test_indexes_live_messages_of_added_conversation(self):
+        node = make_node()
+        self.indexer._conversation_added(node)
+
+        node.on_message(*make_history_entry("uid-1", "foo"))
+
+        self.assertEqual(self._search("foo"), ["uid-1"])
+
+    def test_stops_indexing_removed_conversation(self):
+        node = make_node()
+        self.indexer._conversation_added(node)
+        self.indexer._conversation_removed(node)
+
+        node.on_message(*make_history_entry("uid-1", "foo"))
+
+        self.assertEqual(self._search("foo"), [])
+
+    def test_failing_backfill_does_not_prevent_live_indexing(self):
+        node = make_node()
+        node.get_last_messages.side_effect = RuntimeError()
+
+        self.indexer._conversation_added(node)
+        run_coroutine(asyncio.sleep(0))
+        node.on_message(*make_history_entry("uid-1", "foo"))
+
+        node.get_last_messages.assert_called_once_with(
+            max_count=search.HistoryIndexer.BACKFILL_COUNT,
+        )
+        self.assertEqual(self._search("foo"), ["uid-1"])
+
+    def test_requests_writeback_when_dirty(self):
+        node = make_node()
+        self.indexer._conversation_added(node)
+
+        node.on_message(*make_history_entry("uid-1", "foo"))
+        node.on_message(*make_history_entry("uid-2", "foo"))
+
+        self.writeman.request_writeback.assert_called_once_with()
+
+    def test_writeback_flushes_index(self):
+        node = make_node()
+        self.indexer._conversation_added(node)
+        node.on_message(*make_history_entry("uid-1", "foo"))
+
+        with contextlib.ExitStack() as stack:
+            flush = stack.enter_context(unittest.mock.patch.object(
+                self.indexer.index,
+                "flush",
+            ))
+            run_coroutine(self.indexer._writeback())
+
+        flush.assert_called_once_with()
@@ -4,6 +4,8 @@ import unittest.mock
 
 import aioxmpp.callbacks
 
+import jclib.utils
+
 import jabbercat.Qt as Qt
 import jabbercat.utils as utils
 
@@ -514,3 +516,83 @@ class TestDragNDropUtils(unittest.TestCase):
             utils.DRAG_MIME_TYPE,
             "application/vnd.org.jabbercat.drag-key"
         )
+
+
+class TestTextColourCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = utils.TextColourCache(maxsize=2)
+
+    def test_qtcolor_matches_uncached_derivation(self):
+        self.assertEqual(
+            self.cache.qtcolor("Romeo"),
+            utils.text_to_qtcolor(
+                jclib.utils.normalise_text_for_hash("Romeo")
+            ),
+        )
+
+    def test_qtcolor_derives_colour_once(self):
+        with contextlib.ExitStack() as stack:
+            text_to_qtcolor = stack.enter_context(unittest.mock.patch(
+                "jabbercat.utils.text_to_qtcolor",
+                return_value=Qt.QColor(1, 2, 3),
+            ))
+
+            self.cache.qtcolor("Romeo")
+            self.cache.qtcolor("Romeo")
+            self.cache.css_colors("Romeo")
+
+        text_to_qtcolor.assert_called_once_with(
+            jclib.utils.normalise_text_for_hash("Romeo")
+        )
+
+    def test_qtcolor_returns_independent_copies(self):
+        c1 = self.cache.qtcolor("Romeo")
+        c1.setRed((c1.red() + 1) % 256)
+        c2 = self.cache.qtcolor("Romeo")
+        self.assertNotEqual(c1, c2)
+
+    def test_css_colors(self):
+        with unittest.mock.patch(
+                "jabbercat.utils.text_to_qtcolor",
+                return_value=Qt.QColor(100, 200, 50)):
+            full, weak = self.cache.css_colors("Romeo")
+
+        self.assertEqual(full, "rgba(80, 160, 40, 1.0)")
+        self.assertEqual(
+            weak,
+            "linear-gradient(135deg, rgba(100, 200, 50, 0.1), "
+            "transparent 10em)",
+        )
+
+    def test_css_colors_are_cached(self):
+        self.assertIs(
+            self.cache.css_colors("Romeo"),
+            self.cache.css_colors("Romeo"),
+        )
+
+    def test_bounded(self):
+        with contextlib.ExitStack() as stack:
+            text_to_qtcolor = stack.enter_context(unittest.mock.patch(
+                "jabbercat.utils.text_to_qtcolor",
+                return_value=Qt.QColor(1, 2, 3),
+            ))
+
+            self.cache.qtcolor("a")
+            self.cache.qtcolor("b")
+            self.cache.qtcolor("c")
+            self.cache.qtcolor("a")
+
+        self.assertEqual(len(text_to_qtcolor.mock_calls), 4)
+
+    def test_clear(self):
+        with contextlib.ExitStack() as stack:
+            text_to_qtcolor = stack.enter_context(unittest.mock.patch(
+                "jabbercat.utils.text_to_qtcolor",
+                return_value=Qt.QColor(1, 2, 3),
+            ))
+
+            self.cache.qtcolor("a")
+            self.cache.clear()
+            self.cache.qtcolor("a")
+
+        self.assertEqual(len(text_to_qtcolor.mock_calls), 2)
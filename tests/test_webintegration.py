@@ -0,0 +1,185 @@
+import unittest
+import unittest.mock
+import urllib.parse
+
+import aioxmpp
+
+import jabbercat.avatar as avatar
+import jabbercat.webintegration as webintegration
+import jabbercat.Qt as Qt
+
+from aioxmpp.testutils import (
+    run_coroutine,
+)
+
+
+TEST_ACCOUNT_JID = aioxmpp.JID.fromstr("juliet@capulet.lit")
+TEST_JID1 = aioxmpp.JID.fromstr("romeo@montague.lit")
+TEST_JID2 = aioxmpp.JID.fromstr("mercutio@montague.lit")
+
+
+def make_pixmap(*args, **kwargs):
+    pixmap = Qt.QPixmap(4, 4)
+    pixmap.fill(Qt.QColor(255, 0, 0))
+    return pixmap
+
+
+class TestAvatarURLSchemeHandler(unittest.TestCase):
+    def setUp(self):
+        self.account = unittest.mock.sentinel.account
+        self.accounts = unittest.mock.Mock(["lookup_jid"])
+        self.accounts.lookup_jid.return_value = self.account
+        self.avatar_manager = unittest.mock.Mock(
+            spec=avatar.AvatarManager
+        )
+        self.avatar_manager.get_avatar_pixmap.side_effect = make_pixmap
+        self.handler = webintegration.AvatarURLSchemeHandler(
+            self.accounts,
+            self.avatar_manager,
+            cache_size=4,
+        )
+
+    def _render(self, peer=TEST_JID1, nickname=None, size=32.,
+                device_pixel_ratio=1.):
+        return self.handler._render_png(self.account, peer, nickname,
+                                        size, device_pixel_ratio)
+
+    def _request(self, **query):
+        request = unittest.mock.Mock(spec=Qt.QWebEngineUrlRequestJob)
+        request.requestUrl.return_value = Qt.QUrl(
+            "avatar:///?" + urllib.parse.urlencode(query)
+        )
+        run_coroutine(
+            webintegration.AvatarURLSchemeHandler.requestStarted.__wrapped__(
+                self.handler,
+                request,
+            )
+        )
+        return request
+
+    def test_connects_to_avatar_changes(self):
+        self.avatar_manager.on_avatar_changed.connect.assert_called_once_with(
+            self.handler._on_avatar_changed,
+        )
+
+    def test_parse_float_arg_returns_default_if_missing(self):
+        self.assertEqual(
+            self.handler._parse_float_arg({}, "size", 32., 256),
+            32.,
+        )
+
+    def test_parse_float_arg_parses_value(self):
+        self.assertEqual(
+            self.handler._parse_float_arg({"size": ["48.5"]}, "size",
+                                          32., 256),
+            48.5,
+        )
+
+    def test_parse_float_arg_accepts_maximum(self):
+        self.assertEqual(
+            self.handler._parse_float_arg({"dpr": ["8"]}, "dpr", 1., 8),
+            8.,
+        )
+
+    def test_parse_float_arg_rejects_invalid_values(self):
+        for value in [["0"], ["-1"], ["257"], ["nan"], ["inf"], ["foo"],
+                      ["1", "2"]]:
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    self.handler._parse_float_arg({"size": value}, "size",
+                                                  32., 256)
+
+    def test_render_png_renders_pixmap(self):
+        data = self._render(nickname="Romeo", size=48., device_pixel_ratio=2.)
+
+        self.avatar_manager.get_avatar_pixmap.assert_called_once_with(
+            self.account, TEST_JID1, 48., 2., "Romeo",
+        )
+        image = Qt.QImage.fromData(data, "PNG")
+        self.assertFalse(image.isNull())
+
+    def test_render_png_caches_result(self):
+        data1 = self._render()
+        data2 = self._render()
+
+        self.assertEqual(
+            len(self.avatar_manager.get_avatar_pixmap.mock_calls), 1,
+        )
+        self.assertEqual(data1, data2)
+
+    def test_render_png_caches_per_size_device_pixel_ratio_and_nick(self):
+        self._render(size=32.)
+        self._render(size=48.)
+        self._render(size=32., device_pixel_ratio=2.)
+        self._render(size=32., nickname="Romeo")
+        self._render(size=48.)
+
+        self.assertEqual(
+            len(self.avatar_manager.get_avatar_pixmap.mock_calls), 4,
+        )
+
+    def test_avatar_change_drops_cached_images_of_peer(self):
+        self._render(peer=TEST_JID1)
+        self._render(peer=TEST_JID2)
+        self.avatar_manager.get_avatar_pixmap.reset_mock()
+
+        self.handler._on_avatar_changed(self.account, TEST_JID1)
+        self._render(peer=TEST_JID1)
+        self._render(peer=TEST_JID2)
+
+        self.avatar_manager.get_avatar_pixmap.assert_called_once_with(
+            self.account, TEST_JID1, 32., 1., None,
+        )
+
+    def test_render_png_cache_is_bounded(self):
+        for i in range(5):
+            self._render(size=float(i + 1))
+        self.avatar_manager.get_avatar_pixmap.reset_mock()
+
+        self._render(size=1.)
+
+        self.assertEqual(
+            len(self.avatar_manager.get_avatar_pixmap.mock_calls), 1,
+        )
+        self.assertEqual(len(self.handler._png_cache), 4)
+
+    def test_request_passes_size_and_device_pixel_ratio(self):
+        with unittest.mock.patch.object(self.handler,
+                                        "_render_png") as render_png:
+            render_png.return_value = Qt.QByteArray(b"foo")
+            request = self._request(account=str(TEST_ACCOUNT_JID),
+                                    peer=str(TEST_JID1),
+                                    nick="Romeo",
+                                    size="48",
+                                    dpr="1.5")
+
+        self.accounts.lookup_jid.assert_called_once_with(TEST_ACCOUNT_JID)
+        render_png.assert_called_once_with(
+            self.account, TEST_JID1, "Romeo", 48., 1.5,
+        )
+        request.fail.assert_not_called()
+        self.assertEqual(len(request.reply.mock_calls), 1)
+
+    def test_request_uses_default_size_and_device_pixel_ratio(self):
+        with unittest.mock.patch.object(self.handler,
+                                        "_render_png") as render_png:
+            render_png.return_value = Qt.QByteArray(b"foo")
+            self._request(account=str(TEST_ACCOUNT_JID),
+                          peer=str(TEST_JID1))
+
+        render_png.assert_called_once_with(
+            self.account, TEST_JID1, None,
+            webintegration.AvatarURLSchemeHandler.DEFAULT_SIZE, 1.,
+        )
+
+    def test_request_rejects_out_of_range_size(self):
+        with unittest.mock.patch.object(self.handler,
+                                        "_render_png") as render_png:
+            request = self._request(account=str(TEST_ACCOUNT_JID),
+                                    peer=str(TEST_JID1),
+                                    size="1000")
+
+        render_png.assert_not_called()
+        request.fail.assert_called_once_with(
+            Qt.QWebEngineUrlRequestJob.UrlInvalid,
+        )
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Measure how long the roster filter takes to re-filter a large roster while
+a search text is typed into the magic bar.
+"""
+import asyncio
+import random
+import string
+import time
+import unittest.mock
+
+import PyQt5.Qt as Qt
+
+import aioxmpp
+
+import jclib.instrumentable_list
+import jclib.metadata
+
+import jabbercat.avatar
+import jabbercat.models as models
+
+
+class Item:
+    def __init__(self, account, address, label):
+        self.account = account
+        self.address = address
+        self.label = label
+        self.tags = []
+
+
+def random_word(rng, length):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(length))
+
+
+def make_roster(count, seed):
+    rng = random.Random(seed)
+    account = aioxmpp.JID.fromstr("bench@localhost")
+    roster = jclib.instrumentable_list.ModelList()
+    roster.extend(
+        Item(
+            account,
+            aioxmpp.JID(random_word(rng, 8), random_word(rng, 6) + ".example",
+                        None),
+            "{} {}".format(random_word(rng, 6).title(),
+                           random_word(rng, 9).title()),
+        )
+        for _ in range(count)
+    )
+    return roster
+
+
+def refilter(loop, model, text):
+    t0 = time.perf_counter()
+    model.filter_by_text = text
+    # the filter is applied on the next iteration of the event loop
+    loop.run_until_complete(asyncio.sleep(0))
+    nrows = model.rowCount(Qt.QModelIndex())
+    return time.perf_counter() - t0, nrows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n", "--count",
+        type=int,
+        default=20000,
+        help="Number of roster items (default: %(default)s)"
+    )
+    parser.add_argument(
+        "-r", "--repeat",
+        type=int,
+        default=5,
+        help="Number of times each query is typed (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "query",
+        nargs="?",
+        default="montague",
+        help="Text to type, one character at a time"
+    )
+
+    args = parser.parse_args()
+
+    app = Qt.QCoreApplication([])
+    loop = asyncio.get_event_loop()
+
+    roster = make_roster(args.count, args.seed)
+    roster_model = models.RosterModel(
+        roster,
+        unittest.mock.Mock(spec=jabbercat.avatar.AvatarManager),
+        unittest.mock.Mock(spec=jclib.metadata.MetadataFrontend),
+    )
+    filter_model = models.RosterFilterModel()
+    filter_model.setSourceModel(roster_model)
+    filter_model.tags_filter_model = models.CheckModel()
+    filter_model.tags_filter_model.setSourceModel(
+        models.TagsModel(jclib.instrumentable_list.ModelList())
+    )
+    # make sure the proxy has its mapping, as a view would
+    filter_model.rowCount(Qt.QModelIndex())
+
+    prefixes = [args.query[:i] for i in range(1, len(args.query) + 1)]
+
+    print("{} items, typing {!r}".format(args.count, args.query))
+    for round_ in range(args.repeat):
+        total = 0
+        for prefix in prefixes + [""]:
+            elapsed, nrows = refilter(loop, filter_model, prefix)
+            total += elapsed
+            if round_ == 0:
+                print("  {!r:>12}: {:8.2f} ms, {} rows".format(
+                    prefix, elapsed * 1000, nrows,
+                ))
+        print("round {}: {:8.2f} ms total, {:8.2f} ms per keystroke".format(
+            round_ + 1,
+            total * 1000,
+            total * 1000 / (len(prefixes) + 1),
+        ))